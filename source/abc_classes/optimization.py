@@ -19,5 +19,7 @@ class OptimizationProblem(ABC):
     def get_results(self, export: bool=True,
                     display: bool=True,
                     file_name: str="source/.results/results.txt",
-                    name_file_test: str=None) -> None:
+                    name_file_test: str=None,
+                    report: bool=False,
+                    results_file: str="source/.results/results.npz") -> None:
         ...
@@ -0,0 +1,145 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+from basics import powersystem, read_systems_files, readsystems, scenario_store
+from basics.powersystem import PowerSystemData
+from basics.profiling import Profiler
+from basics.readsystems import read_from_MATPOWER, read_from_ANAREDE
+
+
+# Bump when the bundle format changes. Changes to the code that parses, derives or stores the data are caught by
+# layout_fingerprint, so older bundles are never reused
+CACHE_VERSION = 2
+LAYOUT_MODULES = (powersystem, scenario_store, readsystems, read_systems_files)
+CACHE_DIR = "source/.cache"
+
+READERS = {".m": read_from_MATPOWER,
+           ".pwf": read_from_ANAREDE}
+
+
+def load_system(data_file: str,
+                power_base: float = 100,
+                max_ang_opening: float = 4*np.pi,
+                sce_file: str = None,
+                cache_dir: str = CACHE_DIR,
+                profiler: Profiler = None) -> PowerSystemData:
+    """Builds PowerSystemData from a case file, memory-mapping a compiled bundle when the file was seen before"""
+    profiler = Profiler() if profiler is None else profiler
+    key = case_key(data_file, power_base, max_ang_opening, sce_file)
+    bundle = os.path.join(cache_dir, key)
+    if os.path.isdir(bundle):
+        try:
+            with profiler.phase("load_cache"):
+                return load_bundle(bundle)["psd"]
+        except OSError:
+            # The scenario store the bundle refers to is gone
+            shutil.rmtree(bundle, ignore_errors=True)
+
+    with profiler.phase("read"):
+        system_data = _reader(data_file)(data_file)
+    with profiler.phase("build"):
+        psd = PowerSystemData(system_data=system_data,
+                              power_base=power_base,
+                              max_ang_opening=max_ang_opening,
+                              sce_file=sce_file)
+    with profiler.phase("save_cache"):
+        save_bundle(bundle, {"system_data": system_data, "psd": psd})
+    return psd
+
+def case_key(data_file: str, power_base: float, max_ang_opening: float, sce_file: str = None) -> str:
+    """Hash of everything the compiled data depends on: file contents, reader, parameters and cache version"""
+    digest = hashlib.sha256()
+    digest.update(repr((CACHE_VERSION, _reader(data_file).__name__, float(power_base), float(max_ang_opening))).encode())
+    digest.update(layout_fingerprint().encode())
+    for file_name in (data_file, sce_file):
+        if file_name is not None:
+            with open(file_name, "rb") as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def layout_fingerprint() -> str:
+    """Hash of the source of the modules that read, build and store the cached objects, this one included"""
+    digest = hashlib.sha256()
+    for module in LAYOUT_MODULES + (sys.modules[__name__],):
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+def _reader(data_file: str):
+    extension = os.path.splitext(data_file)[1].lower()
+    if extension not in READERS:
+        raise ValueError("No reader for {} files".format(extension))
+    return READERS[extension]
+
+def save_bundle(bundle: str, content: dict) -> None:
+    """Stores arrays as raw .npy files and everything else in a JSON manifest, then moves the bundle in place at once"""
+    os.makedirs(os.path.dirname(bundle) or ".", exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(bundle) or ".")
+    arrays = dict()  # id -> file name, so arrays shared between objects stay shared
+    manifest = _encode(content, tmp, arrays)
+    with open(os.path.join(tmp, "manifest.json"), "w") as file:
+        json.dump({"version": CACHE_VERSION, "content": manifest}, file)
+    try:
+        os.rename(tmp, bundle)
+    except OSError:
+        # Another process stored the same bundle first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def load_bundle(bundle: str) -> dict:
+    """Loads a bundle, memory-mapping its arrays copy-on-write so callers may modify them freely"""
+    with open(os.path.join(bundle, "manifest.json")) as file:
+        manifest = json.load(file)
+    if manifest["version"] != CACHE_VERSION:
+        raise ValueError("Case bundle {} has version {}".format(bundle, manifest["version"]))
+    return _decode(manifest["content"], bundle, dict())
+
+def _encode(value, bundle: str, arrays: dict):
+    if isinstance(value, np.ndarray):
+        if id(value) not in arrays:
+            arrays[id(value)] = "{}.npy".format(len(arrays))
+            np.save(os.path.join(bundle, arrays[id(value)]), value, allow_pickle=False)
+        return {"array": arrays[id(value)], "size": value.size}
+    if isinstance(value, np.generic):
+        return {"scalar": value.dtype.str, "value": value.item()}
+    if isinstance(value, dict):
+        return {"dict": {k: _encode(v, bundle, arrays) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {type(value).__name__: [_encode(v, bundle, arrays) for v in value]}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return {"value": value}
+    if type(value).__module__ == powersystem.__name__:
+        # Objects are stored as they pickle: ScenariosData keeps a reference to its store, not a copy of the series
+        state = value.__getstate__() if "__getstate__" in vars(type(value)) else vars(value)
+        return {"object": type(value).__name__, "attrs": _encode(state, bundle, arrays)["dict"]}
+    raise TypeError("Cannot store {} in a case bundle".format(type(value).__name__))
+
+def _decode(item: dict, bundle: str, arrays: dict):
+    if "array" in item:
+        if item["array"] not in arrays:
+            # Empty arrays cannot be memory-mapped
+            mmap_mode = "c" if item["size"] > 0 else None
+            arrays[item["array"]] = np.load(os.path.join(bundle, item["array"]), mmap_mode=mmap_mode)
+        return arrays[item["array"]]
+    if "scalar" in item:
+        return np.dtype(item["scalar"]).type(item["value"])
+    if "dict" in item:
+        return {k: _decode(v, bundle, arrays) for k, v in item["dict"].items()}
+    if "list" in item:
+        return [_decode(v, bundle, arrays) for v in item["list"]]
+    if "tuple" in item:
+        return tuple(_decode(v, bundle, arrays) for v in item["tuple"])
+    if "object" in item:
+        value = object.__new__(getattr(powersystem, item["object"]))
+        state = {k: _decode(v, bundle, arrays) for k, v in item["attrs"].items()}
+        if "__setstate__" in vars(type(value)):
+            value.__setstate__(state)
+        else:
+            value.__dict__.update(state)
+        return value
+    return item["value"]
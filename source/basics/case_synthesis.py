@@ -0,0 +1,132 @@
+import numpy as np
+
+
+# Defaults for the data original MATPOWER cases do not carry
+DEFAULT_COST = 20  # $/MWh, when a case has no positive marginal cost
+CANDIDATE_COST = 1e6
+LINE_FAILURE_RATE = 0.5  # failures/yr
+LINE_REPAIR_TIME = 10  # h
+GEN_FOR = 0.05
+
+
+def synthesize_case(system_data: dict, n_candidates: int = 0, reliability: bool = False) -> dict:
+    """Adapts a case in the original MATPOWER format to the system_data layout PowerSystemData reads.
+
+    Out-of-service generators and branches are dropped, along with buses left without branches; the remaining buses are
+    renumbered 1..n. Negative loads, which the models cannot represent, are set to zero and every bus is placed in area 0.
+    Every generator gets its own gencost row, whose operating cost is the marginal cost of the original polynomial at
+    half its capacity. Optionally, n_candidates existing corridors are offered as expansion candidates and failure data
+    is added for reliability studies.
+    """
+    bus = np.array(system_data["bus"], dtype=float)
+    gen = np.array(system_data["gen"], dtype=float)
+    branch = np.array(system_data["branch"], dtype=float)
+    gencost = np.array(system_data["gencost"], dtype=float)[:len(gen)]  # Reactive costs, when present, follow
+
+    in_service = gen[:, 7] > 0
+    gen = gen[in_service]
+    gencost = gencost[in_service]
+    branch = branch[branch[:, 10] > 0]
+
+    # Buses are indexed by position, so numbers are mapped to 1..n
+    position = np.zeros(int(bus[:, 0].max())+1, dtype=int)
+    position[bus[:, 0].astype(int)] = np.arange(1, len(bus)+1)
+    connected = np.zeros(len(bus)+1, dtype=bool)
+    connected[position[branch[:, 0].astype(int)]] = True
+    connected[position[branch[:, 1].astype(int)]] = True
+    kept = connected[position[bus[:, 0].astype(int)]] & (bus[:, 1] != 4)
+    gen_kept = kept[position[gen[:, 0].astype(int)]-1]
+    gen = gen[gen_kept]
+    gencost = gencost[gen_kept]
+    position[bus[kept, 0].astype(int)] = np.arange(1, np.sum(kept)+1)
+    bus = bus[kept]
+
+    new_bus = np.zeros((len(bus), 13))
+    new_bus[:] = bus[:, :13]
+    new_bus[:, 0] = np.arange(1, len(bus)+1)
+    new_bus[:, 2] = np.maximum(bus[:, 2], 0)  # Negative loads would get shedding bounds with no feasible value
+    new_bus[:, 8] = 0  # Column 8 (the MATPOWER angle) holds the area, all buses follow the first scenario series
+
+    new_gen = np.zeros((len(gen), 22))
+    new_gen[:, :21] = gen[:, :21]
+    new_gen[:, 0] = position[gen[:, 0].astype(int)]
+    new_gen[:, 21] = np.arange(1, len(gen)+1)  # One generator type per generator
+
+    new_branch = np.zeros((len(branch), 13))
+    new_branch[:] = branch[:, :13]
+    new_branch[:, 0] = position[branch[:, 0].astype(int)]
+    new_branch[:, 1] = position[branch[:, 1].astype(int)]
+
+    # gencost columns: type, investment cost, operating cost, carbon, ramp, series (-1: none)
+    cost = marginal_cost(gencost, 0.5*gen[:, 8])
+    if not np.any(cost > 0):
+        cost = np.full(len(gen), DEFAULT_COST)
+    new_gencost = np.zeros((len(gen), 6))
+    new_gencost[:, 0] = np.arange(1, len(gen)+1)
+    new_gencost[:, 2] = np.maximum(cost, 0)
+    new_gencost[:, 5] = -1
+
+    adapted = {"bus": new_bus,
+               "gen": new_gen,
+               "branch": new_branch,
+               "gencost": new_gencost,
+               "c02tax": np.zeros((1, 1))}
+
+    if n_candidates > 0:
+        # Evenly spread corridors, each allowing one new circuit
+        picks = np.linspace(0, len(new_branch)-1, min(n_candidates, len(new_branch))).astype(int)
+        adapted["xbranch"] = np.column_stack((new_branch[picks],
+                                              np.ones(len(picks)),
+                                              np.full(len(picks), CANDIDATE_COST)))
+
+    if reliability:
+        adapted["branch"] = np.column_stack((new_branch,
+                                             np.full(len(new_branch), LINE_FAILURE_RATE),
+                                             np.full(len(new_branch), LINE_REPAIR_TIME)))
+        adapted["gencost"] = np.column_stack((new_gencost, np.full(len(gen), GEN_FOR)))
+    return adapted
+
+def synthesize_contingencies(chgtab: np.ndarray, system_data: dict, ebranch=None) -> list:
+    """Branch outages of a MATPOWER change table on system_data, as rows of the branch matrix synthesize_case returns.
+
+    Changes sharing a label form one contingency. Only branch status changes to 0 are read: generator outages and other
+    changes are left out, as are branches synthesize_case drops and contingencies left without branches. Given the
+    ebranch built from that matrix, rows are mapped to the ebranch indices OPFSCOPF takes, one entry per circuit.
+    """
+    in_service = np.array(system_data["branch"], dtype=float)[:, 10] > 0
+    new_row = np.where(in_service, np.cumsum(in_service)-1, -1)
+    if ebranch is not None:
+        new_row[in_service] = ebranch.row_branch[new_row[in_service]]
+    return branch_outages(chgtab, new_row)
+
+def branch_outages(chgtab: np.ndarray, branch_of_row: np.ndarray) -> list:
+    """Branch outages of a MATPOWER change table, the changed rows mapped through branch_of_row (-1: left out)"""
+    # CT_TBRCH rows setting BR_STATUS to 0 (CT_REP)
+    outage = (chgtab[:, 2] == 3) & (chgtab[:, 4] == 11) & (chgtab[:, 5] == 1) & (chgtab[:, 6] == 0)
+    _, first, inverse = np.unique(chgtab[:, 0], return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    branch_only = np.bincount(inverse, weights=~outage, minlength=len(first)) == 0
+    rows = np.where(outage, branch_of_row[np.where(outage, chgtab[:, 3].astype(int)-1, 0)], -1)
+    kept = branch_only[inverse] & (rows >= 0)
+
+    # Contingencies in the order of their first change
+    group = np.argsort(np.argsort(first))[inverse][kept]
+    order = np.argsort(group, kind="stable")
+    if len(order) == 0:
+        return []
+    return np.split(rows[kept][order], np.flatnonzero(np.diff(group[order]))+1)
+
+def marginal_cost(gencost: np.ndarray, pg: np.ndarray) -> np.ndarray:
+    """Marginal cost ($/MWh) of polynomial (model 2) or piecewise linear (model 1) MATPOWER costs at pg MW"""
+    cost = np.zeros(len(gencost))
+    for i, row in enumerate(gencost):
+        n = int(row[3])
+        if row[0] == 2:
+            coefs = row[4:4+n]  # Highest order first
+            cost[i] = np.polyval(np.polyder(coefs), pg[i]) if n > 1 else 0
+        elif row[0] == 1:
+            points = row[4:4+2*n].reshape(n, 2)
+            slopes = np.diff(points[:, 1]) / np.where(np.diff(points[:, 0]) == 0, 1, np.diff(points[:, 0]))
+            segment = np.searchsorted(points[1:-1, 0], pg[i])
+            cost[i] = slopes[segment] if len(slopes) > 0 else 0
+    return cost
@@ -0,0 +1,215 @@
+import numpy as np
+import scipy.sparse as sp
+import highspy
+from basics.profiling import Profiler
+
+
+class MatrixModel:
+    """Class to assemble a LP/MILP in matrix form and solve it with HiGHS"""
+    def __init__(self, profiler: Profiler = None) -> None:
+        self.profiler = Profiler() if profiler is None else profiler
+
+        # Variables
+        self.var_idx = dict()
+        self.col_lower = np.zeros(0)
+        self.col_upper = np.zeros(0)
+        self.col_cost = np.zeros(0)
+        self.col_integer = np.zeros(0, dtype=bool)
+
+        # Constraints
+        self.con_idx = dict()
+        self.row_lower = np.zeros(0)
+        self.row_upper = np.zeros(0)
+        self.a_rows = []
+        self.a_cols = []
+        self.a_vals = []
+
+        # Solver
+        self.highs = None
+        self.col_value = None
+        self.objective = None
+        self.status = None
+
+    @property
+    def optimal(self) -> bool:
+        return self.status == highspy.HighsModelStatus.kOptimal
+
+    @property
+    def num_col(self) -> int:
+        return len(self.col_cost)
+
+    @property
+    def num_row(self) -> int:
+        return len(self.row_lower)
+
+    def add_var(self,
+                name: str,
+                size: int,
+                lb: np.ndarray = -np.inf,
+                ub: np.ndarray = +np.inf,
+                cost: np.ndarray = 0,
+                integer: bool = False) -> np.ndarray:
+        idx = np.arange(self.num_col, self.num_col+size)
+        self.var_idx[name] = idx
+        self.col_lower = np.concatenate((self.col_lower, np.broadcast_to(lb, size)))
+        self.col_upper = np.concatenate((self.col_upper, np.broadcast_to(ub, size)))
+        self.col_cost = np.concatenate((self.col_cost, np.broadcast_to(cost, size)))
+        self.col_integer = np.concatenate((self.col_integer, np.full(size, integer)))
+        return idx
+
+    def add_con(self,
+                name: str,
+                size: int,
+                lb: np.ndarray = -np.inf,
+                ub: np.ndarray = +np.inf) -> np.ndarray:
+        idx = np.arange(self.num_row, self.num_row+size)
+        # Adding to an existing constraint appends rows to it
+        self.con_idx[name] = np.concatenate((self.con_idx[name], idx)) if name in self.con_idx else idx
+        self.row_lower = np.concatenate((self.row_lower, np.broadcast_to(lb, size)))
+        self.row_upper = np.concatenate((self.row_upper, np.broadcast_to(ub, size)))
+        return idx
+
+    def add_terms(self,
+                  con: str,
+                  rows: np.ndarray,
+                  var: str,
+                  cols: np.ndarray,
+                  vals: np.ndarray = 1) -> None:
+        """Adds vals*var[cols] to the constraints con[rows]"""
+        rows = np.asarray(rows)
+        self.a_rows.append(self.con_idx[con][rows])
+        self.a_cols.append(self.var_idx[var][np.broadcast_to(cols, rows.shape)])
+        self.a_vals.append(np.broadcast_to(vals, rows.shape).astype(float))
+
+    def set_var_bounds(self, var: str, lb: np.ndarray, ub: np.ndarray, cols: np.ndarray = None) -> None:
+        idx = self.var_idx[var] if cols is None else self.var_idx[var][cols]
+        self.col_lower[idx] = lb
+        self.col_upper[idx] = ub
+        if self.highs is not None:
+            self.highs.changeColsBounds(len(idx), idx.astype(np.int32),
+                                        self.col_lower[idx], self.col_upper[idx])
+
+    def set_con_bounds(self, con: str, lb: np.ndarray, ub: np.ndarray, rows: np.ndarray = None) -> None:
+        idx = self.con_idx[con] if rows is None else self.con_idx[con][rows]
+        self.row_lower[idx] = lb
+        self.row_upper[idx] = ub
+        if self.highs is not None:
+            self.highs.changeRowsBounds(len(idx), idx.astype(np.int32),
+                                        self.row_lower[idx], self.row_upper[idx])
+
+    def set_coef(self, con: str, rows: np.ndarray, var: str, cols: np.ndarray, vals: np.ndarray) -> None:
+        """Replaces the coefficients of var[cols] in the constraints con[rows]"""
+        if self.highs is None:
+            self._pass_model()
+        rows = self.con_idx[con][rows]
+        cols = self.var_idx[var][np.broadcast_to(cols, rows.shape)]
+        vals = np.broadcast_to(vals, rows.shape).astype(float)
+        # HiGHS changes one coefficient per call: plain Python numbers avoid a conversion per call
+        for row, col, val in zip(rows.tolist(), cols.tolist(), vals.tolist()):
+            self.highs.changeCoeff(row, col, val)
+
+    def replace_terms(self, con: str, terms: list) -> None:
+        """Replaces every coefficient of the constraints con by terms, (rows, var, cols, vals) tuples as for add_terms.
+
+        The rows of con are deleted and added again after all others in one block, which HiGHS does in bulk where
+        set_coef takes a call per coefficient. Constraints keep their names and row order, only their indices change.
+        """
+        if self.highs is not None and self.num_row > self.highs.getNumRow():
+            self._add_rows()
+        moved = self.con_idx[con]
+        kept = np.ones(self.num_row, dtype=bool)
+        kept[moved] = False
+        new_idx = np.empty(self.num_row, dtype=int)
+        new_idx[kept] = np.arange(np.sum(kept))
+        new_idx[moved] = np.sum(kept)+np.arange(len(moved))
+
+        # Terms of the other constraints follow their rows
+        rows = np.concatenate(self.a_rows) if self.a_rows else np.zeros(0, dtype=int)
+        cols = np.concatenate(self.a_cols) if self.a_cols else np.zeros(0, dtype=int)
+        vals = np.concatenate(self.a_vals) if self.a_vals else np.zeros(0)
+        other = kept[rows]
+        self.a_rows = [new_idx[rows[other]]]
+        self.a_cols = [cols[other]]
+        self.a_vals = [vals[other]]
+        order = np.argsort(new_idx)
+        self.row_lower = self.row_lower[order]
+        self.row_upper = self.row_upper[order]
+        self.con_idx = {name: new_idx[idx] for name, idx in self.con_idx.items()}
+        for rows, var, cols, vals in terms:
+            self.add_terms(con, rows, var, cols, vals)
+
+        if self.highs is not None:
+            self.highs.deleteRows(len(moved), np.sort(moved).astype(np.int32))
+            self.n_terms_passed = 1
+            self._add_rows()
+
+    def matrix(self) -> sp.csc_matrix:
+        rows = np.concatenate(self.a_rows) if self.a_rows else np.zeros(0, dtype=int)
+        cols = np.concatenate(self.a_cols) if self.a_cols else np.zeros(0, dtype=int)
+        vals = np.concatenate(self.a_vals) if self.a_vals else np.zeros(0)
+        return sp.csc_matrix((vals, (rows, cols)), shape=(self.num_row, self.num_col))
+
+    def _pass_model(self) -> None:
+        a = self.matrix()
+        self.n_terms_passed = len(self.a_rows)
+
+        lp = highspy.HighsLp()
+        lp.num_col_ = self.num_col
+        lp.num_row_ = self.num_row
+        lp.col_cost_ = self.col_cost
+        lp.col_lower_ = np.where(np.isinf(self.col_lower), -highspy.kHighsInf, self.col_lower)
+        lp.col_upper_ = np.where(np.isinf(self.col_upper), +highspy.kHighsInf, self.col_upper)
+        lp.row_lower_ = np.where(np.isinf(self.row_lower), -highspy.kHighsInf, self.row_lower)
+        lp.row_upper_ = np.where(np.isinf(self.row_upper), +highspy.kHighsInf, self.row_upper)
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = a.indptr
+        lp.a_matrix_.index_ = a.indices
+        lp.a_matrix_.value_ = a.data
+        if np.any(self.col_integer):
+            lp.integrality_ = [highspy.HighsVarType.kInteger if is_int else highspy.HighsVarType.kContinuous
+                               for is_int in self.col_integer]
+
+        self.highs = highspy.Highs()
+        self.highs.setOptionValue("output_flag", False)
+        if not np.any(self.col_integer):
+            # Re-solves after bound/coefficient changes start from the previous optimal basis
+            self.highs.setOptionValue("solver", "simplex")
+            self.highs.setOptionValue("simplex_strategy", 1)  # Dual simplex
+        self.highs.passModel(lp)
+
+    def _add_rows(self) -> None:
+        """Passes the rows added since the model was passed to HiGHS, which keeps its basis"""
+        first = self.highs.getNumRow()
+        rows = np.concatenate(self.a_rows[self.n_terms_passed:]) if len(self.a_rows) > self.n_terms_passed else np.zeros(0, dtype=int)
+        cols = np.concatenate(self.a_cols[self.n_terms_passed:]) if len(self.a_cols) > self.n_terms_passed else np.zeros(0, dtype=int)
+        vals = np.concatenate(self.a_vals[self.n_terms_passed:]) if len(self.a_vals) > self.n_terms_passed else np.zeros(0)
+        if np.any(rows < first):
+            raise ValueError("Only terms of new rows can be added after the model is passed to HiGHS")
+        self.n_terms_passed = len(self.a_rows)
+
+        a = sp.csr_matrix((vals, (rows-first, cols)), shape=(self.num_row-first, self.num_col))
+        lower = self.row_lower[first:]
+        upper = self.row_upper[first:]
+        self.highs.addRows(self.num_row-first,
+                           np.where(np.isinf(lower), -highspy.kHighsInf, lower),
+                           np.where(np.isinf(upper), +highspy.kHighsInf, upper),
+                           a.nnz, a.indptr[:-1].astype(np.int32), a.indices.astype(np.int32), a.data)
+
+    def solve(self) -> None:
+        if self.highs is None:
+            with self.profiler.phase("write"):
+                self._pass_model()
+        elif self.num_row > self.highs.getNumRow():
+            with self.profiler.phase("write"):
+                self._add_rows()
+        with self.profiler.phase("solve"):
+            self.highs.run()
+
+        with self.profiler.phase("load"):
+            self.status = self.highs.getModelStatus()
+            self.col_value = np.array(self.highs.getSolution().col_value)
+            self.col_value[self.col_integer] = np.round(self.col_value[self.col_integer])
+            self.objective = self.highs.getInfo().objective_function_value
+
+    def value(self, var: str) -> np.ndarray:
+        return self.col_value[self.var_idx[var]]
@@ -1,4 +1,6 @@
 import numpy as np
+from basics.scenario_store import STORE_DIR, store_file_of, open_store
+from basics.scenario_reduction import reduce_scenarios
 
 class PowerSystemData:
     """Class to construct Power System Raw Data"""
@@ -42,38 +44,50 @@ class PowerSystemData:
             self.find_isolated_buses()
             if np.any(self.bus.is_isolated):
                 raise UserWarning("Buses {} are impossible to be connected!!!".format(np.where(self.bus.is_isolated)[0]))
+
+        # Bus incidence structures
+        self.build_incidence()
         
+    def build_incidence(self) -> None:
+        self.incidence = IncidenceData(self)
+
     def find_isolated_buses(self) -> None:
-        for b in np.where(self.bus.is_isolated)[0]:
-            for k in self.ebranch.set_all:
-                if b in {self.ebranch.bus_fr[k], self.ebranch.bus_to[k]}:
-                    self.bus.is_isolated[b] = False
-                    break
+        self.bus.is_isolated[self.ebranch.bus_fr] = False
+        self.bus.is_isolated[self.ebranch.bus_to] = False
     
     def create_dumb_grid(self) -> None:
-        for b in np.where(self.bus.is_isolated)[0]:
-            for k in self.xbranch.set_all:
-                if b in {self.xbranch.bus_fr[k], self.xbranch.bus_to[k]}:
-                    self.create_dumb_line(self.xbranch.bus_fr[k], self.xbranch.bus_to[k])
+        # (isolated bus, candidate branch) pairs, sorted by bus and then by branch
+        bus_k = np.concatenate((self.xbranch.bus_fr, self.xbranch.bus_to))
+        set_k = np.concatenate((self.xbranch.set_all, self.xbranch.set_all))
+        at_isolated = self.bus.is_isolated[bus_k]
+        pairs = np.unique(np.stack((bus_k[at_isolated], set_k[at_isolated]), axis=1), axis=0)
+
+        ks = pairs[:, 1]
+        self.create_dumb_lines(self.xbranch.bus_fr[ks], self.xbranch.bus_to[ks])
                     
     
-    def create_dumb_line(self, bus_fr: int, bus_to: int) -> None:
-        self.ebranch.is_dumb = np.append(self.ebranch.is_dumb, True)
-        self.ebranch.bus_fr = np.append(self.ebranch.bus_fr, bus_fr)
-        self.ebranch.bus_to = np.append(self.ebranch.bus_to, bus_to)
-        self.ebranch.r = np.append(self.ebranch.r, 0)
-        self.ebranch.x = np.append(self.ebranch.x, 1/self.ebranch.b_dumb)
-        self.ebranch.b_shunt = np.append(self.ebranch.b_shunt, 0)
-        self.ebranch.g = np.append(self.ebranch.g, 0)
-        self.ebranch.b = np.append(self.ebranch.b, self.ebranch.b_dumb)
-        self.ebranch.b_lin = np.append(self.ebranch.b_lin, self.ebranch.b_dumb)
-        self.ebranch.unlimited_branches = np.append(self.ebranch.unlimited_branches, False)
-        self.ebranch.flow_max_MW = np.append(self.ebranch.flow_max_MW, 0)
-        self.ebranch.flow_max = np.append(self.ebranch.flow_max, self.ebranch.flow_max_dumb)
-        self.ebranch.tap = np.append(self.ebranch.tap, 1)
-        self.ebranch.bigM = np.append(self.ebranch.bigM, self.ebranch.bigM_dumb)
-        self.ebranch.set_all = np.append(self.ebranch.set_all, self.ebranch.len)
-        self.ebranch.len += 1
+    def create_dumb_lines(self, bus_fr: np.ndarray, bus_to: np.ndarray) -> None:
+        ndumb = len(bus_fr)
+        if ndumb == 0:
+            return
+        zeros = np.zeros(ndumb)
+        ones = np.ones(ndumb)
+        self.ebranch.is_dumb = np.concatenate((self.ebranch.is_dumb, np.ones(ndumb, dtype=bool)))
+        self.ebranch.bus_fr = np.concatenate((self.ebranch.bus_fr, bus_fr))
+        self.ebranch.bus_to = np.concatenate((self.ebranch.bus_to, bus_to))
+        self.ebranch.r = np.concatenate((self.ebranch.r, zeros))
+        self.ebranch.x = np.concatenate((self.ebranch.x, ones/self.ebranch.b_dumb))
+        self.ebranch.b_shunt = np.concatenate((self.ebranch.b_shunt, zeros))
+        self.ebranch.g = np.concatenate((self.ebranch.g, zeros))
+        self.ebranch.b = np.concatenate((self.ebranch.b, self.ebranch.b_dumb*ones))
+        self.ebranch.b_lin = np.concatenate((self.ebranch.b_lin, self.ebranch.b_dumb*ones))
+        self.ebranch.unlimited_branches = np.concatenate((self.ebranch.unlimited_branches, np.zeros(ndumb, dtype=bool)))
+        self.ebranch.flow_max_MW = np.concatenate((self.ebranch.flow_max_MW, zeros))
+        self.ebranch.flow_max = np.concatenate((self.ebranch.flow_max, self.ebranch.flow_max_dumb*ones))
+        self.ebranch.tap = np.concatenate((self.ebranch.tap, ones))
+        self.ebranch.bigM = np.concatenate((self.ebranch.bigM, self.ebranch.bigM_dumb*ones))
+        self.ebranch.len += ndumb
+        self.ebranch.set_all = np.arange(self.ebranch.len)
 
 class BusData:
     """Class to load bus data"""
@@ -93,6 +107,7 @@ class BusData:
         self.set_all = np.arange(self.len)
         self.set_with_demand = np.where(self.pd_max > 0)[0]
         self.len_with_demand = len(self.set_with_demand)
+        self.has_demand = self.pd_max > 0
 
         # Initializing isolated buses
         self.is_isolated = np.ones(self.len, dtype=bool)
@@ -105,6 +120,7 @@ class BusData:
     
     def define_all_as_demand(self):
         self.set_with_demand = np.copy(self.set_all)
+        self.has_demand = np.ones(self.len, dtype=bool)
 
     def define_all_areas_as_zero(self):
         self.area = np.zeros_like(self.area)
@@ -179,18 +195,15 @@ class BranchData:
         raise NotImplementedError()
     
     def _remove_repeated_lines(self) -> None:
-        # Finding unique lines
-        self.unique_lines = np.ones(self.len, dtype=bool)
-        self.nlines = np.ones(self.len, dtype=int)
-        for k1 in range(self.len):
-            fr1 = self.bus_fr[k1]
-            to1 = self.bus_to[k1]
-            if not self.unique_lines[k1]:
-                continue
-            for k2 in range(k1+1, self.len):
-                if self.bus_fr[k2] == fr1 and self.bus_to[k2] == to1:
-                    self.unique_lines[k2] = False
-                    self.nlines[k1] += 1
+        # Finding unique lines: parallel circuits are grouped by (bus_fr, bus_to)
+        key = self.bus_fr.astype(np.int64) * (np.max(self.bus_to, initial=0)+1) + self.bus_to
+        _, first, inverse, counts = np.unique(key, return_index=True, return_inverse=True, return_counts=True)
+        self.unique_lines = np.zeros(self.len, dtype=bool)
+        self.unique_lines[first] = True
+        self.nlines = counts[inverse.reshape(-1)]
+
+        # Branch of each data row: parallel circuits share the branch of their first row
+        self.row_branch = (np.cumsum(self.unique_lines)-1)[first[inverse.reshape(-1)]]
         
         if np.all(self.unique_lines):
             return
@@ -213,8 +226,8 @@ class XBranchData(BranchData):
             self.invT_max = system_data[data_key][:, 13][self.unique_lines].astype(int)
             self.invT_cost = system_data[data_key][:, 14][self.unique_lines]
         else:
-            self.invT_max = 3*np.ones(self.len)
-            self.invT_cost = 1e6
+            self.invT_max = 3*np.ones(self.len, dtype=int)
+            self.invT_cost = 1e6*np.ones(self.len)
         
         del self.unique_lines
 
@@ -222,42 +235,50 @@ class XBranchData(BranchData):
 class XBranchBin:
     def __init__(self, xbranch: BranchData) -> None:
         
+        # Each candidate k is repeated invT_max[k] times
+        idx = np.repeat(xbranch.set_all, xbranch.invT_max)
+
         # Misc
-        self.len = sum(xbranch.invT_max)
+        self.len = len(idx)
         self.set_all = np.arange(self.len)
 
         # Data for binary models
-        self.bus_fr = np.zeros(self.len, dtype=int)  # From bus number
-        self.bus_to = np.zeros(self.len, dtype=int)  # To bus number
-
-        self.r = np.zeros(self.len, dtype=float)
-        self.x = np.zeros(self.len, dtype=float)
-        self.b_shunt = np.zeros(self.len, dtype=float)
-        self.g = np.zeros(self.len, dtype=float)
-        self.b = np.zeros(self.len, dtype=float)
-        self.b_lin = np.zeros(self.len, dtype=float)
-        self.flow_max = np.zeros(self.len, dtype=float)
-        self.tap = np.zeros(self.len, dtype=float)
-        self.bigM = np.zeros(self.len, dtype=float)
-        self.invT_cost = np.zeros(self.len, dtype=float)
-
-        idx = 0
-        for k in xbranch.set_all:
-            for _ in range(xbranch.invT_max[k]):
-                self.bus_fr[idx] = xbranch.bus_fr[k]  # From bus number
-                self.bus_to[idx] = xbranch.bus_to[k]  # To bus number
-                self.r[idx] = xbranch.r[k]
-                self.x[idx] = xbranch.x[k]
-                self.b_shunt[idx] = xbranch.b_shunt[k]
-                self.g[idx] = xbranch.g[k]
-                self.b[idx] = xbranch.b[k]
-                self.b_lin[idx] = xbranch.b_lin[k]
-                self.flow_max[idx] = xbranch.flow_max[k]
-                self.tap[idx] = xbranch.tap[k]
-                self.bigM[idx] = xbranch.bigM[k]
-                self.invT_cost[idx] = xbranch.invT_cost[k]
-
-                idx += 1
+        self.bus_fr = xbranch.bus_fr[idx]  # From bus number
+        self.bus_to = xbranch.bus_to[idx]  # To bus number
+
+        self.r = xbranch.r[idx]
+        self.x = xbranch.x[idx]
+        self.b_shunt = xbranch.b_shunt[idx]
+        self.g = xbranch.g[idx]
+        self.b = xbranch.b[idx]
+        self.b_lin = xbranch.b_lin[idx]
+        self.flow_max = xbranch.flow_max[idx]
+        self.tap = xbranch.tap[idx]
+        self.bigM = xbranch.bigM[idx]
+        self.invT_cost = xbranch.invT_cost[idx]
+
+
+class Incidence:
+    """CSR index from each bus to the elements connected to it"""
+    def __init__(self, element_bus: np.ndarray, nbus: int) -> None:
+        # Stable sort keeps the elements of each bus in ascending order
+        self.indices = np.argsort(element_bus, kind="stable")
+        self.indptr = np.searchsorted(element_bus[self.indices], np.arange(nbus+1))
+
+    def __getitem__(self, b: int) -> np.ndarray:
+        return self.indices[self.indptr[b]:self.indptr[b+1]]
+
+
+class IncidenceData:
+    """Class to build bus incidence structures"""
+    def __init__(self, psd: PowerSystemData) -> None:
+        nbus = psd.bus.len
+        self.ebranch_fr = Incidence(psd.ebranch.bus_fr, nbus)  # Branches leaving each bus
+        self.ebranch_to = Incidence(psd.ebranch.bus_to, nbus)  # Branches arriving at each bus
+        self.gen = Incidence(psd.gen.bus, nbus)  # Generators at each bus
+        if hasattr(psd, "xbranch_bin"):
+            self.xbranch_bin_fr = Incidence(psd.xbranch_bin.bus_fr, nbus)  # Candidate circuits leaving each bus
+            self.xbranch_bin_to = Incidence(psd.xbranch_bin.bus_to, nbus)  # Candidate circuits arriving at each bus
 
 
 class GeneratorsData:
@@ -285,21 +306,17 @@ class GeneratorsData:
         self.set_all = np.arange(self.len)
 
         # Generation cost
-        self.cost = np.zeros(self.len)
-        self.FOR = np.zeros(self.len)
-        self.serie = np.zeros(self.len, dtype=int)
+        cost_idx = self.type-1
         co2tax = system_data["c02tax"][0, 0]
-        for gen_idx in self.set_all:
-            cost_idx = self.type[gen_idx]-1
-            opecost = system_data["gencost"][cost_idx, 2]
-            co2prod = system_data["gencost"][cost_idx, 3]
-            self.cost[gen_idx] = opecost + co2prod*co2tax
-            self.serie[gen_idx] = system_data["gencost"][cost_idx, 5].astype(int)
-        
+        opecost = system_data["gencost"][cost_idx, 2]
+        co2prod = system_data["gencost"][cost_idx, 3]
+        self.cost = opecost + co2prod*co2tax
+        self.serie = system_data["gencost"][cost_idx, 5].astype(int)
         
-            # Reliability Data
-            if np.shape(system_data["gencost"])[1] == 7:
-                self.FOR[gen_idx] = system_data["gencost"][cost_idx, 6]
+        # Reliability Data
+        self.FOR = np.zeros(self.len)
+        if np.shape(system_data["gencost"])[1] == 7:
+            self.FOR = system_data["gencost"][cost_idx, 6]
     
     def set_new(self):
         raise NotImplementedError()
@@ -308,10 +325,52 @@ class GeneratorsData:
         raise NotImplementedError()
     
 class ScenariosData:
-    def __init__(self, sce_file) -> None:
-        self.data = np.genfromtxt(sce_file, delimiter=",")
+    """Class to access scenario series memory-mapped from their binary store"""
+    def __init__(self, sce_file: str, store_dir: str = STORE_DIR) -> None:
+        self.store_file = store_file_of(sce_file, store_dir)
+        self.data, header = open_store(self.store_file)
+        self.weight_col = header["weight"]
 
         # Misc
         (self.len_obs, self.len_series) = np.shape(self.data)
         self.set_obs = np.arange(self.len_obs)
-        self.set_series = np.arange(self.len_series)
\ No newline at end of file
+        self.set_series = np.arange(self.len_series)
+
+    def windows(self, size: int):
+        """Yields (observations, data rows) in consecutive windows of at most size observations"""
+        if size <= 0:
+            raise ValueError("Window size must be positive")
+        for start in range(0, self.len_obs, size):
+            stop = min(start+size, self.len_obs)
+            yield self.set_obs[start:stop], self.data[start:stop]
+
+    def reduce(self, n_scenarios: int, method: str = "kmeans", seed: int = 0):
+        """Representative scenarios ("kmeans", "kmedoids" or "forward" selection) weighted by the observations they stand for"""
+        reduced, labels = reduce_scenarios(self.data, n_scenarios, method=method, seed=seed)
+        sce = ScenariosData.from_data(reduced)
+        sce.labels = labels
+        return sce
+
+    @classmethod
+    def from_data(cls, data: np.ndarray):
+        """Scenarios held in memory, without a store"""
+        sce = cls.__new__(cls)
+        sce.store_file = None
+        sce.data = np.asarray(data, dtype=float)
+        sce.weight_col = sce.data.shape[1]-1
+        (sce.len_obs, sce.len_series) = np.shape(sce.data)
+        sce.set_obs = np.arange(sce.len_obs)
+        sce.set_series = np.arange(sce.len_series)
+        return sce
+
+    def __getstate__(self) -> dict:
+        # Other processes map the store again instead of receiving a copy of the series
+        state = dict(vars(self))
+        if self.store_file is not None:
+            del state["data"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self.store_file is not None:
+            self.data, _ = open_store(self.store_file)
\ No newline at end of file
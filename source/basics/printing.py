@@ -1,6 +1,8 @@
 import numpy as np
 import pyomo.environ as pyo
 import typing
+import os
+import sys
 
 def print_pyovar(title: str, var: pyo.Var, set: np.ndarray) -> None:
     print(title)
@@ -26,15 +28,36 @@ def int_format(number: int) -> str:
 def table_format(ncol: int) -> str:
     return ncol*"{:>9}"
 
+def format_table(columns: list, formats: list) -> str:
+    """Formats whole columns at once, one 9-character field per column"""
+    if len(columns[0]) == 0:
+        return ""
+    rows = np.rec.fromarrays([np.asarray(col) for col in columns])
+    return "\n".join("".join(formats) % tuple(row) for row in rows.tolist()) + "\n"
+
+def write_report(report: str, display: bool, export: bool, file_name: str) -> None:
+    if display:
+        sys.stdout.write(report)
+    if export:
+        with open(file_name, "w") as file:
+            file.write(report)
+
+def save_results(results: dict, file_name: str) -> None:
+    """Writes the result arrays in bulk: one .npz archive, or one CSV per array next to file_name"""
+    os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+    root, extension = os.path.splitext(file_name)
+    if extension == ".csv":
+        for key, value in results.items():
+            np.savetxt("{}_{}.csv".format(root, key), np.atleast_1d(value), delimiter=",")
+        return
+    np.savez(file_name, **results)
+
 def pyo_extract(var: pyo.Var, set: np.ndarray) -> np.ndarray:
-    array = np.zeros(len(set))
-    for arr_idx, set_idx in enumerate(set):
-        array[arr_idx] = pyo.value(var[set_idx])
-    return array
+    """Values of var over set, read from the component in one pass"""
+    values = var.extract_values()
+    return np.array([values[idx] for idx in set], dtype=float)
 
 def pyo_extract_2D(var: pyo.Var, set_1D: np.ndarray, set_2D: np.ndarray) -> np.ndarray:
-    array = np.zeros((len(set_1D), len(set_2D)))
-    for arr_idx_1D, set_idx_1D in enumerate(set_1D):
-        for arr_idx_2D, set_idx_2D in enumerate(set_2D):
-            array[arr_idx_1D, arr_idx_2D] = pyo.value(var[set_idx_1D, set_idx_2D])
-    return array
+    values = var.extract_values()
+    return np.array([values[idx_1D, idx_2D] for idx_1D in set_1D for idx_2D in set_2D],
+                    dtype=float).reshape(len(set_1D), len(set_2D))
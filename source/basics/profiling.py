@@ -0,0 +1,137 @@
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pyomo.environ as pyo
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class Profiler:
+    """Class to record wall time and peak memory of named phases, together with model statistics.
+
+    Repeated phases (e.g. one solve per Monte Carlo state) are aggregated under the same name. With trace_memory,
+    the peak of Python allocations above the phase start is recorded too, at the cost of slower allocations.
+    """
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.trace_memory = trace_memory
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        self.phases = dict()  # name -> {"calls", "time", "peak_mb", "max_rss_mb"}
+        self.model = dict()
+        self._stack = []  # [name, traced memory at start, highest peak of inner phases]
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        full_name = "/".join([frame[0] for frame in self._stack] + [name])
+        traced = 0
+        if self.trace_memory:
+            traced, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # The peak is reset for this phase, so the enclosing one keeps what it reached so far
+                self._stack[-1][2] = max(self._stack[-1][2], peak)
+            tracemalloc.reset_peak()
+        self._stack.append([name, traced, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _, traced, inner_peak = self._stack.pop()
+            peak = max(tracemalloc.get_traced_memory()[1], inner_peak) if self.trace_memory else 0
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], peak)
+
+            record = self.phases.setdefault(full_name, {"calls": 0, "time": 0.0, "peak_mb": 0.0, "max_rss_mb": 0.0})
+            record["calls"] += 1
+            record["time"] += elapsed
+            record["peak_mb"] = max(record["peak_mb"], (peak - traced) / 2**20)
+            record["max_rss_mb"] = max_rss_mb()
+
+    def instrument_solver(self, solver):
+        """Times the write, solve and load steps of a Pyomo shell solver (e.g. GLPK) on every call"""
+        if not hasattr(solver, "_apply_solver"):
+            # Persistent solvers write no files: model updates are timed with the solve
+            solver.solve = self._timed("solve", solver.solve)
+            return solver
+        for step, method in (("write", "_presolve"), ("solve", "_apply_solver"), ("load", "_postsolve")):
+            setattr(solver, method, self._timed(step, getattr(solver, method)))
+        return solver
+
+    def _timed(self, name: str, function):
+        def timed(*args, **kwds):
+            with self.phase(name):
+                return function(*args, **kwds)
+        return timed
+
+    def record_model(self, model) -> dict:
+        self.model = model_stats(model)
+        return self.model
+
+    def to_dict(self) -> dict:
+        return {"phases": [dict(name=name, **record) for name, record in self.phases.items()],
+                "model": self.model}
+
+    def dump(self, file_name: str) -> None:
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        with open(file_name, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def summary(self) -> str:
+        lines = ["{:<40}{:>8}{:>12}{:>12}".format("Phase", "Calls", "Time (s)", "Peak (MB)")]
+        for name, record in self.phases.items():
+            lines.append("{:<40}{:>8}{:>12.4f}{:>12.1f}".format(name, record["calls"], record["time"], record["peak_mb"]))
+        for key, value in self.model.items():
+            lines.append("{:<40}{:>8}".format(key, value))
+        return "\n".join(lines)
+
+
+class ProfiledModel(pyo.ConcreteModel):
+    """ConcreteModel timing the construction of each component it receives"""
+    def __init__(self, profiler: Profiler, *args, **kwds) -> None:
+        super().__init__(*args, **kwds)
+        self._profiler = profiler
+
+    def add_component(self, name: str, val) -> None:
+        with self._profiler.phase(name):
+            super().add_component(name, val)
+
+
+def max_rss_mb() -> float:
+    """High-water mark of the process resident memory"""
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 1024  # Bytes on macOS, kilobytes on Linux
+
+
+def model_stats(model) -> dict:
+    """Number of variables, constraints, nonzeros and integer variables of a Pyomo or MatrixModel model"""
+    if hasattr(model, "col_cost"):
+        a = model.matrix()
+        integer = model.col_integer
+        binary = integer & (model.col_lower >= 0) & (model.col_upper <= 1)
+        return {"variables": int(model.num_col),
+                "constraints": int(model.num_row),
+                "nonzeros": int(a.nnz),
+                "binaries": int(np.sum(binary)),
+                "integers": int(np.sum(integer & ~binary))}
+
+    variables = list(model.component_data_objects(pyo.Var, active=True, descend_into=True))
+    nonzeros = 0
+    constraints = 0
+    for con in model.component_data_objects(pyo.Constraint, active=True, descend_into=True):
+        constraints += 1
+        nonzeros += sum(1 for _ in pyo.expr.identify_variables(con.body, include_fixed=False))
+    binaries = sum(1 for var in variables if var.is_binary())
+    return {"variables": len(variables),
+            "constraints": constraints,
+            "nonzeros": nonzeros,
+            "binaries": binaries,
+            "integers": sum(1 for var in variables if var.is_integer()) - binaries}
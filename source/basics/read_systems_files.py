@@ -1,65 +1,219 @@
 from dataclasses import dataclass
+import numpy as np
+
+
 class ReadSystemsFiles():
-    def __init__(self, data_file: str) -> None:
+    def __init__(self, data_file: str, power_base: float = 100) -> None:
         self.data_file = data_file
+        self.power_base = power_base
         self.header_types = HeaderTypes()
-        pass
-    
-    
-    def read_from_anarede(self) -> None:
-        ...
 
-    
+    def read_from_anarede(self) -> dict:
+        """Reads a PWF deck into the MATPOWER-like system_data dict used by PowerSystemData"""
+        with open(self.data_file, "rb") as file:
+            sections = read_pwf_sections(file.read(), ("DBAR", "DLIN", "DGER"))
+
+        dbar = parse_fixed_width(sections.get("DBAR", []), self.header_types.dbar_types)
+        dlin = parse_fixed_width(sections.get("DLIN", []), self.header_types.dlin_types)
+        dger = parse_fixed_width(sections.get("DGER", []), self.header_types.dger_types)
+
+        # Buses are renumbered 1..n in deck order, as PowerSystemData indexes them by position
+        number = dbar["NUMBER"]
+        order = np.argsort(number, kind="stable")
+        def position(bus_number: np.ndarray) -> np.ndarray:
+            idx = np.searchsorted(number, bus_number, sorter=order)
+            if np.any(idx >= len(number)) or np.any(number[order[np.minimum(idx, len(number)-1)]] != bus_number):
+                raise ValueError("DLIN/DGER refer to buses missing from DBAR")
+            return order[idx] + 1
+
+        nbus = len(number)
+        bus = np.zeros((nbus, 13))
+        bus[:, 0] = np.arange(1, nbus+1)
+        bus[:, 1] = np.array([1, 2, 3, 1])[dbar["TYPE"]]  # PQ, PV, Vtheta, PQ with limits
+        bus[:, 2] = dbar["ACTIVE CHARGE"]
+        bus[:, 3] = dbar["REACTIVE CHARGE"]
+        bus[:, 5] = dbar["TOTAL REACTIVE POWER"]
+        bus[:, 7] = np.where(dbar["VOLTAGE"] > 0, dbar["VOLTAGE"], 1)
+        bus[:, 8] = dbar["AREA"]  # Column BusData reads the area from, the DC models start from flat angles
+        bus[:, 10] = 1
+        bus[:, 11] = 1.1
+        bus[:, 12] = 0.9
+
+        # Generators: buses with voltage control or scheduled generation, limits from DGER when present
+        is_gen = (dbar["TYPE"] == 1) | (dbar["TYPE"] == 2) | (dbar["ACTIVE GENERATION"] != 0)
+        gen_bus = np.flatnonzero(is_gen)
+        gen = np.zeros((len(gen_bus), 22))
+        gen[:, 0] = gen_bus + 1
+        gen[:, 1] = dbar["ACTIVE GENERATION"][gen_bus]
+        gen[:, 2] = dbar["REACTIVE GENERATION"][gen_bus]
+        gen[:, 3] = dbar["MAXIMUM REACTIVE GENERATION"][gen_bus]
+        gen[:, 4] = dbar["MINIMUM REACTIVE GENERATION"][gen_bus]
+        gen[:, 5] = bus[gen_bus, 7]
+        gen[:, 6] = self.power_base
+        gen[:, 7] = 1
+        gen[:, 8] = 9999
+        gen[:, 21] = 1
+        if len(dger["NUMBER"]) > 0:
+            gen_of_bus = np.full(nbus, -1)
+            gen_of_bus[gen_bus] = np.arange(len(gen_bus))
+            g = gen_of_bus[position(dger["NUMBER"]) - 1]
+            if np.any(g < 0):
+                raise ValueError("DGER refers to buses without generation")
+            gen[g, 8] = dger["MAXIMUM ACTIVE GENERATION"]
+            gen[g, 9] = dger["MINIMUM ACTIVE GENERATION"]
+
+        # Branches: percent impedances and total charging in Mvar
+        branch = np.zeros((len(dlin["FROM BUS"]), 13))
+        branch[:, 0] = position(dlin["FROM BUS"])
+        branch[:, 1] = position(dlin["TO BUS"])
+        branch[:, 2] = dlin["RESISTANCE"]/100
+        branch[:, 3] = dlin["REACTANCE"]/100
+        branch[:, 4] = dlin["SHUNT SUSCEPTANCE"]/self.power_base
+        branch[:, 5] = dlin["NORMAL CAPACITY"]
+        branch[:, 6] = dlin["EMERGENCY CAPACITY"]
+        branch[:, 7] = dlin["EMERGENCY CAPACITY"]
+        branch[:, 8] = dlin["TAP"]
+        branch[:, 9] = dlin["PHASE SHIFT"]
+        branch[:, 10] = dlin["STATUS"] != b"D"
+        branch[:, 11] = -360
+        branch[:, 12] = 360
+
+        # PWF decks carry no costs: a single generator type with unit operating cost
+        return {"bus": bus,
+                "gen": gen,
+                "branch": branch,
+                "gencost": np.array([[1, 0, 1, 0, 0, -1]], dtype=float),
+                "c02tax": np.zeros((1, 1)),
+                "bus_number": number.astype(float)}
+
+
+def read_pwf_sections(content: bytes, names: tuple) -> dict:
+    """Splits a PWF deck into the data lines of the requested sections"""
+    sections = dict()
+    current = None
+    is_title = False
+    for line in content.splitlines():
+        if current is None:
+            # The line after TITU is free text and may look like a section code
+            code = line[:4].decode("latin-1")
+            if not is_title and code in names and line[4:5].strip() == b"":
+                current = sections.setdefault(code, [])
+            is_title = code == "TITU" and not is_title
+            continue
+        if line.startswith(b"99999"):
+            current = None
+        elif not line.startswith(b"("):  # Comment lines start with "("
+            current.append(line)
+    return sections
+
+def parse_fixed_width(lines: list, types: list) -> dict:
+    """Slices every field of a section at once, applying ANAREDE's implied decimal point to numbers without one"""
+    width = max([s.stop for _, _, s, _ in types])
+    buffer = np.frombuffer(b"".join(line[:width].ljust(width) for line in lines), dtype=np.uint8).reshape(-1, width)
+
+    fields = dict()
+    for name, kind, s, decimals in types:
+        chars = np.ascontiguousarray(buffer[:, s])
+        if kind is str:
+            fields[name] = np.char.strip(chars.view("S{}".format(s.stop-s.start)).ravel())  # Text fields are kept as bytes
+            continue
+        values, has_point = parse_numbers(chars)
+        if kind is int:
+            fields[name] = values.astype(int)
+            continue
+        if decimals > 0:
+            values[~has_point] /= 10**decimals
+        fields[name] = values
+    return fields
+
+def parse_numbers(chars: np.ndarray) -> tuple:
+    """Parses a (rows, width) block of characters as numbers, column by column; blank fields are 0"""
+    is_digit = (chars >= ord("0")) & (chars <= ord("9"))
+    is_point = chars == ord(".")
+    is_minus = chars == ord("-")
+    if not np.all(is_digit | is_point | is_minus | (chars == ord(" ")) | (chars == ord("+"))):
+        # Exponents or other notations: let NumPy parse the text
+        column = chars.view("S{}".format(chars.shape[1])).ravel()
+        blank = np.all(chars == ord(" "), axis=1)
+        return np.where(blank, b"0", column).astype(float), np.any(is_point, axis=1)
+
+    # Digits accumulate into an integer mantissa, digits after the point count as decimals
+    mantissa = np.zeros(len(chars))
+    after_point = np.zeros(len(chars), dtype=bool)
+    decimals = np.zeros(len(chars), dtype=int)
+    for j in range(chars.shape[1]):
+        digit = is_digit[:, j]
+        mantissa[digit] = 10*mantissa[digit] + (chars[digit, j] - ord("0"))
+        decimals += digit & after_point
+        after_point |= is_point[:, j]
+    values = mantissa / 10.0**decimals
+    values[np.any(is_minus, axis=1)] *= -1
+    return values, after_point
+
 @dataclass
 class HeaderTypes():
+    # (field, type, columns, implied decimal places when the field has no decimal point)
     dbar_types = [
-            ("NUMBER", int, slice(0, 5)), 
-            ("OPERATION", str, slice(5, 6)), 
-            ("STATUS", str, slice(6, 7)), 
-            ("TYPE", int, slice(7, 8)), 
-            ("BASE VOLTAGE GROUP", str, slice(8, 10)),
-            ("NAME", str, slice(10, 22)), 
-            ("VOLTAGE LIMIT GROUP", str, slice(22, 24)),
-            ("VOLTAGE", float, slice(24, 28)), 
-            ("ANGLE", float, slice(28, 32)),
-            ("ACTIVE GENERATION", float, slice(32, 37)), 
-            ("REACTIVE GENERATION", float, slice(37, 42)),
-            ("MINIMUM REACTIVE GENERATION", float, slice(42, 47)),
-            ("MAXIMUM REACTIVE GENERATION", float, slice(47, 52)), 
-            ("CONTROLLED BUS", int, slice(52, 58)),
-            ("ACTIVE CHARGE", float, slice(58, 63)), 
-            ("REACTIVE CHARGE", float, slice(63, 68)),
-            ("TOTAL REACTIVE POWER", float, slice(68, 73)), 
-            ("AREA", int, slice(73, 76)),
-            ("CHARGE DEFINITION VOLTAGE", float, slice(76, 80)), 
-            ("VISUALIZATION", int, slice(80, 81)),
-            ("AGGREGATOR 1", int, slice(81, 84)), 
-            ("AGGREGATOR 2", int, slice(84, 87)),
-            ("AGGREGATOR 3", int, slice(87, 90)), 
-            ("AGGREGATOR 4", int, slice(90, 93)),
-            ("AGGREGATOR 5", int, slice(93, 96)), 
-            ("AGGREGATOR 6", int, slice(96, 99)),
-            ("AGGREGATOR 7", int, slice(99, 102)), 
-            ("AGGREGATOR 8", int, slice(102, 105)),
-            ("AGGREGATOR 9", int, slice(105, 108)), 
-            ("AGGREGATOR 10", int, slice(108, 111))
+            ("NUMBER", int, slice(0, 5), 0),
+            ("OPERATION", str, slice(5, 6), 0),
+            ("STATUS", str, slice(6, 7), 0),
+            ("TYPE", int, slice(7, 8), 0),
+            ("BASE VOLTAGE GROUP", str, slice(8, 10), 0),
+            ("NAME", str, slice(10, 22), 0),
+            ("VOLTAGE LIMIT GROUP", str, slice(22, 24), 0),
+            ("VOLTAGE", float, slice(24, 28), 3),
+            ("ANGLE", float, slice(28, 32), 0),
+            ("ACTIVE GENERATION", float, slice(32, 37), 0),
+            ("REACTIVE GENERATION", float, slice(37, 42), 0),
+            ("MINIMUM REACTIVE GENERATION", float, slice(42, 47), 0),
+            ("MAXIMUM REACTIVE GENERATION", float, slice(47, 52), 0),
+            ("CONTROLLED BUS", int, slice(52, 58), 0),
+            ("ACTIVE CHARGE", float, slice(58, 63), 0),
+            ("REACTIVE CHARGE", float, slice(63, 68), 0),
+            ("TOTAL REACTIVE POWER", float, slice(68, 73), 0),
+            ("AREA", int, slice(73, 76), 0),
+            ("CHARGE DEFINITION VOLTAGE", float, slice(76, 80), 3),
+            ("VISUALIZATION", int, slice(80, 81), 0),
+            ("AGGREGATOR 1", int, slice(81, 84), 0),
+            ("AGGREGATOR 2", int, slice(84, 87), 0),
+            ("AGGREGATOR 3", int, slice(87, 90), 0),
+            ("AGGREGATOR 4", int, slice(90, 93), 0),
+            ("AGGREGATOR 5", int, slice(93, 96), 0),
+            ("AGGREGATOR 6", int, slice(96, 99), 0),
+            ("AGGREGATOR 7", int, slice(99, 102), 0),
+            ("AGGREGATOR 8", int, slice(102, 105), 0),
+            ("AGGREGATOR 9", int, slice(105, 108), 0),
+            ("AGGREGATOR 10", int, slice(108, 111), 0)
             ]
-    
+
     dlin_types = [
-        ("De", int, slice(0, 4)), 
-        ("d", str, slice(4, 5)), 
-        ("O", int, slice(5, 8)), 
-        ("d_Pa", float, slice(8, 13)), 
-        ("NcEP", float, slice(13, 16)), 
-        ("R", str, slice(16, 20)), 
-        ("X", str, slice(20, 24)), 
-        ("Mvar", float, slice(24, 30)), 
-        ("Tap", float, slice(30, 36)), 
-        ("Tmn", float, slice(36, 42)), 
-        ("Tmx", float, slice(42, 48)), 
-        ("Phs", str, slice(48, 51)), 
-        ("Bc", str, slice(51, 56)), 
-        ("Cn", str, slice(56, 58)), 
-        ("Ce", str, slice(58, 61)), 
-        ("Ns", int, slice(61, 65))
-    ]
\ No newline at end of file
+        ("FROM BUS", int, slice(0, 5), 0),
+        ("FROM OPENING", str, slice(5, 6), 0),
+        ("OPERATION", str, slice(7, 8), 0),
+        ("TO OPENING", str, slice(9, 10), 0),
+        ("TO BUS", int, slice(10, 15), 0),
+        ("CIRCUIT", int, slice(15, 17), 0),
+        ("STATUS", str, slice(17, 18), 0),
+        ("OWNER", str, slice(18, 19), 0),
+        ("RESISTANCE", float, slice(20, 26), 2),
+        ("REACTANCE", float, slice(26, 32), 2),
+        ("SHUNT SUSCEPTANCE", float, slice(32, 38), 3),
+        ("TAP", float, slice(38, 43), 3),
+        ("MINIMUM TAP", float, slice(43, 48), 3),
+        ("MAXIMUM TAP", float, slice(48, 53), 3),
+        ("PHASE SHIFT", float, slice(53, 58), 2),
+        ("CONTROLLED BUS", int, slice(58, 64), 0),
+        ("NORMAL CAPACITY", float, slice(64, 68), 0),
+        ("EMERGENCY CAPACITY", float, slice(68, 72), 0),
+        ("STEPS", int, slice(72, 74), 0)
+    ]
+
+    dger_types = [
+        ("NUMBER", int, slice(0, 5), 0),
+        ("OPERATION", str, slice(6, 7), 0),
+        ("MINIMUM ACTIVE GENERATION", float, slice(8, 14), 0),
+        ("MAXIMUM ACTIVE GENERATION", float, slice(15, 21), 0),
+        ("PARTICIPATION FACTOR", float, slice(22, 27), 0),
+        ("REMOTE PARTICIPATION FACTOR", float, slice(28, 33), 0),
+        ("NOMINAL POWER FACTOR", float, slice(34, 38), 0)
+    ]
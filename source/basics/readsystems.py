@@ -1,65 +1,71 @@
 import re
 import numpy as np
+from basics.read_systems_files import ReadSystemsFiles
+
+
+_MATPOWER_FIELD = re.compile(r'\s*mpc\.(\w+)\s*=\s*(.*)')
+_MATPOWER_SCALAR = re.compile(r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*;?')
+_MATPOWER_CHGTAB = re.compile(r'\s*chgtab\s*=\s*(.*)')
+_MATPOWER_NAME = re.compile(r'\b[A-Z][A-Z_]+\b')
+
+# Named constants of MATPOWER change tables (idx_ct, with the status columns of idx_brch and idx_gen)
+CHGTAB_CONSTANTS = {"CT_TBUS": 1, "CT_TGEN": 2, "CT_TBRCH": 3, "CT_TAREABUS": 4, "CT_TAREAGEN": 5, "CT_TAREABRCH": 6,
+                    "CT_TLOAD": 7, "CT_TAREALOAD": 8, "CT_TGENCOST": 9, "CT_TAREAGENCOST": 10, "CT_MODEL": 11,
+                    "CT_REP": 1, "CT_REL": 2, "CT_ADD": 3,
+                    "BR_STATUS": 11, "GEN_STATUS": 8}
 
 
 def read_from_MATPOWER(data_file: str) -> dict:
-    matrices = {}  # Dictionary to store the matrices
+    matrices = {}  # Dictionary to store the matrices and numeric scalars
 
     with open(data_file, 'r') as file:
-        content = file.read()
+        # Single pass over the lines: "mpc.<name> = [" opens a matrix block, "mpc.<name> = <number>;" is a scalar
+        for line in file:
+            match = _MATPOWER_FIELD.match(line)
+            if match is None:
+                continue
+            name, value = match.groups()
+            value = value.split('%', 1)[0].strip()
+            if value.startswith('['):
+                matrices[name] = _read_MATPOWER_matrix(value[1:], file)
+            else:
+                scalar = _MATPOWER_SCALAR.fullmatch(value)
+                if scalar is not None:
+                    matrices[name] = float(scalar.group(1))
 
-        # Find all parts within line comments
-        parts = re.findall(r'%%\s+(.*?)\n(?:(?!%%).)*?mpc\.(\w+)\s*=\s*\[\s*(.*?)(?=\n\s*];)', content, re.DOTALL)
+    return matrices
 
-        for _, matrix_name, matrix_content in parts:
-            # Remove comments from the part
-            matrix_content_no_comments = re.sub(r'%.*', '', matrix_content)
-            
-            # Split the lines of the matrix based on the ";"
-            matrix_lines = matrix_content_no_comments.split(';')
-            
-            # Remove leading and trailing whitespaces from each line
-            matrix_lines = [line.strip() for line in matrix_lines if line.strip()]
-            
-            # Split the numbers into lists to form the matrix rows
-            matrix = [line.split() for line in matrix_lines]
+def _read_MATPOWER_matrix(first_line: str, file) -> np.ndarray:
+    """Reads the rows of a matrix block up to its closing bracket and parses them at once"""
+    rows = []
+    line = first_line
+    while True:
+        # Remove comments, then keep what comes before the closing bracket
+        data, *closing = line.split('%', 1)[0].split(']', 1)
 
-            # Convert the numbers to floats
-            matrix = [[float(num) for num in line] for line in matrix]
+        # Rows end at ";" or at a line break, and values may be separated by commas
+        rows.extend(row for row in data.replace(',', ' ').split(';') if row.strip())
+        if closing:
+            break
+        line = next(file, None)
+        if line is None:
+            raise ValueError("Unterminated MATPOWER matrix")
 
-            # Store the matrix in the dictionary
-            matrices[matrix_name] = np.array(matrix)
+    if not rows:
+        return np.array([])
+    return np.loadtxt(rows, dtype=float, ndmin=2)
 
-    return matrices
+def read_chgtab_from_MATPOWER(data_file: str) -> np.ndarray:
+    """Change table of a MATPOWER contingency file (contab): label, prob, table, row, col, chgtype, newval"""
+    def numeric(line: str) -> str:
+        return _MATPOWER_NAME.sub(lambda name: str(CHGTAB_CONSTANTS.get(name.group(0), name.group(0))), line)
 
-def read_from_ANAREDE(data_file: str) -> dict:
-    sections = {}
     with open(data_file, 'r') as file:
-        lines = file.readlines()
-        current_section = None
-        current_lines = []
-        for line in lines:
-            header = line.strip()
-            if not header.startswith("("):  # Se não começar com "("
-                if current_section is not None:
-                    line = read_section(line)
-                current_section = header
-                current_lines = []
-            else:
-                current_lines.append(line)
-        if current_section is not None and current_lines:
-            sections[current_section] = read_section(current_lines)
-    return sections
-
+        for line in file:
+            match = _MATPOWER_CHGTAB.match(line)
+            if match is not None and match.group(1).startswith('['):
+                return _read_MATPOWER_matrix(numeric(match.group(1)[1:]), (numeric(line) for line in file))
+    raise ValueError("No chgtab matrix in {}".format(data_file))
 
-
-def read_section(lines):
-    if not lines:
-        return None
-    data = []
-    for line in lines:
-        if line.strip() == "99999":
-            break
-        values = line.split()
-        data.append([float(value) if "." in value else int(value) for value in values])
-    return np.array(data)
\ No newline at end of file
+def read_from_ANAREDE(data_file: str) -> dict:
+    return ReadSystemsFiles(data_file).read_from_anarede()
@@ -0,0 +1,147 @@
+import json
+import os
+import numpy as np
+from basics.state_sampler import StateSampler
+
+
+# Log layout: magic, header length, JSON header padded to 64 bytes, then fixed-size records
+LOG_MAGIC = b"PLANNOPS-MCLOG"
+LOG_VERSION = 1
+ALIGNMENT = 64
+
+
+def record_dtype(state_bytes: int, n_shed: int) -> np.dtype:
+    """One record per sampled (or unique) state: bit-packed outages, multiplicity, likelihood ratio and shed per bus"""
+    return np.dtype([("state", np.uint8, (state_bytes,)),
+                     ("count", "<u4"),
+                     ("weight", "<f8"),
+                     ("shed", "<f8", (n_shed,))])
+
+
+class SampleLog:
+    """Class to append Monte Carlo sample outcomes to a binary log through a fixed-size buffer"""
+    def __init__(self, file_name: str, header: dict, buffer_size: int = 4096) -> None:
+        self.file_name = file_name
+        self.header = dict(header, version=LOG_VERSION)
+        self.dtype = record_dtype(self.header["state_bytes"], len(self.header["shed_bus"]))
+
+        # Records are kept here until the buffer is full
+        self.buffer = np.zeros(buffer_size, dtype=self.dtype)
+        self.size = 0
+        self.written = 0
+
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        content = json.dumps(self.header).encode()
+        prefix = len(LOG_MAGIC) + 8
+        padding = -(prefix + len(content)) % ALIGNMENT
+        self.file = open(file_name, "wb")
+        self.file.write(LOG_MAGIC + np.uint64(len(content) + padding).tobytes() + content + b" "*padding)
+
+    def write(self, states: np.ndarray, counts: np.ndarray, weights: np.ndarray, shed: np.ndarray) -> None:
+        """Appends a block of records; states are bit-packed rows"""
+        start = 0
+        while start < len(states):
+            n = min(len(self.buffer) - self.size, len(states) - start)
+            block = self.buffer[self.size:self.size+n]
+            block["state"] = states[start:start+n]
+            block["count"] = counts[start:start+n]
+            block["weight"] = weights[start:start+n]
+            block["shed"] = shed[start:start+n]
+            self.size += n
+            start += n
+            if self.size == len(self.buffer):
+                self.flush()
+
+    def flush(self) -> None:
+        self.file.write(self.buffer[:self.size].tobytes())
+        self.file.flush()
+        self.written += self.size
+        self.size = 0
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class SampleLogReader:
+    """Class to compute reliability indexes from a sample log, without solving any state again"""
+    def __init__(self, file_name: str, chunk_size: int = 65536) -> None:
+        self.chunk_size = chunk_size
+        with open(file_name, "rb") as file:
+            if file.read(len(LOG_MAGIC)) != LOG_MAGIC:
+                raise ValueError("{} is not a sample log".format(file_name))
+            length = int(np.frombuffer(file.read(8), dtype="<u8")[0])
+            self.header = json.loads(file.read(length).decode())
+        if self.header["version"] != LOG_VERSION:
+            raise ValueError("Sample log {} has version {}".format(file_name, self.header["version"]))
+
+        # A run stopped while writing may leave a partial record at the end
+        offset = len(LOG_MAGIC) + 8 + length
+        dtype = record_dtype(self.header["state_bytes"], len(self.header["shed_bus"]))
+        n_records = (os.path.getsize(file_name) - offset) // dtype.itemsize
+        self.records = np.memmap(file_name, dtype=dtype, mode="r", offset=offset, shape=(n_records,)) \
+            if n_records > 0 else np.zeros(0, dtype=dtype)
+
+        self.sampler = StateSampler(nlines=np.array(self.header["nlines"]),
+                                    line_FOR=np.array(self.header["line_FOR"]),
+                                    gen_FOR=np.array(self.header["gen_FOR"]))
+        self.n_samples = int(np.sum(self.records["count"], dtype=np.int64))
+
+    def chunks(self, line_FOR: np.ndarray = None, gen_FOR: np.ndarray = None):
+        """Yields (records, weights) in chunks, re-weighting the samples when other FORs are given"""
+        reweight = None
+        if line_FOR is not None or gen_FOR is not None:
+            # Likelihood ratio between the new and the original FORs
+            reweight = StateSampler(nlines=self.sampler.nlines,
+                                    line_FOR=self.sampler.line_FOR if line_FOR is None else np.asarray(line_FOR),
+                                    gen_FOR=self.sampler.gen_FOR if gen_FOR is None else np.asarray(gen_FOR))
+            reweight.line_q = self.sampler.line_FOR
+            reweight.gen_q = self.sampler.gen_FOR
+        for start in range(0, len(self.records), self.chunk_size):
+            records = self.records[start:start+self.chunk_size]
+            weights = records["count"] * records["weight"]
+            if reweight is not None:
+                weights = weights * reweight.weights(self.sampler.unpack(records["state"]))
+            yield records, weights
+
+    def indexes(self, line_FOR: np.ndarray = None, gen_FOR: np.ndarray = None) -> dict:
+        """LOLP, EPNS and EPNS by bus with demand, optionally under other FORs"""
+        sumLOLP = 0
+        bus_EPNS = np.zeros(len(self.header["shed_bus"]))
+        for records, weights in self.chunks(line_FOR, gen_FOR):
+            total_sl = records["shed"].sum(axis=1)
+            sumLOLP += weights @ (total_sl > 0)
+            bus_EPNS += weights @ records["shed"]
+        n = max(self.n_samples, 1)
+        return {"LOLP": sumLOLP / n,
+                "EPNS": bus_EPNS.sum() / n,
+                "bus_EPNS": bus_EPNS / n,
+                "shed_bus": np.array(self.header["shed_bus"])}
+
+    def shed_distribution(self, bins: np.ndarray) -> np.ndarray:
+        """Probability of the total load shedding falling in each bin"""
+        hist = np.zeros(len(bins)-1)
+        for records, weights in self.chunks():
+            hist += np.histogram(records["shed"].sum(axis=1), bins=bins, weights=weights)[0]
+        return hist / max(self.n_samples, 1)
+
+    def by_outage_order(self) -> dict:
+        """Contribution to LOLP and EPNS of the states by number of elements out"""
+        sumLOLP = dict()
+        sumEPNS = dict()
+        for records, weights in self.chunks():
+            order = np.unpackbits(records["state"], axis=1).sum(axis=1)
+            total_sl = records["shed"].sum(axis=1)
+            for k in np.unique(order):
+                at = order == k
+                sumLOLP[int(k)] = sumLOLP.get(int(k), 0) + weights[at] @ (total_sl[at] > 0)
+                sumEPNS[int(k)] = sumEPNS.get(int(k), 0) + weights[at] @ total_sl[at]
+        n = max(self.n_samples, 1)
+        return {k: (sumLOLP[k] / n, sumEPNS[k] / n) for k in sorted(sumLOLP)}
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+BLOCK_SIZE = 1024
+MAX_MATRIX_BYTES = 2**29
+
+
+def reduce_scenarios(data: np.ndarray, n_scenarios: int, method: str = "kmeans", seed: int = 0) -> tuple:
+    """Reduces observations (series columns followed by the weight) to representatives carrying the weight of their members"""
+    data = np.asarray(data, dtype=float)
+    points = data[:, :-1]
+    weights = data[:, -1]
+    n_scenarios = min(n_scenarios, len(data))
+    if n_scenarios <= 0:
+        raise ValueError("The number of scenarios must be positive")
+
+    rng = np.random.default_rng(seed)
+    if method == "kmeans":
+        centers, labels = _kmeans(points, weights, n_scenarios, rng)
+    elif method == "kmedoids":
+        medoids, labels = _kmedoids(points, weights, n_scenarios, rng)
+        centers = points[medoids]
+    elif method == "forward":
+        selected, labels = _forward_selection(points, weights, n_scenarios)
+        centers = points[selected]
+    else:
+        raise ValueError("Unknown reduction method: {}".format(method))
+
+    reduced = np.column_stack((centers, np.bincount(labels, weights=weights, minlength=len(centers))))
+    return reduced, labels
+
+def _sq_distances(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    d2 = np.sum(points**2, axis=1)[:, None] - 2*points @ centers.T + np.sum(centers**2, axis=1)[None, :]
+    return np.maximum(d2, 0)
+
+def _kmeans_pp(points: np.ndarray, weights: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """Weighted k-means++ seeding, returning the indexes of the initial centers"""
+    p = weights / weights.sum() if weights.sum() > 0 else np.full(len(points), 1/len(points))
+    chosen = [rng.choice(len(points), p=p)]
+    d2 = _sq_distances(points, points[chosen])[:, 0]
+    for _ in range(1, k):
+        score = weights*d2 if np.any(weights*d2 > 0) else (d2 > 0).astype(float)
+        if not np.any(score > 0):
+            # Fewer distinct observations than scenarios
+            score = np.ones(len(points))
+            score[chosen] = 0
+        chosen.append(rng.choice(len(points), p=score/score.sum()))
+        d2 = np.minimum(d2, _sq_distances(points, points[chosen[-1:]])[:, 0])
+    return np.array(chosen)
+
+def _kmeans(points: np.ndarray, weights: np.ndarray, k: int, rng: np.random.Generator, max_iter: int = 100) -> tuple:
+    """Weighted Lloyd iterations"""
+    centers = points[_kmeans_pp(points, weights, k, rng)]
+    labels = None
+    for _ in range(max_iter):
+        new_labels = np.argmin(_sq_distances(points, centers), axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        mass = np.bincount(labels, weights=weights, minlength=k)
+        for col in range(points.shape[1]):
+            total = np.bincount(labels, weights=weights*points[:, col], minlength=k)
+            centers[:, col] = np.where(mass > 0, total/np.where(mass > 0, mass, 1), centers[:, col])
+    return centers, labels
+
+def _kmedoids(points: np.ndarray, weights: np.ndarray, k: int, rng: np.random.Generator, max_iter: int = 100) -> tuple:
+    """Alternates assignment and the weighted medoid of each cluster"""
+    medoids = _kmeans_pp(points, weights, k, rng)
+    for _ in range(max_iter):
+        labels = np.argmin(_sq_distances(points, points[medoids]), axis=1)
+        new_medoids = np.copy(medoids)
+        for c in range(k):
+            members = np.flatnonzero(labels == c)
+            if len(members) > 0:
+                new_medoids[c] = members[_medoid(points[members], weights[members])]
+        if np.array_equal(new_medoids, medoids):
+            break
+        medoids = new_medoids
+    labels = np.argmin(_sq_distances(points, points[medoids]), axis=1)
+    return medoids, labels
+
+def _medoid(points: np.ndarray, weights: np.ndarray) -> int:
+    cost = np.zeros(len(points))
+    for start in range(0, len(points), BLOCK_SIZE):
+        block = points[start:start+BLOCK_SIZE]
+        cost[start:start+BLOCK_SIZE] = weights @ np.sqrt(_sq_distances(points, block))
+    return int(np.argmin(cost))
+
+def _forward_selection(points: np.ndarray, weights: np.ndarray, k: int) -> tuple:
+    """Fast forward selection: adds the observation that most reduces the weighted distance to the selected set"""
+    # Distance blocks are kept between steps when they fit in memory, and recomputed otherwise
+    starts = range(0, len(points), BLOCK_SIZE)
+    keep = len(points)**2 * 4 <= MAX_MATRIX_BYTES
+    blocks = [_distance_block(points, start) for start in starts] if keep else None
+
+    dist = np.full(len(points), np.inf, dtype=np.float32)
+    selected = []
+    for _ in range(k):
+        cost = np.zeros(len(points))
+        for idx, start in enumerate(starts):
+            block = blocks[idx] if keep else _distance_block(points, start)
+            cost[start:start+BLOCK_SIZE] = weights @ np.minimum(block, dist[:, None])
+        cost[selected] = np.inf
+        selected.append(int(np.argmin(cost)))
+        dist = np.minimum(dist, np.sqrt(_sq_distances(points, points[selected[-1:]]))[:, 0])
+    selected = np.array(selected)
+    labels = np.argmin(_sq_distances(points, points[selected]), axis=1)
+    return selected, labels
+
+def _distance_block(points: np.ndarray, start: int) -> np.ndarray:
+    return np.sqrt(_sq_distances(points, points[start:start+BLOCK_SIZE])).astype(np.float32)
@@ -0,0 +1,91 @@
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import numpy as np
+
+
+# Store layout: a fixed-size JSON header followed by the observations as float64 rows
+STORE_MAGIC = b"PLANNOPS-SCE"
+STORE_VERSION = 1
+HEADER_SIZE = 4096
+STORE_DIR = "source/.cache/scenarios"
+STORE_EXTENSION = ".sce"
+
+
+def store_file_of(sce_file: str, store_dir: str = STORE_DIR) -> str:
+    """Path of the binary store of a scenario CSV, converting it on first use"""
+    if sce_file.lower().endswith(STORE_EXTENSION):
+        return sce_file
+    digest = hashlib.sha256(repr(STORE_VERSION).encode())
+    with open(sce_file, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    store_file = os.path.join(store_dir, digest.hexdigest() + STORE_EXTENSION)
+    if not os.path.isfile(store_file):
+        convert_csv(sce_file, store_file)
+    return store_file
+
+def convert_csv(sce_file: str, store_file: str, chunk_rows: int = 65536) -> None:
+    """Streams a scenario CSV into a binary store, chunk_rows lines at a time"""
+    os.makedirs(os.path.dirname(store_file) or ".", exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(store_file) or ".")
+    try:
+        store = os.fdopen(fd, "wb")
+        fd = None  # Closed with store from here on
+        rows = 0
+        columns = None
+        with store, open(sce_file) as csv:
+            store.write(bytes(HEADER_SIZE))
+            while True:
+                lines = [line for line in itertools.islice(csv, chunk_rows) if line.strip()]
+                if len(lines) == 0:
+                    break
+                chunk = np.loadtxt(lines, delimiter=",", ndmin=2, dtype="<f8")
+                if columns is not None and chunk.shape[1] != columns:
+                    raise ValueError("{} has rows with different numbers of columns".format(sce_file))
+                columns = chunk.shape[1]
+                rows += len(chunk)
+                store.write(chunk.tobytes())
+            if columns is None:
+                raise ValueError("{} has no scenarios".format(sce_file))
+
+            # The last column holds the weight of each observation
+            header = {"version": STORE_VERSION,
+                      "rows": rows,
+                      "columns": columns,
+                      "series": list(range(columns-1)),
+                      "weight": columns-1,
+                      "dtype": "<f8"}
+            store.seek(0)
+            store.write(_encode_header(header))
+        os.replace(tmp, store_file)
+    except BaseException:
+        # A CSV that cannot be converted leaves no temporary file next to the stores
+        if fd is not None:
+            os.close(fd)
+        os.unlink(tmp)
+        raise
+
+def open_store(store_file: str) -> tuple:
+    """Memory-maps a binary store read-only, returning (data, header)"""
+    with open(store_file, "rb") as file:
+        header = _decode_header(file.read(HEADER_SIZE), store_file)
+    data = np.memmap(store_file, dtype=header["dtype"], mode="r", offset=HEADER_SIZE,
+                     shape=(header["rows"], header["columns"]))
+    return data, header
+
+def _encode_header(header: dict) -> bytes:
+    content = STORE_MAGIC + json.dumps(header).encode()
+    if len(content) > HEADER_SIZE:
+        raise ValueError("Scenario store header is larger than {} bytes".format(HEADER_SIZE))
+    return content.ljust(HEADER_SIZE, b" ")
+
+def _decode_header(content: bytes, store_file: str) -> dict:
+    if not content.startswith(STORE_MAGIC):
+        raise ValueError("{} is not a scenario store".format(store_file))
+    header = json.loads(content[len(STORE_MAGIC):].decode())
+    if header["version"] != STORE_VERSION:
+        raise ValueError("Scenario store {} has version {}".format(store_file, header["version"]))
+    return header
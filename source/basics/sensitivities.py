@@ -0,0 +1,82 @@
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from scipy.sparse.csgraph import connected_components
+
+
+def incidence_matrix(bus_fr: np.ndarray, bus_to: np.ndarray, nbus: int) -> sp.csr_matrix:
+    """Branch-bus incidence: +1 at the from bus, -1 at the to bus"""
+    nbranch = len(bus_fr)
+    rows = np.concatenate((np.arange(nbranch), np.arange(nbranch)))
+    cols = np.concatenate((bus_fr, bus_to))
+    vals = np.concatenate((np.ones(nbranch), -np.ones(nbranch)))
+    return sp.csr_matrix((vals, (rows, cols)), shape=(nbranch, nbus))
+
+
+class PTDF:
+    """Class to compute DC flows and their sensitivities to bus injections from a sparse LU of the reduced B matrix.
+
+    Flows follow the model convention pf = -b_lin*(th_fr-th_to), so a positive injection at bus_fr pushes a positive
+    flow. Each island has its own slack, its lowest-numbered bus (bus 0, the th[0] reference, for the first island).
+    """
+    def __init__(self, bus_fr: np.ndarray, bus_to: np.ndarray, b_lin: np.ndarray, nbus: int) -> None:
+        self.bus_fr = np.asarray(bus_fr)
+        self.bus_to = np.asarray(bus_to)
+        self.nbus = nbus
+        self.incidence = incidence_matrix(self.bus_fr, self.bus_to, nbus)
+
+        # Islands: one slack and one power balance each
+        self.n_islands, self.island = connected_components(self.incidence.T @ self.incidence, directed=False)
+        self.slack = np.unique(self.island, return_index=True)[1]
+        self.is_slack = np.zeros(nbus, dtype=bool)
+        self.is_slack[self.slack] = True
+        self.non_slack = np.flatnonzero(~self.is_slack)
+
+        self.factorize(b_lin)
+
+    def factorize(self, b_lin: np.ndarray) -> None:
+        """(Re)factorizes the reduced B matrix for new susceptances"""
+        self.b = -np.asarray(b_lin, dtype=float)  # Series susceptance 1/x
+        bbus = (self.incidence.T @ sp.diags(self.b) @ self.incidence).tocsc()
+        self.lu = spla.splu(bbus[self.non_slack][:, self.non_slack].tocsc())
+
+    def angles(self, injections: np.ndarray) -> np.ndarray:
+        """Bus angles (zero at the slacks) for net bus injections, one column per case when 2D"""
+        injections = np.asarray(injections, dtype=float)
+        th = np.zeros(injections.shape)
+        th[self.non_slack] = self.lu.solve(np.ascontiguousarray(injections[self.non_slack]))
+        return th
+
+    def flows(self, injections: np.ndarray) -> np.ndarray:
+        th = self.angles(injections)
+        return (self.b * (self.incidence @ th).T).T
+
+    def matrix(self, branches: np.ndarray = None, buses: np.ndarray = None) -> np.ndarray:
+        """Dense PTDF block of the given branches (rows) and buses (columns), solving for the smaller side"""
+        branches = np.arange(len(self.b)) if branches is None else np.asarray(branches)
+        buses = np.arange(self.nbus) if buses is None else np.asarray(buses)
+        if len(branches) == 0 or len(buses) == 0:
+            return np.zeros((len(branches), len(buses)))
+
+        if len(branches) < len(buses):
+            # Rows of branches: B^-1 A^T diag(b), as B is symmetric
+            rhs = (self.incidence[branches].T @ sp.diags(self.b[branches])).toarray()
+            x = np.zeros((self.nbus, len(branches)))
+            x[self.non_slack] = self.lu.solve(np.ascontiguousarray(rhs[self.non_slack]))
+            return x[buses].T
+
+        # Columns of buses: flows of a unit injection at each of them
+        unit = np.zeros((self.nbus, len(buses)))
+        unit[buses, np.arange(len(buses))] = 1
+        return self.flows(unit)[branches]
+
+    def transfer_flows(self, branches: np.ndarray) -> np.ndarray:
+        """Flows of all branches for 1 pu injected at bus_fr and withdrawn at bus_to of each of branches"""
+        return self.flows(self.incidence[np.asarray(branches)].T.toarray())
+
+    def angle_matrix(self, rows: np.ndarray, buses: np.ndarray) -> np.ndarray:
+        """Dense sensitivities of the angles of rows (buses) to the injections at buses"""
+        rows = np.asarray(rows)
+        unit = np.zeros((self.nbus, len(rows)))
+        unit[rows, np.arange(len(rows))] = 1
+        return self.angles(unit)[np.asarray(buses)].T
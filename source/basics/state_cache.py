@@ -0,0 +1,59 @@
+import numpy as np
+
+
+class StateCache:
+    """Class to cache the outcome of system states keyed by bit-packed outage vectors"""
+    def __init__(self, capacity: int = 100000, evict_fraction: float = 0.1) -> None:
+        self.capacity = capacity
+        self.evict_fraction = evict_fraction
+
+        self.outcomes = dict()  # key -> outcome
+        self.counts = dict()  # key -> number of requests
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.outcomes)
+
+    def get(self, key: bytes):
+        outcome = self.outcomes.get(key)
+        if outcome is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.counts[key] += 1
+        return outcome
+
+    def put(self, key: bytes, outcome) -> None:
+        if self.capacity <= 0:
+            return
+        if len(self.outcomes) >= self.capacity:
+            self._evict()
+        self.outcomes[key] = outcome
+        self.counts[key] = 1
+
+    def _evict(self) -> None:
+        # Least frequently requested states are dropped in bulk, so frequent low-order states survive
+        n_evict = max(1, int(self.evict_fraction*len(self.outcomes)))
+        keys = list(self.counts.keys())
+        counts = np.fromiter(self.counts.values(), dtype=np.int64, count=len(keys))
+        for idx in np.argpartition(counts, n_evict-1)[:n_evict]:
+            del self.outcomes[keys[idx]]
+            del self.counts[keys[idx]]
+        self.evictions += n_evict
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests > 0 else 0
+
+    def stats(self) -> dict:
+        return {"size": len(self.outcomes),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hit_rate}
@@ -0,0 +1,92 @@
+import numpy as np
+
+
+class StateClassifier:
+    """Class to answer Monte Carlo states from bounds on previously solved states, without solving the LP"""
+    def __init__(self,
+                 gen_cost: np.ndarray,
+                 gen_pg_max: np.ndarray,
+                 sl_cost: float,
+                 sl_max: float,
+                 pd_total: float,
+                 max_records: int = 64,
+                 tol: float = 1e-7) -> None:
+        self.max_records = max_records
+        self.tol = tol
+
+        # Copper-plate merit order: generators sorted by cost, followed by load shedding
+        self.merit_order = np.argsort(gen_cost, kind="stable")
+        self.merit_cost = np.append(gen_cost[self.merit_order], sl_cost)
+        self.merit_pg_max = gen_pg_max[self.merit_order]
+        self.sl_max = sl_max
+        self.pd_total = pd_total
+
+        # Solved states grouped by line state
+        self.records = dict()  # line key -> _Records
+
+        # Statistics
+        self.queries = 0
+        self.avoided = 0
+
+    def copper_plate_bound(self, gen_out: np.ndarray) -> float:
+        """Optimal cost of the state without network constraints, a lower bound of its OPF cost"""
+        capacity = np.append(np.where(gen_out[self.merit_order], 0, self.merit_pg_max), self.sl_max)
+        if capacity.sum() < self.pd_total:
+            return -np.inf
+        filled = np.clip(self.pd_total - (np.cumsum(capacity) - capacity), 0, capacity)
+        return float(filled @ self.merit_cost)
+
+    def classify(self, line_key: bytes, gen_out: np.ndarray):
+        """Returns the outcome of a state when it is provable from solved states, None otherwise"""
+        self.queries += 1
+        records = self.records.get(line_key)
+        if records is None:
+            return None
+        n = records.size
+        rec_out = records.gen_out[:n]
+        rec_idle = records.idle[:n]
+        rec_obj = records.objective[:n]
+
+        # Upper bound: a solved state whose solution is feasible here, i.e. every generator out here was idle there
+        feasible = ~np.any(gen_out & ~rec_idle, axis=1)
+        if not np.any(feasible):
+            return None
+        best = np.flatnonzero(feasible)[np.argmin(rec_obj[feasible])]
+        upper = rec_obj[best]
+
+        # Lower bound: copper-plate dispatch, or any solved state with a subset of these outages
+        lower = self.copper_plate_bound(gen_out)
+        subset = ~np.any(rec_out & ~gen_out, axis=1)
+        if np.any(subset):
+            lower = max(lower, rec_obj[subset].max())
+
+        if upper - lower > self.tol*max(1, abs(upper)):
+            return None
+        self.avoided += 1
+        return records.outcomes[best]
+
+    def record(self, line_key: bytes, gen_out: np.ndarray, pg: np.ndarray, objective: float, outcome) -> None:
+        """Stores a solved state, keeping the most recent max_records per line state"""
+        records = self.records.get(line_key)
+        if records is None:
+            records = self.records[line_key] = _Records(self.max_records, len(gen_out))
+        records.add(gen_out, gen_out | (pg <= 1e-9), objective, outcome)
+
+
+class _Records:
+    """Ring buffer of solved states sharing a line state"""
+    def __init__(self, max_records: int, ngen: int) -> None:
+        self.gen_out = np.zeros((max_records, ngen), dtype=bool)
+        self.idle = np.zeros((max_records, ngen), dtype=bool)
+        self.objective = np.zeros(max_records)
+        self.outcomes = [None]*max_records
+        self.size = 0
+        self.next = 0
+
+    def add(self, gen_out: np.ndarray, idle: np.ndarray, objective: float, outcome) -> None:
+        self.gen_out[self.next] = gen_out
+        self.idle[self.next] = idle
+        self.objective[self.next] = objective
+        self.outcomes[self.next] = outcome
+        self.size = min(self.size+1, len(self.objective))
+        self.next = (self.next+1) % len(self.objective)
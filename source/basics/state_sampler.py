@@ -0,0 +1,105 @@
+import numpy as np
+from scipy.stats import qmc
+
+
+class StateSampler:
+    """Class to draw blocks of system states for Monte Carlo simulation"""
+    def __init__(self,
+                 nlines: np.ndarray,
+                 line_FOR: np.ndarray,
+                 gen_FOR: np.ndarray,
+                 method: str = "crude") -> None:
+        if method not in ("crude", "ce", "lhs", "sobol"):
+            raise ValueError("Unknown sampling method: {}".format(method))
+        self.nlines = nlines
+        self.line_FOR = line_FOR
+        self.gen_FOR = gen_FOR
+        self.method = method
+
+        # Proposal outage probabilities, equal to the FORs unless importance sampling moves them
+        self.line_q = np.copy(line_FOR)
+        self.gen_q = np.copy(gen_FOR)
+
+        # Misc
+        self.len_lines = len(nlines)
+        self.len_gen = len(gen_FOR)
+
+        # Bit layout: one bit per circuit of each corridor followed by one bit per generator
+        self.circuit_line = np.repeat(np.arange(self.len_lines), nlines)
+        self.circuit_pos = np.arange(len(self.circuit_line)) - np.repeat(np.cumsum(nlines) - nlines, nlines)
+        self.circuit_end = np.cumsum(nlines)
+
+    def draw(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        """Draws n states as rows of [circuits out per corridor, generators out]"""
+        if self.method in ("lhs", "sobol"):
+            return self._draw_uniform(self._uniform(n, rng))
+        states = np.empty((n, self.len_lines+self.len_gen), dtype=np.uint8)
+        states[:, :self.len_lines] = rng.binomial(self.nlines, self.line_q, size=(n, self.len_lines))
+        states[:, self.len_lines:] = rng.random((n, self.len_gen)) < self.gen_q
+        return states
+
+    def _uniform(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        """Stratified uniform draws, one column per circuit and generator"""
+        d = len(self.circuit_line) + self.len_gen
+        if self.method == "sobol":
+            return qmc.Sobol(d, scramble=True, seed=rng).random(n)
+        return qmc.LatinHypercube(d, seed=rng).random(n)
+
+    def _draw_uniform(self, u: np.ndarray) -> np.ndarray:
+        n_circuits = len(self.circuit_line)
+        circuits_out = np.zeros((len(u), n_circuits+1), dtype=np.int64)
+        np.cumsum(u[:, :n_circuits] < self.line_q[self.circuit_line], axis=1, out=circuits_out[:, 1:])
+
+        states = np.empty((len(u), self.len_lines+self.len_gen), dtype=np.uint8)
+        states[:, :self.len_lines] = circuits_out[:, self.circuit_end] - circuits_out[:, self.circuit_end - self.nlines]
+        states[:, self.len_lines:] = u[:, n_circuits:] < self.gen_q
+        return states
+
+    def weights(self, states: np.ndarray) -> np.ndarray:
+        """Likelihood ratios between the FORs and the proposal probabilities for each state"""
+        log_w = np.zeros(len(states))
+        lines = np.flatnonzero(self.line_q != self.line_FOR)
+        if len(lines) > 0:
+            out = states[:, lines].astype(float)
+            p, q, n = self.line_FOR[lines], self.line_q[lines], self.nlines[lines]
+            log_w += out @ np.log(p/q) + (n - out) @ np.log((1-p)/(1-q))
+        gens = np.flatnonzero(self.gen_q != self.gen_FOR)
+        if len(gens) > 0:
+            out = states[:, self.len_lines + gens].astype(float)
+            p, q = self.gen_FOR[gens], self.gen_q[gens]
+            log_w += out @ np.log(p/q) + (1 - out) @ np.log((1-p)/(1-q))
+        return np.exp(log_w)
+
+    def pack(self, state: np.ndarray) -> bytes:
+        """Bit-packed outage vector of a state, used as a compact key"""
+        bits = np.concatenate((state[self.circuit_line] > self.circuit_pos, state[self.len_lines:] > 0))
+        return np.packbits(bits).tobytes()
+
+    def pack_block(self, states: np.ndarray) -> np.ndarray:
+        """Bit-packed outage vectors of a block of states, one row per state"""
+        bits = np.concatenate((states[:, self.circuit_line] > self.circuit_pos, states[:, self.len_lines:] > 0), axis=1)
+        return np.packbits(bits, axis=1)
+
+    def unpack(self, packed: np.ndarray) -> np.ndarray:
+        """States of a block of bit-packed outage vectors"""
+        n_circuits = len(self.circuit_line)
+        bits = np.unpackbits(packed, axis=1, count=n_circuits+self.len_gen)
+        circuits_out = np.zeros((len(packed), n_circuits+1), dtype=np.int64)
+        np.cumsum(bits[:, :n_circuits], axis=1, out=circuits_out[:, 1:])
+
+        states = np.empty((len(packed), self.len_lines+self.len_gen), dtype=np.uint8)
+        states[:, :self.len_lines] = circuits_out[:, self.circuit_end] - circuits_out[:, self.circuit_end - self.nlines]
+        states[:, self.len_lines:] = bits[:, n_circuits:]
+        return states
+
+    def split(self, state: np.ndarray) -> tuple:
+        """Splits a state row into line and generator contingencies"""
+        return state[:self.len_lines].astype(int), state[self.len_lines:].astype(int)
+
+
+def unique_states(states: np.ndarray) -> tuple:
+    """Collapses identical rows of a state block, returning them with their counts"""
+    states = np.ascontiguousarray(states)
+    rows = states.view(np.dtype((np.void, states.dtype.itemsize*states.shape[1]))).ravel()
+    _, first, counts = np.unique(rows, return_index=True, return_counts=True)
+    return states[first], counts
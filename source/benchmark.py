@@ -0,0 +1,149 @@
+# Scaling benchmark over the original MATPOWER library
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from basics.readsystems import read_from_MATPOWER
+from basics.case_synthesis import synthesize_case
+from basics.powersystem import PowerSystemData
+from basics.profiling import Profiler
+from opf_basic import OPFBasic
+from opf_basic_losses import OPFBasicLoss
+from tep_basic import TEPBasic
+from opf_monte_carlo import OPFMonteCarlo
+
+
+CASES_DIR = "misc/dataMATPOWER_original"
+RESULTS_FILE = "source/.results/benchmark.json"
+BASELINE_FILE = "source/tests/results/benchmark_baseline.json"
+
+LADDERS = {"small": ["case5", "case14", "case30", "case118", "case300"],
+           "medium": ["case1354pegase", "case2383wp", "case_ACTIVSg2000"],
+           "large": ["case9241pegase", "case_ACTIVSg10k", "case13659pegase"]}
+MODELS = ("OPFBasic", "OPFBasicLoss", "TEPBasic", "OPFMonteCarlo")
+PHASES = ("read", "build", "define_model", "solve_model", "get_results")
+
+# A phase regresses when it is TOLERANCE times slower than the baseline and by more than MIN_TIME seconds
+TOLERANCE = 1.5
+MIN_TIME = 0.05
+
+
+def run_case(case: str, model: str, engine: str = "pyomo", n_candidates: int = 5, n_samples: int = 200,
+             cases_dir: str = CASES_DIR) -> dict:
+    """Times one model on one case, from reading the file to extracting the results"""
+    profiler = Profiler()
+    with profiler.phase("read"):
+        system_data = synthesize_case(read_from_MATPOWER(os.path.join(cases_dir, case + ".m")),
+                                      n_candidates=n_candidates if model == "TEPBasic" else 0,
+                                      reliability=model == "OPFMonteCarlo")
+    with profiler.phase("build"):
+        psd = PowerSystemData(system_data)
+
+    if model == "OPFBasic":
+        op = OPFBasic(psd, engine=engine, profiler=profiler)
+    elif model == "OPFBasicLoss":
+        op = OPFBasicLoss(psd, engine=engine, profiler=profiler)
+    elif model == "TEPBasic":
+        op = TEPBasic(psd, engine=engine, profiler=profiler)
+    elif model == "OPFMonteCarlo":
+        # A fixed number of samples: the convergence tolerance is never reached
+        np.random.seed(0)
+        op = OPFMonteCarlo(psd, MAX_ITER=n_samples, BETA_TOL=1e-12, engine=engine, seed=0, profiler=profiler)
+    else:
+        raise ValueError("Unknown model '{}'".format(model))
+
+    with profiler.phase("define_model"):
+        op.define_model()
+    with profiler.phase("solve_model"):
+        op.solve_model()
+    if not op.optimal:
+        # Objective and solution are meaningless, the run is recorded as an error by run_suite
+        raise RuntimeError("{} on {} ({}) did not reach an optimal solution".format(model, case, engine))
+    with profiler.phase("get_results"):
+        op.get_results(export=False, display=False)
+
+    return {"case": case,
+            "model": model,
+            "engine": engine,
+            "buses": int(psd.bus.len),
+            "times": {name: profiler.phases[name]["time"] for name in PHASES},
+            "max_rss_mb": max(phase["max_rss_mb"] for phase in profiler.phases.values()),
+            "size": profiler.record_model(op.model),
+            "objective": float(op._objective_value())}
+
+def run_suite(cases: list, models: list = MODELS, engines: list = ("pyomo",), **kwds) -> dict:
+    """Runs every (case, model, engine) in a fresh process, so peak RSS is measured for each run alone"""
+    runs = []
+    for case in cases:
+        for model in models:
+            for engine in engines:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    try:
+                        run = executor.submit(run_case, case, model, engine, **kwds).result()
+                    except Exception as error:
+                        run = {"case": case, "model": model, "engine": engine, "error": repr(error)}
+                runs.append(run)
+                print(format_run(run))
+    return {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+            "runs": runs}
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE, min_time: float = MIN_TIME) -> list:
+    """Phases and peak memory of the runs that regressed against the baseline"""
+    base_runs = {(run["case"], run["model"], run["engine"]): run for run in baseline["runs"] if "error" not in run}
+    regressions = []
+    for run in results["runs"]:
+        base = base_runs.get((run["case"], run["model"], run["engine"]))
+        if base is None:
+            continue
+        if "error" in run:
+            regressions.append((run["case"], run["model"], run["engine"], "error", run["error"]))
+            continue
+        for name, time in run["times"].items():
+            if time > tolerance*base["times"][name] and time-base["times"][name] > min_time:
+                regressions.append((run["case"], run["model"], run["engine"], name, "{:.3f} s (baseline {:.3f} s)".format(time, base["times"][name])))
+        if run["max_rss_mb"] > tolerance*base["max_rss_mb"]:
+            regressions.append((run["case"], run["model"], run["engine"], "max_rss_mb", "{:.0f} MB (baseline {:.0f} MB)".format(run["max_rss_mb"], base["max_rss_mb"])))
+    return regressions
+
+def format_run(run: dict) -> str:
+    if "error" in run:
+        return "{:<18}{:<15}{:<7} error: {}".format(run["case"], run["model"], run["engine"], run["error"])
+    times = "".join("{:>10.3f}".format(run["times"][name]) for name in PHASES)
+    return "{:<18}{:<15}{:<7}{}{:>10.0f}".format(run["case"], run["model"], run["engine"], times, run["max_rss_mb"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling benchmark over the original MATPOWER library")
+    parser.add_argument("--ladder", choices=LADDERS, default="small")
+    parser.add_argument("--cases", nargs="+", help="Cases to run instead of a ladder")
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=MODELS)
+    parser.add_argument("--engines", nargs="+", choices=("pyomo", "highs"), default=["pyomo", "highs"])
+    parser.add_argument("--samples", type=int, default=200, help="Monte Carlo samples")
+    parser.add_argument("--candidates", type=int, default=5, help="Synthetic TEP candidates")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    print("{:<18}{:<15}{:<7}".format("Case", "Model", "Engine") + "".join("{:>10}".format(name[:9]) for name in PHASES) + "{:>10}".format("RSS (MB)"))
+    results = run_suite(args.cases or LADDERS[args.ladder], args.models, args.engines,
+                        n_candidates=args.candidates, n_samples=args.samples)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file))
+        for regression in regressions:
+            print("Regression: {} {} {} {}: {}".format(*regression))
+        sys.exit(1 if regressions else 0)
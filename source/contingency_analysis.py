@@ -0,0 +1,248 @@
+# LODF-based screening of branch outages on a base-case DC flow
+
+from basics.case_cache import load_system
+from basics.powersystem import PowerSystemData
+from basics.sensitivities import PTDF
+from basics.printing import print_centered_text, table_format, format_table, write_report
+from basics.profiling import Profiler
+from opf_basic import OPFBasic
+from scipy.sparse.csgraph import connected_components, depth_first_order
+import scipy.sparse as sp
+import numpy as np
+import io
+
+
+class ContingencyAnalysis:
+    """Class to screen N-1 and listed N-k branch outages with line outage distribution factors (LODF).
+
+    Post-contingency flows follow from the base-case flows without re-solving: taking out a fraction alpha of branch m
+    (one of its nlines circuits) moves the lost flow alpha*pf[m] through the transfer PTDF between its terminal buses.
+    Outages that split an island are reported with the buses they cut off instead of being evaluated.
+    """
+    def __init__(self, psd: PowerSystemData, block_size: int = 1024) -> None:
+        self.psd = psd
+        ebranch = self.psd.ebranch
+        self.ptdf = PTDF(ebranch.bus_fr, ebranch.bus_to, ebranch.b_lin, self.psd.bus.len)
+
+        # N-1 outages are evaluated block_size at a time, which bounds the dense matrices to branches x block_size
+        self.block_size = block_size
+        self.ISLANDING_TOL = 1e-6
+        self.OVERLOAD_TOL = 1e-6
+
+        # Dumb lines are not real circuits: they are neither taken out nor checked
+        self.nlines = np.ones(ebranch.len)
+        self.nlines[:len(ebranch.nlines)] = ebranch.nlines
+        self.outages = np.flatnonzero(~ebranch.is_dumb)
+        self.checked = ~ebranch.unlimited_branches & ~ebranch.is_dumb
+
+    def screen(self, pf: np.ndarray, outages: np.ndarray = None) -> dict:
+        """N-1: one circuit out of each branch in outages (all real branches by default)"""
+        outages = self.outages if outages is None else np.asarray(outages)
+        outcome = _Outcome(len(outages))
+        for start in range(0, len(outages), self.block_size):
+            block = outages[start:start+self.block_size]
+            cols = np.arange(len(block))
+            alpha = 1/self.nlines[block]
+
+            # Injections compensating the lost flow: alpha*pf[m] / (1 - alpha*PTDF of m for its own transfer)
+            transfer = self.ptdf.transfer_flows(block)
+            denominator = 1-alpha*transfer[block, cols]
+            islanding = np.abs(denominator) < self.ISLANDING_TOL
+            z = np.where(islanding, 0, alpha*pf[block]/np.where(islanding, 1, denominator))
+
+            post = pf[:, None]+transfer*z
+            post[block, cols] *= 1-alpha
+            flow_max = np.repeat(self.psd.ebranch.flow_max[:, None], len(block), axis=1)
+            flow_max[block, cols] *= 1-alpha
+            outcome.add(start+cols, post, flow_max, self.checked, self.OVERLOAD_TOL, islanding)
+
+        islanding = np.flatnonzero(outcome.islanding)
+        outcome.islanded_buses = dict(zip(islanding.tolist(), self._bridge_islands(outages[islanding])))
+        return outcome.results(outages)
+
+    def screen_multiple(self, pf: np.ndarray, outage_sets: list) -> dict:
+        """N-k: each set lists the branches taken out, one circuit per occurrence"""
+        outcome = _Outcome(len(outage_sets))
+        for idx, outage in enumerate(outage_sets):
+            branches, circuits = np.unique(np.asarray(outage, dtype=int), return_counts=True)
+            alpha = np.minimum(circuits/self.nlines[branches], 1)
+
+            islanded = self.islanded_buses(branches[alpha == 1])
+            if len(islanded) > 0:
+                outcome.islanding[idx] = True
+                outcome.islanded_buses[idx] = islanded
+                continue
+
+            # Compensating injections: (I - diag(alpha)*PTDF_KK) z = alpha*pf_K
+            transfer = self.ptdf.transfer_flows(branches)
+            z = np.linalg.solve(np.eye(len(branches))-alpha[:, None]*transfer[branches], alpha*pf[branches])
+
+            post = pf+transfer@z
+            post[branches] *= 1-alpha
+            flow_max = np.copy(self.psd.ebranch.flow_max)
+            flow_max[branches] *= 1-alpha
+            outcome.add(np.array([idx]), post[:, None], flow_max[:, None], self.checked, self.OVERLOAD_TOL, np.zeros(1, dtype=bool))
+        return outcome.results(np.arange(len(outage_sets)))
+
+    def islanded_buses(self, removed: np.ndarray) -> np.ndarray:
+        """Buses cut off from the larger part of their island when the removed branches are taken out.
+
+        Of equal parts, the one with the lowest-numbered bus stays in service.
+        """
+        if len(removed) == 0:
+            return np.zeros(0, dtype=int)
+        _, labels = connected_components(self._adjacency(removed), directed=False)
+
+        # The largest remaining part of each island stays in service
+        size = np.bincount(labels)[labels]
+        order = np.lexsort((-size, self.ptdf.island))
+        _, first = np.unique(self.ptdf.island[order], return_index=True)
+        main = labels[order[first]]
+        return np.flatnonzero(labels != main[self.ptdf.island])
+
+    def _bridge_islands(self, bridges: np.ndarray) -> list:
+        """islanded_buses of each bridge taken out alone, from the tree the bridges form between the remaining parts"""
+        nbus = self.psd.bus.len
+        if len(bridges) == 0:
+            return []
+        n_parts, part = connected_components(self._adjacency(bridges), directed=False)
+        part_fr = part[self.psd.ebranch.bus_fr[bridges]]
+        part_to = part[self.psd.ebranch.bus_to[bridges]]
+        tree = sp.coo_matrix((np.ones(len(bridges)), (part_fr, part_to)), shape=(n_parts, n_parts))
+
+        # Depth-first order from the slack of each island: the parts below any part of the tree are contiguous
+        order = []
+        parent = np.full(n_parts, -1)
+        for slack in self.ptdf.slack:
+            island_order, predecessors = depth_first_order(tree, part[slack], directed=False)
+            order.append(island_order)
+            parent[island_order[1:]] = predecessors[island_order[1:]]
+        order = np.concatenate(order)
+        position = np.empty(n_parts, dtype=int)
+        position[order] = np.arange(n_parts)
+
+        sub_size = np.bincount(part, minlength=n_parts)
+        sub_min = np.full(n_parts, nbus)
+        np.minimum.at(sub_min, part, np.arange(nbus))
+        for p in order[::-1]:
+            if parent[p] >= 0:
+                sub_size[parent[p]] += sub_size[p]
+                sub_min[parent[p]] = min(sub_min[parent[p]], sub_min[p])
+
+        # Buses sorted by the position of their part, so a subtree is a slice
+        bus_order = np.argsort(position[part], kind="stable")
+        start = np.concatenate(([0], np.cumsum(np.bincount(part, minlength=n_parts)[order])))[position]
+        island_size = np.bincount(self.ptdf.island)
+
+        islanded = []
+        for fr, to in zip(part_fr, part_to):
+            child = to if parent[to] == fr else fr
+            island = self.ptdf.island[sub_min[child]]
+            below = np.sort(bus_order[start[child]:start[child]+sub_size[child]])
+            rest = island_size[island]-sub_size[child]
+            if sub_size[child] < rest or (sub_size[child] == rest and sub_min[child] != self.ptdf.slack[island]):
+                islanded.append(below)
+            else:
+                islanded.append(np.setdiff1d(np.flatnonzero(self.ptdf.island == island), below))
+        return islanded
+
+    def _adjacency(self, removed: np.ndarray) -> sp.coo_matrix:
+        ebranch = self.psd.ebranch
+        kept = np.ones(ebranch.len, dtype=bool)
+        kept[removed] = False
+        return sp.coo_matrix((np.ones(np.sum(kept)), (ebranch.bus_fr[kept], ebranch.bus_to[kept])),
+                             shape=(self.psd.bus.len, self.psd.bus.len))
+
+
+class _Outcome:
+    """Accumulates the screening outcome of a list of outages"""
+    def __init__(self, n_outages: int) -> None:
+        self.islanding = np.zeros(n_outages, dtype=bool)
+        self.max_loading = np.full(n_outages, np.nan)
+        self.islanded_buses = dict()
+        self.overloads = []
+
+    def add(self, idx: np.ndarray, post: np.ndarray, flow_max: np.ndarray, checked: np.ndarray, tol: float,
+            islanding: np.ndarray) -> None:
+        """Records the outages idx, whose post-contingency flows are the columns of post"""
+        post = post[checked]
+        flow_max = flow_max[checked]
+        loading = np.divide(np.abs(post), flow_max, out=np.zeros(post.shape), where=flow_max > 0)
+        over = (np.abs(post) > flow_max+tol) & ~islanding
+        self.islanding[idx] = islanding
+        self.max_loading[idx] = np.where(islanding, np.nan, np.max(loading, axis=0, initial=0))
+
+        rows, cols = np.nonzero(over)
+        branches = np.flatnonzero(checked)
+        self.overloads.append(np.column_stack((idx[cols], branches[rows], post[rows, cols], loading[rows, cols])))
+
+    def results(self, outages: np.ndarray) -> dict:
+        overloads = np.concatenate(self.overloads) if self.overloads else np.zeros((0, 4))
+        return {"outage": outages,
+                "islanding": self.islanding,
+                "max_loading": self.max_loading,
+                "overload_outage": overloads[:, 0].astype(int),
+                "overload_branch": overloads[:, 1].astype(int),
+                "overload_flow": overloads[:, 2],
+                "overload_loading": overloads[:, 3],
+                "islanded_buses": self.islanded_buses}
+
+
+def contingency_report(psd: PowerSystemData, single: dict, multiple: dict = None) -> str:
+    out = io.StringIO()
+    print("-----------------------------------------", file=out)
+    print("----------Contingency Analysis-----------", file=out)
+    print("-----------------------------------------", file=out)
+
+    # Outages are named by branch (N-1) or by position in the list (N-k)
+    for title, results in (("N-1", single), ("N-k", multiple)):
+        if results is None:
+            continue
+        n_over = len(np.unique(results["overload_outage"]))
+        print("\n\n{}: {} outages, {} with overloads, {} islanding".format(title, len(results["outage"]), n_over,
+                                                                        np.sum(results["islanding"])), file=out)
+        if len(results["overload_outage"]) > 0:
+            ncol = 5
+            print_centered_text("{} overloads".format(title), file=out, ncol=ncol)
+            print(table_format(ncol=ncol).format("Outage", "Branch", "pflow", "limit", "loading"), file=out)
+            out.write(format_table([results["outage"][results["overload_outage"]]+1,
+                                    results["overload_branch"]+1,
+                                    results["overload_flow"],
+                                    psd.ebranch.flow_max[results["overload_branch"]],
+                                    results["overload_loading"]],
+                                   ["%9d", "%9d", "%9.4f", "%9.4f", "%9.4f"]))
+        for idx, buses in results["islanded_buses"].items():
+            print("Outage {} islands buses {}".format(results["outage"][idx]+1, buses+1), file=out)
+    return out.getvalue()
+
+def main_contingency_analysis(data_file: str, outage_sets: list=None, engine: str="pyomo", report: bool=False,
+                              file_name: str="source/.results/contingency.txt", profile_file: str=None) -> dict:
+    profiler = Profiler()
+    psd = load_system(data_file, profiler=profiler)
+
+    # Base case: the DC-OPF dispatch
+    op = OPFBasic(psd, engine=engine, profiler=profiler)
+    with profiler.phase("define_model"):
+        op.define_model()
+    with profiler.phase("solve_model"):
+        op.solve_model()
+    pf = op._extract_var("pf", psd.ebranch.set_all)
+
+    with profiler.phase("factorize"):
+        ca = ContingencyAnalysis(psd)
+    with profiler.phase("n_1"):
+        single = ca.screen(pf)
+    multiple = None
+    if outage_sets is not None:
+        with profiler.phase("n_k"):
+            multiple = ca.screen_multiple(pf, outage_sets)
+
+    if report:
+        write_report(contingency_report(psd, single, multiple), display=True, export=True, file_name=file_name)
+    if profile_file is not None:
+        profiler.dump(profile_file)
+    return {"pf": pf, "single": single, "multiple": multiple}
+
+if __name__ == "__main__":
+    data_file = "source/data/matpower/case24_ieee_rts_reliability.m"
+    main_contingency_analysis(data_file=data_file, outage_sets=[[0, 1], [10, 22]], report=True)
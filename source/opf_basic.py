@@ -1,26 +1,75 @@
 # Created in 05/03/2024 by Arthur
 
-from basics.readsystems import read_from_MATPOWER, read_from_ANAREDE
+from basics.case_cache import load_system
 from basics.powersystem import PowerSystemData
 from abc_classes.optimization import OptimizationProblem
 import pyomo.environ as pyo
+from pyomo.core.expr.numeric_expr import LinearExpression, MonomialTermExpression
 import numpy as np
-from basics.printing import print_centered_text, int_format, float_format, table_format, pyo_extract
-import sys
+from basics.printing import print_centered_text, table_format, format_table, write_report, save_results, pyo_extract
+from basics.matrix_model import MatrixModel
+from basics.profiling import Profiler, ProfiledModel
+from basics.sensitivities import PTDF
+import io
 from basics.read_systems_files import ReadSystemsFiles
 
 class OPFBasic(OptimizationProblem):
 
-    def __init__(self, psd: PowerSystemData) -> None:
+    def __init__(self, psd: PowerSystemData, engine: str = "pyomo", profiler: Profiler = None,
+                 formulation: str = "angle", lazy: bool = False, monitored: np.ndarray = None) -> None:
         # PowerSystemData injection
         self.psd = psd
         
         self.losses = np.zeros(self.psd.ebranch.len)
+
+        # Network: "angle" models angles and flows, "ptdf" writes the limited flows as functions of the injections
+        if formulation not in ("angle", "ptdf"):
+            raise ValueError("Unknown formulation '{}'".format(formulation))
+        self.formulation = formulation
+
+        # Monitored branches have their flow limits in the model. Lazy mode starts from the given ones (none by default)
+        # and adds the violated limits between re-solves; otherwise nothing would check the limits left out, so every
+        # limited branch is monitored along with the given ones
+        self.lazy = lazy
+        self.LAZY_TOL = 1e-6
+        self.lazy_iterations = 0
+        monitored = np.zeros(0, dtype=int) if monitored is None else np.asarray(monitored, dtype=int)
+        if lazy:
+            self.monitored = np.unique(monitored)
+        else:
+            self.monitored = np.union1d(monitored, np.flatnonzero(~self.psd.ebranch.unlimited_branches))
+        self.flow_max = np.copy(self.psd.ebranch.flow_max)  # Limits currently loaded, monitored or not
+
+        # Angle limits only bind through the low susceptance of dumb lines, so they are kept at their buses
+        ebranch = self.psd.ebranch
+        self.angle_monitored = np.union1d(ebranch.bus_fr[ebranch.is_dumb], ebranch.bus_to[ebranch.is_dumb])
+
+        # Phase timings and model statistics
+        self.profiler = Profiler() if profiler is None else profiler
         
         # Model
-        self.model = pyo.ConcreteModel(name=self.__class__.__name__)
+        self.engine = engine
+        if self.engine == "pyomo":
+            self.model = ProfiledModel(self.profiler, name=self.__class__.__name__)
+            self.solver = self.profiler.instrument_solver(pyo.SolverFactory('glpk'))
+        elif self.engine == "highs":
+            self.model = MatrixModel(self.profiler)
+        else:
+            raise ValueError("Unknown engine '{}'".format(self.engine))
     
     def define_model(self, debug: bool = False):
+        self.monitored_row = np.full(self.psd.ebranch.len, -1)
+        self.monitored_row[self.monitored] = np.arange(len(self.monitored))
+        if self.formulation == "ptdf":
+            self._init_ptdf()
+        if self.engine == "highs":
+            self._define_matrix_model()
+            return
+        if self.formulation == "ptdf":
+            self._define_ptdf_model()
+            if debug:
+                self._write_debug()
+            return
 
         # Mutable Parameters
         self.model.bus_pd_max = pyo.Param(self.psd.bus.set_all, initialize=self.psd.bus.pd_max, mutable=True)
@@ -46,14 +95,278 @@ class OPFBasic(OptimizationProblem):
 
         # Data file for debug
         if debug:
-            with open('source/.results/output.txt', 'w') as file:
+            self._write_debug()
+
+    def _define_ptdf_model(self) -> None:
+        # Mutable Parameters
+        self.model.bus_pd_max = pyo.Param(self.psd.bus.set_all, initialize=self.psd.bus.pd_max, mutable=True)
+        self.model.ebranch_flow_max = pyo.Param(self.psd.ebranch.set_all, initialize=self.psd.ebranch.flow_max, mutable=True)
+        self.model.gen_pg_max = pyo.Param(self.psd.gen.set_all, initialize=self.psd.gen.pg_max, mutable=True)
+        self.model.ptdf_flow_offset = pyo.Param(self.psd.ebranch.set_all, initialize=self.flow_offset, mutable=True)
+        self.model.ptdf_angle_offset = pyo.Param(self.psd.bus.set_all, initialize=self.angle_offset, mutable=True)
+        self.model.set_monitored = pyo.Set(initialize=self.monitored.tolist(), ordered=True)
+
+        # Variables
+        self.model.pg = pyo.Var(self.psd.gen.set_all, within=pyo.Reals, bounds=self._bounds_pg)  # Power Generation
+        self.model.sl = pyo.Var(self.psd.bus.set_with_demand, within=pyo.Reals, bounds=self._bounds_sl)  # Load shedding
+
+        # Objective
+        self.model.obj = pyo.Objective(expr=self._create_objective())
+
+        # Constraints
+        self.model.con_system_balance = pyo.Constraint(np.arange(self.ptdf.n_islands), rule=self._rule_system_balance)
+        self.model.con_flow_limit = pyo.Constraint(self.model.set_monitored, rule=self._rule_flow_limit)
+        self.model.con_angle_limit = pyo.Constraint(self.angle_monitored, rule=self._rule_angle_limit)
+
+    def _init_ptdf(self) -> None:
+        """Factorizes the network and computes the sensitivities of the monitored flows and angles to generation and shedding"""
+        ebranch = self.psd.ebranch
+        self.ptdf = PTDF(ebranch.bus_fr, ebranch.bus_to, ebranch.b_lin, self.psd.bus.len)
+        self.ptdf_pd = np.copy(self.psd.bus.pd_max)
+        self.ptdf_buses = np.union1d(self.psd.gen.bus, self.psd.bus.set_with_demand)
+        self.angle_row = np.full(self.psd.bus.len, -1)
+        self.angle_row[self.angle_monitored] = np.arange(len(self.angle_monitored))
+        self._ptdf_coefficients()
+
+    def _ptdf_coefficients(self) -> None:
+        # Rows follow self.monitored (flows) and self.angle_monitored (angles)
+        self.flow_gen, self.flow_sl = self._ptdf_split(self.ptdf.matrix(self.monitored, self.ptdf_buses))
+        self.angle_gen, self.angle_sl = self._ptdf_split(self.ptdf.angle_matrix(self.angle_monitored, self.ptdf_buses))
+        self._ptdf_offsets()
+
+    def _ptdf_split(self, sensitivities: np.ndarray) -> tuple:
+        """Columns of a block over ptdf_buses for generation and for shedding"""
+        sensitivities[np.abs(sensitivities) < 1e-10] = 0  # Round-off would spoil the solver scaling
+        return (sensitivities[:, np.searchsorted(self.ptdf_buses, self.psd.gen.bus)],
+                sensitivities[:, np.searchsorted(self.ptdf_buses, self.psd.bus.set_with_demand)])
+
+    def _ptdf_offsets(self) -> None:
+        """Flows and angles caused by the demand alone"""
+        self.flow_offset = self.ptdf.flows(self.ptdf_pd)
+        self.angle_offset = self.ptdf.angles(self.ptdf_pd)
+
+    def _flow_limit_bounds(self, branches: np.ndarray) -> tuple:
+        return -self.flow_max[branches]+self.flow_offset[branches], self.flow_max[branches]+self.flow_offset[branches]
+
+    def _angle_limit_bounds(self) -> tuple:
+        return -np.pi+self.angle_offset[self.angle_monitored], np.pi+self.angle_offset[self.angle_monitored]
+
+    def _add_ptdf_terms(self, con: str, rows: np.ndarray, gen_block: np.ndarray, sl_block: np.ndarray) -> None:
+        for term in self._ptdf_terms(rows, gen_block, sl_block):
+            self.model.add_terms(con, *term)
+
+    def _ptdf_terms(self, rows: np.ndarray, gen_block: np.ndarray, sl_block: np.ndarray) -> list:
+        """Nonzero sensitivities of the blocks as (rows, var, cols, vals) terms of the matrix model"""
+        terms = []
+        for var, block in (("pg", gen_block), ("sl", sl_block)):
+            r, c = np.nonzero(block)
+            terms.append((rows[r], var, c, block[r, c]))
+        return terms
+
+    def _write_debug(self, file_name: str = "source/.results/output.txt") -> None:
+        """Writes the whole Pyomo model, which can take longer than building it on large cases"""
+        with self.profiler.phase("debug_output"):
+            with open(file_name, 'w') as file:
                 self.model.pprint(ostream=file)
     
+    def _define_matrix_model(self) -> None:
+        bus = self.psd.bus
+        ebranch = self.psd.ebranch
+        gen = self.psd.gen
+
+        if self.formulation == "ptdf":
+            self.model.add_var("pg", gen.len, lb=0, ub=gen.pg_max, cost=gen.cost)  # Power Generation
+            self.model.add_var("sl", len(bus.set_with_demand), lb=0, ub=bus.pd_max[bus.set_with_demand], cost=bus.sl_cost)  # Load shedding
+
+            # System balance, by island: sum(pg) + sum(sl) == sum(pd_max)
+            pd_island = np.bincount(self.ptdf.island, weights=bus.pd_max, minlength=self.ptdf.n_islands)
+            self.model.add_con("system_balance", self.ptdf.n_islands, lb=pd_island, ub=pd_island)
+            self.model.add_terms("system_balance", self.ptdf.island[gen.bus], "pg", gen.set_all, +1)
+            self.model.add_terms("system_balance", self.ptdf.island[bus.set_with_demand], "sl", np.arange(len(bus.set_with_demand)), +1)
+
+            # Flow and angle limits: -limit <= ptdf_gen*pg + ptdf_sl*sl - ptdf*pd_max <= limit
+            lb, ub = self._flow_limit_bounds(self.monitored)
+            self.model.add_con("flow_limit", len(self.monitored), lb=lb, ub=ub)
+            self._add_ptdf_terms("flow_limit", np.arange(len(self.monitored)), self.flow_gen, self.flow_sl)
+            lb, ub = self._angle_limit_bounds()
+            self.model.add_con("angle_limit", len(self.angle_monitored), lb=lb, ub=ub)
+            self._add_ptdf_terms("angle_limit", np.arange(len(self.angle_monitored)), self.angle_gen, self.angle_sl)
+            return
+
+        # Variables
+        th_max = np.pi*np.ones(bus.len)
+        th_max[0] = 0
+        self.model.add_var("pg", gen.len, lb=0, ub=gen.pg_max, cost=gen.cost)  # Power Generation
+        self.model.add_var("th", bus.len, lb=-th_max, ub=th_max)  # Voltage angle
+        self.model.add_var("sl", len(bus.set_with_demand), lb=0, ub=bus.pd_max[bus.set_with_demand], cost=bus.sl_cost)  # Load shedding
+        flow_max = np.where(self.monitored_row >= 0, ebranch.flow_max, np.inf) if self.lazy else ebranch.flow_max
+        self.model.add_var("pf", ebranch.len, lb=-flow_max, ub=flow_max)  # Active Power Flow
+
+        # Power balance: pg_inj - pf_inj + sl_inj == pd_max
+        self.model.add_con("power_balance", bus.len, lb=bus.pd_max, ub=bus.pd_max)
+        self.model.add_terms("power_balance", gen.bus, "pg", gen.set_all, +1)
+        self.model.add_terms("power_balance", ebranch.bus_fr, "pf", ebranch.set_all, -1)
+        self.model.add_terms("power_balance", ebranch.bus_to, "pf", ebranch.set_all, +1)
+        self.model.add_terms("power_balance", bus.set_with_demand, "sl", np.arange(len(bus.set_with_demand)), +1)
+
+        # Power flow: pf + b_lin*(th_fr-th_to) == 0
+        self.model.add_con("power_flow", ebranch.len, lb=0, ub=0)
+        self.model.add_terms("power_flow", ebranch.set_all, "pf", ebranch.set_all, +1)
+        self.model.add_terms("power_flow", ebranch.set_all, "th", ebranch.bus_fr, +ebranch.b_lin)
+        self.model.add_terms("power_flow", ebranch.set_all, "th", ebranch.bus_to, -ebranch.b_lin)
+
     def solve_model(self) -> None:
-        solver = pyo.SolverFactory('glpk')
-        solver.solve(self.model)
+        self._solve()
+        self.lazy_iterations = 1
+        if not self.lazy:
+            return
+
+        # Violated limits are added until the solution is feasible for all branches
+        violated = self._violated_branches()
+        while len(violated) > 0:
+            self._monitor(violated)
+            self._solve()
+            self.lazy_iterations += 1
+            violated = self._violated_branches()
+
+    def _solve(self) -> None:
+        if self.engine == "highs":
+            self.model.solve()
+            self.optimal = self.model.optimal
+            return
+        results = self.solver.solve(self.model)
+        # Shell solvers (GLPK) report under results.solver, persistent ones (APPSI HiGHS) on the results themselves
+        status = results.solver if hasattr(results, "solver") else results
+        self.optimal = status.termination_condition.name == "optimal"
+
+    def _violated_branches(self) -> np.ndarray:
+        pf = self._extract_var("pf", self.psd.ebranch.set_all)
+        return np.flatnonzero((np.abs(pf) > self.flow_max+self.LAZY_TOL) & (self.monitored_row < 0))
+
+    def _monitor(self, branches: np.ndarray) -> None:
+        """Adds the flow limits of branches to the model"""
+        rows = len(self.monitored)+np.arange(len(branches))
+        self.monitored = np.concatenate((self.monitored, branches))
+        self.monitored_row[branches] = rows
+
+        if self.formulation == "angle":
+            if self.engine == "highs":
+                self.model.set_var_bounds("pf", -self.flow_max[branches], self.flow_max[branches], branches)
+                return
+            for k in branches.tolist():
+                self.model.pf[k].setlb(-self.model.ebranch_flow_max[k])
+                self.model.pf[k].setub(self.model.ebranch_flow_max[k])
+            return
+
+        flow_gen, flow_sl = self._ptdf_split(self.ptdf.matrix(branches, self.ptdf_buses))
+        self.flow_gen = np.vstack((self.flow_gen, flow_gen))
+        self.flow_sl = np.vstack((self.flow_sl, flow_sl))
+        if self.engine == "highs":
+            lb, ub = self._flow_limit_bounds(branches)
+            self.model.add_con("flow_limit", len(branches), lb=lb, ub=ub)
+            self._add_ptdf_terms("flow_limit", rows, flow_gen, flow_sl)
+            return
+        for k in branches.tolist():
+            self.model.set_monitored.add(k)
+            con = self._rule_flow_limit(None, k)
+            if con is not pyo.Constraint.Skip:
+                self.model.con_flow_limit.add(k, con)
+
+    def _extract_var(self, name: str, set: np.ndarray) -> np.ndarray:
+        if self.formulation == "ptdf" and name in ("th", "pf"):
+            # Angles and flows are recovered from the net injections
+            injection = np.bincount(self.psd.gen.bus, weights=self._extract_var("pg", self.psd.gen.set_all), minlength=self.psd.bus.len)
+            injection[self.psd.bus.set_with_demand] += self._extract_var("sl", self.psd.bus.set_with_demand)
+            injection -= self.ptdf_pd
+            return self.ptdf.angles(injection) if name == "th" else self.ptdf.flows(injection)
+        if self.engine == "highs":
+            return self.model.value(name)
+        return pyo_extract(getattr(self.model, name), set)
+
+    def _objective_value(self) -> float:
+        if self.engine == "highs":
+            return self.model.objective
+        return pyo.value(self.model.obj)
+
+    def _set_bus_pd_max(self, pd_max: np.ndarray) -> None:
+        if self.formulation == "ptdf":
+            self.ptdf_pd = np.copy(pd_max)
+            self._ptdf_offsets()
+            self._update_ptdf_bounds(pd_max)
+        if self.engine == "highs":
+            if self.formulation == "ptdf":
+                self.model.set_var_bounds("sl", 0, pd_max[self.psd.bus.set_with_demand])
+                return
+            self.model.set_con_bounds("power_balance", pd_max, pd_max)
+            self.model.set_var_bounds("sl", 0, pd_max[self.psd.bus.set_with_demand])
+            return
+        self.model.bus_pd_max.store_values(dict(zip(self.psd.bus.set_all.tolist(), pd_max.tolist())), check=False)
+
+    def _set_gen_pg_max(self, pg_max: np.ndarray, gens: np.ndarray) -> None:
+        if self.engine == "highs":
+            self.model.set_var_bounds("pg", 0, pg_max, gens)
+            return
+        self.model.gen_pg_max.store_values(dict(zip(np.asarray(gens).tolist(), np.asarray(pg_max).tolist())), check=False)
+
+    def _set_ebranch_flow_max(self, flow_max: np.ndarray, branches: np.ndarray) -> None:
+        self.flow_max[branches] = flow_max
+        if self.engine == "highs":
+            if self.formulation == "ptdf":
+                self._update_ptdf_bounds()
+            elif self.lazy:
+                bounded = self.monitored_row[branches] >= 0
+                self.model.set_var_bounds("pf", -flow_max[bounded], flow_max[bounded], branches[bounded])
+            else:
+                self.model.set_var_bounds("pf", -flow_max, flow_max, branches)
+            return
+        self.model.ebranch_flow_max.store_values(dict(zip(np.asarray(branches).tolist(), np.asarray(flow_max).tolist())), check=False)
+
+    def _set_ebranch_b_lin(self, b_lin: np.ndarray, branches: np.ndarray) -> None:
+        if self.formulation == "ptdf":
+            self._set_ptdf_b_lin(b_lin, branches)
+            return
+        if self.engine == "highs":
+            self.model.set_coef("power_flow", branches, "th", self.psd.ebranch.bus_fr[branches], +b_lin)
+            self.model.set_coef("power_flow", branches, "th", self.psd.ebranch.bus_to[branches], -b_lin)
+            return
+        self.model.ebranch_b_lin.store_values(dict(zip(np.asarray(branches).tolist(), np.asarray(b_lin).tolist())), check=False)
     
+    def _update_ptdf_bounds(self, pd_max: np.ndarray = None) -> None:
+        """Pushes the demand-dependent bounds of the PTDF constraints to the model"""
+        if self.engine == "highs":
+            lb, ub = self._flow_limit_bounds(self.monitored)
+            self.model.set_con_bounds("flow_limit", lb, ub)
+            lb, ub = self._angle_limit_bounds()
+            self.model.set_con_bounds("angle_limit", lb, ub)
+            if pd_max is not None:
+                pd_island = np.bincount(self.ptdf.island, weights=pd_max, minlength=self.ptdf.n_islands)
+                self.model.set_con_bounds("system_balance", pd_island, pd_island)
+            return
+        self.model.ptdf_flow_offset.store_values(dict(zip(self.psd.ebranch.set_all.tolist(), self.flow_offset.tolist())), check=False)
+        self.model.ptdf_angle_offset.store_values(dict(zip(self.psd.bus.set_all.tolist(), self.angle_offset.tolist())), check=False)
+
+    def _set_ptdf_b_lin(self, b_lin: np.ndarray, branches: np.ndarray) -> None:
+        """Refactorizes the network and replaces the flow limit coefficients"""
+        b_lin_all = -self.ptdf.b
+        b_lin_all[branches] = b_lin
+        self.ptdf.factorize(b_lin_all)
+        self._ptdf_coefficients()
+        if self.engine == "highs":
+            # Dense blocks change as a whole, so their rows are replaced in bulk
+            for con, gen_block, sl_block in (("flow_limit", self.flow_gen, self.flow_sl),
+                                             ("angle_limit", self.angle_gen, self.angle_sl)):
+                self.model.replace_terms(con, self._ptdf_terms(np.arange(len(gen_block)), gen_block, sl_block))
+            self._update_ptdf_bounds()
+            return
+        self._update_ptdf_bounds()
+        self.model.del_component(self.model.con_flow_limit)
+        self.model.del_component(self.model.con_angle_limit)
+        self.model.con_flow_limit = pyo.Constraint(self.model.set_monitored, rule=self._rule_flow_limit)
+        self.model.con_angle_limit = pyo.Constraint(self.angle_monitored, rule=self._rule_angle_limit)
+
     def _bounds_pf(self, _, k: int) -> tuple:
+        if self.lazy and self.monitored_row[k] < 0:
+            return (None, None)
         return (-self.model.ebranch_flow_max[k], +self.model.ebranch_flow_max[k])
     
     def _bounds_pg(self, _, g: int) -> tuple:
@@ -67,15 +380,15 @@ class OPFBasic(OptimizationProblem):
     
     def _pf_inj(self, b: int) -> pyo.Expression:
         pf_inj = 0
-        for k in np.where(self.psd.ebranch.bus_fr == b)[0]:
+        for k in self.psd.incidence.ebranch_fr[b]:
             pf_inj += self.model.pf[k]
-        for k in np.where(self.psd.ebranch.bus_to == b)[0]:
+        for k in self.psd.incidence.ebranch_to[b]:
             pf_inj -= self.model.pf[k]
         return pf_inj
     
     def _pg_inj(self, b: int) -> pyo.Expression:
         pg_inj = 0
-        for g in np.where(self.psd.gen.bus == b)[0]:
+        for g in self.psd.incidence.gen[b]:
             pg_inj += self.model.pg[g]
         return pg_inj
     
@@ -87,8 +400,39 @@ class OPFBasic(OptimizationProblem):
         kj = self.psd.ebranch.bus_to[k]
         return self.model.pf[k] == -self.model.ebranch_b_lin[k]*(self.model.th[ki]-self.model.th[kj])
     
+    def _rule_system_balance(self, _, i: int) -> pyo.Expression:
+        gens = self.psd.gen.set_all[self.ptdf.island[self.psd.gen.bus] == i]
+        buses = np.flatnonzero(self.ptdf.island == i)
+        if len(gens) == 0 and not np.any(self.psd.bus.has_demand[buses]):
+            return pyo.Constraint.Skip
+        return (sum(self.model.pg[g] for g in gens)+sum(self._sl_inj(b) for b in buses) ==
+                sum(self.model.bus_pd_max[b] for b in buses))
+
+    def _rule_flow_limit(self, _, k: int) -> pyo.Expression:
+        row = self.monitored_row[k]
+        if not (np.any(self.flow_gen[row]) or np.any(self.flow_sl[row])):
+            return pyo.Constraint.Skip
+        return (-self.model.ebranch_flow_max[k]+self.model.ptdf_flow_offset[k], self._ptdf_inj(self.flow_gen[row], self.flow_sl[row]),
+                self.model.ebranch_flow_max[k]+self.model.ptdf_flow_offset[k])
+
+    def _rule_angle_limit(self, _, b: int) -> pyo.Expression:
+        row = self.angle_row[b]
+        if not (np.any(self.angle_gen[row]) or np.any(self.angle_sl[row])):
+            return pyo.Constraint.Skip
+        return (-np.pi+self.model.ptdf_angle_offset[b], self._ptdf_inj(self.angle_gen[row], self.angle_sl[row]),
+                np.pi+self.model.ptdf_angle_offset[b])
+
+    def _ptdf_inj(self, gen_row: np.ndarray, sl_row: np.ndarray) -> pyo.Expression:
+        """Flow or angle of a PTDF row due to generation and shedding"""
+        gens = np.flatnonzero(gen_row)
+        sls = np.flatnonzero(sl_row)
+        coefs = np.concatenate((gen_row[gens], sl_row[sls])).tolist()
+        variables = [self.model.pg[g] for g in gens.tolist()]+[self.model.sl[b] for b in self.psd.bus.set_with_demand[sls].tolist()]
+        # Dense rows: a LinearExpression is built much faster than a sum
+        return LinearExpression([MonomialTermExpression(term) for term in zip(coefs, variables)])
+
     def _sl_inj(self, b: int):
-        if b in self.psd.bus.set_with_demand:
+        if self.psd.bus.has_demand[b]:
             return self.model.sl[b]
         return 0
     
@@ -102,78 +446,94 @@ class OPFBasic(OptimizationProblem):
                     export: bool=True,
                     display: bool=True,
                     file_name: str="source/.results/results.txt",
-                    name_file_test: str=None) -> None:
-        with open(file_name, "w") as file:
-            for idx, out in enumerate([sys.stdout, file]):
-                if idx == 0 and not display:
-                    continue
-                if idx == 1 and not export:
-                    continue
-                print("-----------------------------------------", file=out)
-                print("-----------------Results-----------------", file=out)
-                print("-----------------------------------------", file=out)
-
-                print("\n\n", file=out)
-                ncol = 4
-                print_centered_text("Bus data", file=out, ncol=ncol)
-                print(table_format(ncol=ncol).format("Bus", "pg", "LShed", "Angle"), file=out)
-                for b in self.psd.bus.set_all:
-                    bus = int_format(b+1)
-                    gen = float_format(self._pg_inj(b))
-                    lshed = float_format(self._sl_inj(b))
-                    angle = float_format(self.model.th[b])
-                    print(bus + gen + lshed + angle, file=out)
-                
-                print("\n\n", file=out)
-                ncol = 5
-                print_centered_text("Existent branch data", file=out, ncol=ncol)
-                print(table_format(ncol=ncol).format("Branch", "fr", "to", "pflow", "losses"), file=out)
-                for k in self.psd.ebranch.set_all:
-                    branch = int_format(k+1)
-                    fr = int_format(self.psd.ebranch.bus_fr[k]+1)
-                    to = int_format(self.psd.ebranch.bus_to[k]+1)
-                    pflow = float_format(self.model.pf[k])
-                    losses = float_format(self.losses[k])
-                    print(branch + fr + to + pflow + losses, file=out)
-                
-                print("\n\n", file=out)
-                ncol = 4
-                print_centered_text("Generation data", file=out, ncol=ncol)
-                print(table_format(ncol=ncol).format("Gen", "Bus", "pg", "cost"), file=out)
-                for g in self.psd.gen.set_all:
-                    gen = int_format(g+1)
-                    bus = int_format(self.psd.gen.bus[g]+1)
-                    pg = float_format(self.model.pg[g])
-                    cost = float_format(self.model.pg[g]*self.psd.gen.cost[g])
-                    print(gen + bus + pg + cost, file=out)
-
-                print("\nObjective:", file=out)
-                print(pyo.value(self.model.obj), file=out)
-
-                print("\nTotal Power generation cost:", file=out)
-                print(pyo.value(self._total_pg_cost()), file=out)
-
-                print("\nTotal Load shedding cost:", file=out)
-                print(pyo.value(self._total_sl_cost()), file=out)
-        
-        self.results = dict()
+                    name_file_test: str=None,
+                    report: bool=False,
+                    results_file: str="source/.results/results.npz") -> None:
+        self._extract_results()
+        if export:
+            save_results(self.results, results_file)
 
-        # Extracting results
-        self.results["pg"] = pyo_extract(self.model.pg, self.psd.gen.set_all)
-        self.results["th"] = pyo_extract(self.model.th, self.psd.bus.set_all)
-        self.results["sl"] = pyo_extract(self.model.sl, self.psd.bus.set_with_demand)
-        self.results["pf"] = pyo_extract(self.model.pf, self.psd.ebranch.set_all)
+        # The text report is only built on request
+        if report:
+            write_report(self._report(), display=display, export=export, file_name=file_name)
 
         if name_file_test is not None:
             np.save(name_file_test, self.results)
 
-def main_opf_basic(data_file: str, name_file_test: str=None) -> None:
-    system_data = read_from_MATPOWER(data_file)
-    psd = PowerSystemData(system_data=system_data)
-    op = OPFBasic(psd)
-    op.define_model(debug=True)
-    op.solve_model()
-    op.get_results(name_file_test=name_file_test)
+    def _extract_results(self) -> None:
+        self.results = dict()
+
+        # Extracting results
+        self.results["pg"] = self._extract_var("pg", self.psd.gen.set_all)
+        self.results["th"] = self._extract_var("th", self.psd.bus.set_all)
+        self.results["sl"] = self._extract_var("sl", self.psd.bus.set_with_demand)
+        self.results["pf"] = self._extract_var("pf", self.psd.ebranch.set_all)
+        if self.lazy:
+            # Active monitored set, a seed for later runs
+            self.results["monitored"] = np.sort(self.monitored)
+
+    def _report(self) -> str:
+        pg_bus = np.bincount(self.psd.gen.bus, weights=self.results["pg"], minlength=self.psd.bus.len)
+        sl_bus = np.zeros(self.psd.bus.len)
+        sl_bus[self.psd.bus.set_with_demand] = self.results["sl"]
+
+        out = io.StringIO()
+        print("-----------------------------------------", file=out)
+        print("-----------------Results-----------------", file=out)
+        print("-----------------------------------------", file=out)
+
+        print("\n\n", file=out)
+        ncol = 4
+        print_centered_text("Bus data", file=out, ncol=ncol)
+        print(table_format(ncol=ncol).format("Bus", "pg", "LShed", "Angle"), file=out)
+        out.write(format_table([self.psd.bus.set_all+1, pg_bus, sl_bus, self.results["th"]],
+                               ["%9d", "%9.4f", "%9.4f", "%9.4f"]))
+        
+        print("\n\n", file=out)
+        ncol = 5
+        print_centered_text("Existent branch data", file=out, ncol=ncol)
+        print(table_format(ncol=ncol).format("Branch", "fr", "to", "pflow", "losses"), file=out)
+        out.write(format_table([self.psd.ebranch.set_all+1, self.psd.ebranch.bus_fr+1, self.psd.ebranch.bus_to+1,
+                                self.results["pf"], self.losses],
+                               ["%9d", "%9d", "%9d", "%9.4f", "%9.4f"]))
+        
+        print("\n\n", file=out)
+        ncol = 4
+        print_centered_text("Generation data", file=out, ncol=ncol)
+        print(table_format(ncol=ncol).format("Gen", "Bus", "pg", "cost"), file=out)
+        out.write(format_table([self.psd.gen.set_all+1, self.psd.gen.bus+1, self.results["pg"],
+                                self.results["pg"]*self.psd.gen.cost],
+                               ["%9d", "%9d", "%9.4f", "%9.4f"]))
+
+        print("\nObjective:", file=out)
+        print(self._objective_value(), file=out)
+
+        print("\nTotal Power generation cost:", file=out)
+        print(self.psd.gen.cost @ self.results["pg"], file=out)
+
+        print("\nTotal Load shedding cost:", file=out)
+        print(self.psd.bus.sl_cost*np.sum(self.results["sl"]), file=out)
+
+        if self.lazy:
+            print("\nMonitored branches ({} of {}, {} solves):".format(len(self.monitored), self.psd.ebranch.len, self.lazy_iterations), file=out)
+            print(np.sort(self.monitored)+1, file=out)
+        return out.getvalue()
+
+def main_opf_basic(data_file: str, name_file_test: str=None, engine: str="pyomo", report: bool=False,
+                   debug: bool=False, profile_file: str=None, formulation: str="angle", lazy: bool=False,
+                   monitored: np.ndarray=None) -> None:
+    profiler = Profiler()
+    psd = load_system(data_file, profiler=profiler)
+    op = OPFBasic(psd, engine=engine, profiler=profiler, formulation=formulation, lazy=lazy, monitored=monitored)
+    with profiler.phase("define_model"):
+        op.define_model(debug=debug)
+    with profiler.phase("solve_model"):
+        op.solve_model()
+    with profiler.phase("get_results"):
+        op.get_results(name_file_test=name_file_test, report=report)
+    if profile_file is not None:
+        profiler.record_model(op.model)
+        profiler.dump(profile_file)
     return op.results
 
 if __name__ == "__main__":
@@ -184,5 +544,5 @@ if __name__ == "__main__":
         name_file_test = "source/tests/results/res_OPFBasic_case3.npy"
         main_opf_basic(data_file=data_file, name_file_test=name_file_test)
     else:
-        main_opf_basic(data_file=data_file)
+        main_opf_basic(data_file=data_file, report=True, debug=True)
         
\ No newline at end of file
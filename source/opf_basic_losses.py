@@ -1,23 +1,107 @@
-from basics.printing import pyo_extract
 from opf_basic import OPFBasic
 from abc_classes.optimization import PowerSystemData
-from basics.readsystems import read_from_MATPOWER
+from basics.case_cache import load_system
+from basics.profiling import Profiler
+from basics.printing import pyo_extract_2D
+from pyomo.contrib.appsi.solvers import Highs
+import pyomo.environ as pyo
 import numpy as np
 
 class OPFBasicLoss(OPFBasic):
 
-    def __init__(self, psd: PowerSystemData, MAX_ITER: int = 4, TOL: float = 1e-8,) -> None:
-        super().__init__(psd)
+    def __init__(self, psd: PowerSystemData, MAX_ITER: int = 4, TOL: float = 1e-8, engine: str = "pyomo",
+                 profiler: Profiler = None, persistent: bool = True, method: str = "iterative", n_segments: int = 8,
+                 dth_max: np.ndarray = None, max_dth: float = np.pi/4) -> None:
+        super().__init__(psd, engine=engine, profiler=profiler)
 
         self.MAX_ITER = MAX_ITER
         self.TOL = TOL
 
+        # Losses: "iterative" moves them into the demand between solves, "pwl" models them in a single LP
+        if method not in ("iterative", "pwl"):
+            raise ValueError("Unknown losses method '{}'".format(method))
+        self.method = method
+
+        # Piecewise linear losses: |th_fr-th_to| <= dth_max is split into n_segments of equal width per branch
+        self.n_segments = n_segments
+        self.set_segments = np.arange(n_segments)
+        if dth_max is None:
+            # Angle difference at the flow limit, which the flow bounds already impose
+            dth_max = np.minimum(self.psd.ebranch.flow_max/np.abs(self.psd.ebranch.b_lin), max_dth)
+        self.dth_max = np.broadcast_to(np.asarray(dth_max, dtype=float), self.psd.ebranch.len)
+        self.segment_width = self.dth_max/n_segments
+
+        # Slope of the losses 0.5*g*dth**2 on each segment, by branch
+        self.segment_cost = 0.5*self.psd.ebranch.g[:, None]*self.segment_width[:, None]*(2*self.set_segments[None, :]+1)
+
+        # Persistent solver: iterations only push the new demands to HiGHS, which restarts from the previous basis
+        if self.engine == "pyomo" and persistent:
+            self.solver = Highs()
+            self.solver.update_config.check_for_new_or_removed_constraints = False
+            self.solver.update_config.check_for_new_or_removed_vars = False
+            self.solver.update_config.check_for_new_or_removed_params = False
+            self.solver.update_config.check_for_new_objective = False
+            self.solver.update_config.update_constraints = False
+            self.solver.update_config.update_vars = False
+            self.solver.update_config.update_named_expressions = False
+            self.solver.update_config.update_objective = False
+            self.profiler.instrument_solver(self.solver)
+
         self.pd_max0 = np.copy(self.psd.bus.pd_max)
 
         # For this class, all buses have demand
         self.psd.bus.define_all_as_demand()
 
+    def define_model(self, debug: bool = False):
+        if self.method != "pwl" or self.engine == "highs":
+            super().define_model(debug)
+            return
+
+        # Angle difference segments in each direction
+        self.model.dth_pos = pyo.Var(self.psd.ebranch.set_all, self.set_segments, within=pyo.NonNegativeReals, bounds=self._bounds_dth)
+        self.model.dth_neg = pyo.Var(self.psd.ebranch.set_all, self.set_segments, within=pyo.NonNegativeReals, bounds=self._bounds_dth)
+        self.model.loss = pyo.Expression(self.psd.ebranch.set_all, rule=self._rule_loss)
+
+        super().define_model()
+
+        self.model.con_angle_difference = pyo.Constraint(self.psd.ebranch.set_all, rule=self._rule_angle_difference)
+
+        # Data file for debug
+        if debug:
+            self._write_debug()
+
+    def _define_matrix_model(self) -> None:
+        super()._define_matrix_model()
+        if self.method != "pwl":
+            return
+        ebranch = self.psd.ebranch
+
+        # Segment (k, s) is column k*n_segments+s
+        cols = np.arange(ebranch.len*self.n_segments)
+        k_of = np.repeat(ebranch.set_all, self.n_segments)
+        width = np.repeat(self.segment_width, self.n_segments)
+        self.model.add_var("dth_pos", len(cols), lb=0, ub=width)
+        self.model.add_var("dth_neg", len(cols), lb=0, ub=width)
+
+        # Angle difference: th_fr - th_to - sum(dth_pos) + sum(dth_neg) == 0
+        self.model.add_con("angle_difference", ebranch.len, lb=0, ub=0)
+        self.model.add_terms("angle_difference", ebranch.set_all, "th", ebranch.bus_fr, +1)
+        self.model.add_terms("angle_difference", ebranch.set_all, "th", ebranch.bus_to, -1)
+        self.model.add_terms("angle_difference", k_of, "dth_pos", cols, -1)
+        self.model.add_terms("angle_difference", k_of, "dth_neg", cols, +1)
+
+        # Power balance: half of the losses of each branch is drawn at each end
+        cost = self.segment_cost.ravel()
+        for bus in (ebranch.bus_fr, ebranch.bus_to):
+            self.model.add_terms("power_balance", bus[k_of], "dth_pos", cols, -0.5*cost)
+            self.model.add_terms("power_balance", bus[k_of], "dth_neg", cols, -0.5*cost)
+
     def solve_model(self) -> None:
+        if self.method == "pwl":
+            super().solve_model()
+            self.losses = np.sum(self.segment_cost*(self._extract_segments("dth_pos")+self._extract_segments("dth_neg")), axis=1)
+            return
+
         for iter in range(self.MAX_ITER):
             print("... iter:", iter+1)
             
@@ -33,31 +117,62 @@ class OPFBasicLoss(OPFBasic):
 
     def _update_pd_max(self) -> None:
         self.pd_max_old = np.copy(self.psd.bus.pd_max)
-        self.psd.bus.pd_max = np.copy(self.pd_max0)
-
-        th = pyo_extract(self.model.th, self.psd.bus.set_all)
-        for k in self.psd.ebranch.set_all:
-            
-            ki = self.psd.ebranch.bus_fr[k]
-            kj = self.psd.ebranch.bus_to[k]
-            self.losses[k] = 0.5 * self.psd.ebranch.g[k]*(th[ki]-th[kj])**2
 
-            self.psd.bus.pd_max[ki] += 0.5*self.losses[k]
-            self.psd.bus.pd_max[kj] += 0.5*self.losses[k]
+        # Losses of each branch are split between its terminal buses
+        ebranch = self.psd.ebranch
+        th = self._extract_var("th", self.psd.bus.set_all)
+        self.losses = 0.5*ebranch.g*(th[ebranch.bus_fr]-th[ebranch.bus_to])**2
+        self.psd.bus.pd_max = self.pd_max0 + 0.5*(np.bincount(ebranch.bus_fr, weights=self.losses, minlength=self.psd.bus.len) +
+                                                  np.bincount(ebranch.bus_to, weights=self.losses, minlength=self.psd.bus.len))
         
-        for b in self.psd.bus.set_all:
-            self.model.bus_pd_max[b] = self.psd.bus.pd_max[b]
+        self._set_bus_pd_max(self.psd.bus.pd_max)
+
+    def _extract_segments(self, name: str) -> np.ndarray:
+        if self.engine == "highs":
+            return self.model.value(name).reshape(self.psd.ebranch.len, self.n_segments)
+        return pyo_extract_2D(getattr(self.model, name), self.psd.ebranch.set_all, self.set_segments)
+
+    def _bounds_dth(self, _, k: int, s: int) -> tuple:
+        return (0, self.segment_width[k])
+
+    def _rule_loss(self, _, k: int) -> pyo.Expression:
+        return sum(self.segment_cost[k, s]*(self.model.dth_pos[k, s]+self.model.dth_neg[k, s]) for s in self.set_segments)
+
+    def _rule_angle_difference(self, _, k: int) -> pyo.Expression:
+        ki = self.psd.ebranch.bus_fr[k]
+        kj = self.psd.ebranch.bus_to[k]
+        return self.model.th[ki]-self.model.th[kj] == sum(self.model.dth_pos[k, s]-self.model.dth_neg[k, s] for s in self.set_segments)
+
+    def _rule_power_balance(self, _, b: int) -> pyo.Expression:
+        if self.method != "pwl":
+            return super()._rule_power_balance(_, b)
+        return self._pg_inj(b)-self._pf_inj(b)+self._sl_inj(b) == self.model.bus_pd_max[b]+self._loss_inj(b)
+
+    def _loss_inj(self, b: int) -> pyo.Expression:
+        loss_inj = 0
+        for k in self.psd.incidence.ebranch_fr[b]:
+            loss_inj += 0.5*self.model.loss[k]
+        for k in self.psd.incidence.ebranch_to[b]:
+            loss_inj += 0.5*self.model.loss[k]
+        return loss_inj
 
     def _stop_criterion(self) -> bool:
         return np.sum((self.psd.bus.pd_max-self.pd_max_old)**2) < self.TOL
 
-def main_opf_basic_losses(data_file: str, name_file_test: str=None) -> None:
-    system_data = read_from_MATPOWER(data_file)
-    psd = PowerSystemData(system_data=system_data)
-    op = OPFBasicLoss(psd)
-    op.define_model(debug=True)
-    op.solve_model()
-    op.get_results(name_file_test=name_file_test)
+def main_opf_basic_losses(data_file: str, name_file_test: str=None, engine: str="pyomo", report: bool=False,
+                          debug: bool=False, profile_file: str=None, method: str="iterative", n_segments: int=8) -> None:
+    profiler = Profiler()
+    psd = load_system(data_file, profiler=profiler)
+    op = OPFBasicLoss(psd, engine=engine, profiler=profiler, method=method, n_segments=n_segments)
+    with profiler.phase("define_model"):
+        op.define_model(debug=debug)
+    with profiler.phase("solve_model"):
+        op.solve_model()
+    with profiler.phase("get_results"):
+        op.get_results(name_file_test=name_file_test, report=report)
+    if profile_file is not None:
+        profiler.record_model(op.model)
+        profiler.dump(profile_file)
     return op.results
 
 if __name__ == "__main__":
@@ -68,4 +183,4 @@ if __name__ == "__main__":
         name_file_test = "source/tests/results/res_OPFBasic_loss_case3.npy"
         main_opf_basic_losses(data_file=data_file, name_file_test=name_file_test)
     else:
-        main_opf_basic_losses(data_file=data_file)
+        main_opf_basic_losses(data_file=data_file, report=True, debug=True)
@@ -1,18 +1,38 @@
 import numpy as np
 from basics.powersystem import PowerSystemData
 from opf_basic import OPFBasic
-from basics.readsystems import read_from_MATPOWER
+from basics.case_cache import load_system
 from basics.powersystem import PowerSystemData
 from basics.progress_bar_range import ProgressBarRange
-from methodtools import lru_cache
+from basics.state_sampler import StateSampler, unique_states
+from basics.state_cache import StateCache
+from basics.state_classifier import StateClassifier
+from basics.sample_log import SampleLog
+from basics.profiling import Profiler
 import pyomo.environ as pyo
 import numpy as np
-from basics.printing import print_centered_text, int_format, float_format, table_format, pyo_extract
+from concurrent.futures import ProcessPoolExecutor
 
 
 class OPFMonteCarlo(OPFBasic):
-    def __init__(self, psd: PowerSystemData, ctg_list: np.ndarray=None, MAX_ITER: int=100000, BETA_TOL: float=0.05) -> dict:
-        super().__init__(psd)
+    def __init__(self,
+                 psd: PowerSystemData,
+                 ctg_list: np.ndarray=None,
+                 MAX_ITER: int=100000,
+                 BETA_TOL: float=0.05,
+                 engine: str="pyomo",
+                 n_workers: int=None,
+                 batch_size: int=None,
+                 seed: int=None,
+                 cache_size: int=100000,
+                 screening: bool=True,
+                 sampling: str="crude",
+                 log_file: str=None,
+                 profiler: Profiler=None,
+                 formulation: str="angle",
+                 lazy: bool=False,
+                 monitored: np.ndarray=None) -> dict:
+        super().__init__(psd, engine=engine, profiler=profiler, formulation=formulation, lazy=lazy, monitored=monitored)
 
         # Monte Carlo Parameters
         self.MAX_ITER = MAX_ITER
@@ -24,16 +44,64 @@ class OPFMonteCarlo(OPFBasic):
             self.ctg_list = ctg_list
         self.ctg_list_len = len(self.ctg_list)
 
+        # Branches under contingency get reduced limits, so they are monitored even when unlimited (lazy mode finds the
+        # ones that bind), and their buses may reach the angle limits once the branches are replaced by dumb lines
+        if not self.lazy:
+            self.monitored = np.union1d(self.monitored, self.ctg_list)
+        self.angle_monitored = np.union1d(self.angle_monitored, np.union1d(self.psd.ebranch.bus_fr[self.ctg_list],
+                                                                           self.psd.ebranch.bus_to[self.ctg_list]))
+
+        # Sampling: "crude", "ce" (cross-entropy importance sampling), "lhs" (Latin hypercube) or "sobol"
+        self.sampling = sampling
+        self.CE_SAMPLES = 1000
+        self.CE_RHO = 0.1
+        self.CE_MAX_ITER = 10
+        self.CE_SMOOTHING = 0.7
+
+        # Block sampling: batch_size states are drawn at once and identical states are solved once
+        # Parallel mode: batches are drawn from independent SeedSequence streams
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        if (self.n_workers is not None or self.sampling != "crude") and self.batch_size is None:
+            self.batch_size = 1024 if self.sampling == "sobol" else 1000
+        if self.sampling == "sobol" and self.batch_size & (self.batch_size-1) != 0:
+            raise ValueError("Sobol sampling requires a power of 2 batch_size")
+        self.seed = seed
+
+        # Outcomes of solved states
+        self.cache = StateCache(capacity=cache_size)
+
+        # States provable from solved ones skip the LP
+        self.screening = screening
+
         # Beta history
         self.beta = np.ones(self.MAX_ITER)
+
+        # Optional binary log of every sample outcome, for analyses without re-solving
+        self.log_file = log_file
+        self.log = None
     
     def solve_model(self) -> None:
 
-        # Initial mutable data
-        ebranch_flow_max_0 = np.copy(self.psd.ebranch.flow_max)
-        ebranch_b_lin_0 = np.copy(self.psd.ebranch.b_lin)
-        gen_pg_max_0 = np.copy(self.psd.gen.pg_max)
+        # Initial mutable data and state sampler
+        self._init_simulation()
+        if self.sampling == "ce":
+            self._cross_entropy()
 
+        if self.log_file is not None:
+            self.log = SampleLog(self.log_file, self._log_header())
+        try:
+            if self.n_workers is not None:
+                self._solve_parallel()
+            elif self.batch_size is not None:
+                self._solve_blocks()
+            else:
+                self._solve_serial()
+        finally:
+            if self.log is not None:
+                self.log.close()
+
+    def _solve_serial(self) -> None:
         # Auxiliary reliability indexes
         sumLOLP = 0
         sumEPNS = 0
@@ -45,38 +113,11 @@ class OPFMonteCarlo(OPFBasic):
         pbar = pbr.start_progess_bar()
         for iter in range(1, self.MAX_ITER+1):
 
-            for k in self.ctg_list:
-                self.model.ebranch_flow_max[k] = ebranch_flow_max_0[k]
-                self.model.ebranch_b_lin[k] = ebranch_b_lin_0[k]
-            for g in self.psd.gen.set_all:
-                self.model.gen_pg_max[g] = gen_pg_max_0[g]
+            ctg_lines, ctg_gen = self._sample_state(np.random.rand)
             
-            # Applying contingencies in existent lines
-            ctg_lines = np.zeros(self.ctg_list_len, dtype=int)
-            for k in self.ctg_list:
-                for _ in range(self.psd.ebranch.nlines[k]):
-                    if np.random.rand() < self.psd.ebranch.FOR[k]:
-                        ctg_lines[k] += 1
-                
-                if ctg_lines[k] == 0:
-                    continue
-                
-                remaining_lines = self.psd.ebranch.nlines[k] - ctg_lines[k]
-                if remaining_lines > 0:
-                    self.model.ebranch_flow_max[k] = self.model.ebranch_flow_max[k] * remaining_lines / self.psd.ebranch.nlines[k]
-                    self.model.ebranch_b_lin[k] = self.model.ebranch_b_lin[k] * remaining_lines / self.psd.ebranch.nlines[k]
-                else:
-                    self.model.ebranch_flow_max[k] = self.psd.ebranch.flow_max_dumb
-                    self.model.ebranch_b_lin[k] = self.psd.ebranch.b_dumb
-
-            # Applying contingencies in generators
-            ctg_gen = np.zeros(self.psd.gen.len, dtype=int)
-            for g in self.psd.gen.set_all:
-                if np.random.rand() < self.psd.gen.FOR[g]:
-                    ctg_gen[g] = 1
-                    self.model.gen_pg_max[g] = 0
-            
-            total_sl = self._solve_memo(tuple(np.concatenate((ctg_lines, ctg_gen))))
+            total_sl, sl = self._state_outcome(ctg_lines, ctg_gen)
+            if self.log is not None:
+                self.log.write(self.sampler.pack_block(np.concatenate((ctg_lines, ctg_gen))[None]), [1], [1.0], sl[None])
 
             # Reliability Indexes
             if total_sl > 0:
@@ -84,35 +125,308 @@ class OPFMonteCarlo(OPFBasic):
                 sumEPNS += total_sl
                 sum2EPNS += total_sl**2
         
-            self.LOLP = sumLOLP / (iter)
-            self.EPNS = sumEPNS / (iter)
-
-            if iter > 1 and self.LOLP > 0:
-                var_LOLP = (sumLOLP - iter * self.LOLP**2)/(iter*(iter-1))
-                var_EPNS = (sum2EPNS - iter * self.EPNS**2)/(iter*(iter-1))
-                b_LOLP = np.sqrt(var_LOLP) / self.LOLP
-                b_EPNS = np.sqrt(var_EPNS) / self.EPNS
+            if self._update_indexes(iter, sumLOLP, sumEPNS, sum2EPNS):
+                break
                 
-                self.beta[iter-1] = max(b_LOLP, b_EPNS)
-                if self.beta[iter-1] > 1:
-                    self.beta[iter-1] = 1
+            pbar.update(pbr.delta(self.beta[iter-1]))
+        pbar.close()
+
+    def _solve_blocks(self) -> None:
+        rng = np.random.default_rng(self.seed)
+
+        # Auxiliary reliability indexes
+        iter = 0
+        sumLOLP = 0
+        sumEPNS = 0
+        sum2EPNS = 0
+        sum2LOLP = 0
+
+        pbr = ProgressBarRange(start=1, stop=self.BETA_TOL, mode="log")
+
+        print("\n\nRunning Monte Carlo Simulation...")
+        pbar = pbr.start_progess_bar()
+        while iter < self.MAX_ITER:
+            n, batch_LOLP, batch_EPNS, batch_2EPNS, batch_2LOLP, _, records = self._run_batch(rng, min(self.batch_size, self.MAX_ITER - iter),
+                                                                                              record=self.log is not None)
+            if records is not None:
+                self.log.write(*records)
+            iter += n
+            sumLOLP += batch_LOLP
+            sumEPNS += batch_EPNS
+            sum2EPNS += batch_2EPNS
+            sum2LOLP += batch_2LOLP
+
+            if self._update_indexes(iter, sumLOLP, sumEPNS, sum2EPNS, sum2LOLP):
+                break
+
+            pbar.update(pbr.delta(self.beta[iter-1]))
+        pbar.close()
+
+        # Results are reported for the base case
+        self._apply_state(np.zeros(self.ctg_list_len, dtype=int), np.zeros(self.psd.gen.len, dtype=int))
+        super().solve_model()
+
+    def _solve_parallel(self) -> None:
+        n_batches = -(-self.MAX_ITER // self.batch_size)
+        seeds = np.random.SeedSequence(self.seed).spawn(n_batches)
+
+        # Auxiliary reliability indexes
+        iter = 0
+        sumLOLP = 0
+        sumEPNS = 0
+        sum2EPNS = 0
+        sum2LOLP = 0
+
+        pbr = ProgressBarRange(start=1, stop=self.BETA_TOL, mode="log")
+
+        print("\n\nRunning Monte Carlo Simulation ({} workers)...".format(self.n_workers))
+        pbar = pbr.start_progess_bar()
+        with ProcessPoolExecutor(max_workers=self.n_workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.psd, self.ctg_list, self.engine, self.cache.capacity, self.screening,
+                                           self.sampling, self.sampler.line_q, self.sampler.gen_q, self.formulation,
+                                           self.lazy, self.monitored)) as executor:
+            # Batches are merged in order, so results do not depend on the number of workers
+            futures = dict()
+            for batch in range(n_batches):
+                for new_batch in range(batch, min(batch + 2*self.n_workers, n_batches)):
+                    if new_batch not in futures:
+                        n_samples = min(self.batch_size, self.MAX_ITER - new_batch*self.batch_size)
+                        futures[new_batch] = executor.submit(_run_batch, seeds[new_batch], n_samples, self.log is not None)
                 
-                # print("{:6}{:6.2f}{:6.1f}".format(iter, total_sl, 100*self.beta[iter-1]))
+                n, batch_LOLP, batch_EPNS, batch_2EPNS, batch_2LOLP, batch_stats, records = futures.pop(batch).result()
+                self._add_stats(batch_stats)
+                if records is not None:
+                    self.log.write(*records)
+                iter += n
+                sumLOLP += batch_LOLP
+                sumEPNS += batch_EPNS
+                sum2EPNS += batch_2EPNS
+                sum2LOLP += batch_2LOLP
 
-                if iter>100 and self.beta[iter-1] < self.BETA_TOL:
+                if self._update_indexes(iter, sumLOLP, sumEPNS, sum2EPNS, sum2LOLP):
                     break
-                
+
                 pbar.update(pbr.delta(self.beta[iter-1]))
+            
+            for future in futures.values():
+                future.cancel()
         pbar.close()
-    
-    @lru_cache(maxsize=1000)
-    def _solve_memo(self, ctg_lines):
+
+        # Results are reported for the base case
+        self._apply_state(np.zeros(self.ctg_list_len, dtype=int), np.zeros(self.psd.gen.len, dtype=int))
         super().solve_model()
-        sl = pyo_extract(self.model.sl, self.psd.bus.set_with_demand)
-        return sum(sl)
+
+    def _run_batch(self, rng: np.random.Generator, n_samples: int, record: bool = False) -> tuple:
+        states, counts = unique_states(self.sampler.draw(n_samples, rng))
+        weights = self.sampler.weights(states)
+        stats_0 = self._stats()
+        shed = np.zeros((len(states), len(self.psd.bus.set_with_demand))) if record else None
+
+        # Sums are weighted by the likelihood ratios, which are 1 unless importance sampling is used
+        sumLOLP = 0
+        sumEPNS = 0
+        sum2EPNS = 0
+        sum2LOLP = 0
+        for idx, (state, count, w) in enumerate(zip(states, counts, weights)):
+            total_sl, sl = self._state_outcome(*self.sampler.split(state))
+            if record:
+                shed[idx] = sl
+
+            if total_sl > 0:
+                sumLOLP += count*w
+                sumEPNS += count*w*total_sl
+                sum2EPNS += count*(w*total_sl)**2
+                sum2LOLP += count*w**2
+        
+        records = (self.sampler.pack_block(states), counts, weights, shed) if record else None
+        return n_samples, sumLOLP, sumEPNS, sum2EPNS, sum2LOLP, self._stats() - stats_0, records
+
+    def _cross_entropy(self) -> None:
+        """Moves the sampler proposal probabilities towards the loss of load states (multilevel cross-entropy)"""
+        # Own stream, apart from the sampling batches
+        rng = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(2**31,)))
+        pd_total = np.sum(self.psd.bus.pd_max)
+        nlines = self.sampler.nlines
+
+        print("\n\nOptimizing importance sampling probabilities...")
+        for _ in range(self.CE_MAX_ITER):
+            states, counts = unique_states(self.sampler.draw(self.CE_SAMPLES, rng))
+            weights = self.sampler.weights(states)*counts
+
+            # Score: load shedding, or minus the generation reserve when nothing is shed
+            total_sl = np.array([self._solve_state(*self.sampler.split(state)) for state in states])
+            reserve = np.sum(np.where(states[:, self.ctg_list_len:] > 0, 0, self.gen_pg_max_0), axis=1) - pd_total
+            score = np.where(total_sl > 0, total_sl, -np.maximum(reserve, 0))
+
+            # Elite states: the loss of load states once they are frequent enough, otherwise the top CE_RHO quantile
+            order = np.argsort(-score, kind="stable")
+            n_elite = np.searchsorted(np.cumsum(counts[order]), self.CE_RHO*self.CE_SAMPLES) + 1
+            level = min(score[order[min(n_elite, len(order))-1]], 0)
+            reached = level >= 0
+            # With no loss of load drawn at all, the states at the level (zero reserve) are the elite
+            elite = score > 0 if reached and np.any(score > 0) else score >= level
+
+            w = weights[elite]
+            line_q = (w @ states[elite, :self.ctg_list_len]) / (np.sum(w)*np.maximum(nlines, 1))
+            gen_q = (w @ states[elite, self.ctg_list_len:]) / np.sum(w)
+
+            # Proposals never go below the FORs, so no outage becomes impossible to draw
+            line_q = np.minimum(self.CE_SMOOTHING*line_q + (1-self.CE_SMOOTHING)*self.sampler.line_q, 0.5)
+            gen_q = np.minimum(self.CE_SMOOTHING*gen_q + (1-self.CE_SMOOTHING)*self.sampler.gen_q, 0.5)
+            self.sampler.line_q = np.maximum(line_q, self.sampler.line_FOR)
+            self.sampler.gen_q = np.maximum(gen_q, self.sampler.gen_FOR)
+            if reached:
+                break
+
+    def _log_header(self) -> dict:
+        n_bits = len(self.sampler.circuit_line) + self.sampler.len_gen
+        return {"nlines": self.sampler.nlines.tolist(),
+                "line_FOR": self.sampler.line_FOR.tolist(),
+                "gen_FOR": self.sampler.gen_FOR.tolist(),
+                "line_q": self.sampler.line_q.tolist(),
+                "gen_q": self.sampler.gen_q.tolist(),
+                "ctg_list": np.asarray(self.ctg_list).tolist(),
+                "shed_bus": self.psd.bus.set_with_demand.tolist(),
+                "power_base": self.psd.power_base,
+                "sampling": self.sampling,
+                "seed": self.seed,
+                "state_bytes": -(-n_bits // 8)}
+
+    def _stats(self) -> np.ndarray:
+        return np.array([self.cache.hits, self.cache.misses, self.cache.evictions,
+                         self.classifier.queries, self.classifier.avoided])
+
+    def _add_stats(self, stats: np.ndarray) -> None:
+        self.cache.hits += stats[0]
+        self.cache.misses += stats[1]
+        self.cache.evictions += stats[2]
+        self.classifier.queries += stats[3]
+        self.classifier.avoided += stats[4]
+
+    def _update_indexes(self, iter: int, sumLOLP: float, sumEPNS: float, sum2EPNS: float, sum2LOLP: float = None) -> bool:
+        """Updates the reliability indexes after iter samples and returns True when converged"""
+        self.LOLP = sumLOLP / (iter)
+        self.EPNS = sumEPNS / (iter)
+
+        # Without weights the LOLP indicator is its own square
+        if sum2LOLP is None:
+            sum2LOLP = sumLOLP
+
+        if iter > 1 and self.LOLP > 0:
+            var_LOLP = (sum2LOLP - iter * self.LOLP**2)/(iter*(iter-1))
+            var_EPNS = (sum2EPNS - iter * self.EPNS**2)/(iter*(iter-1))
+            b_LOLP = np.sqrt(var_LOLP) / self.LOLP
+            b_EPNS = np.sqrt(var_EPNS) / self.EPNS
+            
+            self.beta[iter-1] = max(b_LOLP, b_EPNS)
+            if self.beta[iter-1] > 1:
+                self.beta[iter-1] = 1
+            
+            # print("{:6}{:6.2f}{:6.1f}".format(iter, total_sl, 100*self.beta[iter-1]))
+
+            if iter>100 and self.beta[iter-1] < self.BETA_TOL:
+                return True
+        return False
+
+    def _init_simulation(self) -> None:
+        self.sampler = StateSampler(nlines=self.psd.ebranch.nlines[self.ctg_list],
+                                    line_FOR=self.psd.ebranch.FOR[self.ctg_list],
+                                    gen_FOR=self.psd.gen.FOR,
+                                    method=self.sampling)
+
+        self.ebranch_flow_max_0 = np.copy(self.psd.ebranch.flow_max)
+        self.ebranch_b_lin_0 = np.copy(self.psd.ebranch.b_lin)
+        self.gen_pg_max_0 = np.copy(self.psd.gen.pg_max)
+
+        self.classifier = StateClassifier(gen_cost=self.psd.gen.cost,
+                                          gen_pg_max=self.gen_pg_max_0,
+                                          sl_cost=self.psd.bus.sl_cost,
+                                          sl_max=np.sum(self.psd.bus.pd_max[self.psd.bus.set_with_demand]),
+                                          pd_total=np.sum(self.psd.bus.pd_max))
+
+        # Mutable data currently loaded in the model
+        self.ebranch_flow_max = np.copy(self.ebranch_flow_max_0)
+        self.ebranch_b_lin = np.copy(self.ebranch_b_lin_0)
+        self.gen_pg_max = np.copy(self.gen_pg_max_0)
+
+    def _sample_state(self, rand) -> tuple:
+        # Applying contingencies in existent lines
+        ctg_lines = np.zeros(self.ctg_list_len, dtype=int)
+        for idx, k in enumerate(self.ctg_list):
+            for _ in range(self.psd.ebranch.nlines[k]):
+                if rand() < self.psd.ebranch.FOR[k]:
+                    ctg_lines[idx] += 1
+
+        # Applying contingencies in generators
+        ctg_gen = np.zeros(self.psd.gen.len, dtype=int)
+        for g in self.psd.gen.set_all:
+            if rand() < self.psd.gen.FOR[g]:
+                ctg_gen[g] = 1
+        
+        return ctg_lines, ctg_gen
+
+    def _apply_state(self, ctg_lines: np.ndarray, ctg_gen: np.ndarray) -> None:
+        """Loads a sampled state in the model, pushing only the parameters that changed"""
+        nlines = self.psd.ebranch.nlines[self.ctg_list]
+        remaining_lines = nlines - ctg_lines
+
+        ebranch_flow_max = np.copy(self.ebranch_flow_max_0)
+        ebranch_b_lin = np.copy(self.ebranch_b_lin_0)
+        ebranch_flow_max[self.ctg_list] = np.where(remaining_lines > 0,
+                                                   self.ebranch_flow_max_0[self.ctg_list] * remaining_lines / nlines,
+                                                   self.psd.ebranch.flow_max_dumb)
+        ebranch_b_lin[self.ctg_list] = np.where(remaining_lines > 0,
+                                                self.ebranch_b_lin_0[self.ctg_list] * remaining_lines / nlines,
+                                                self.psd.ebranch.b_dumb)
+        gen_pg_max = np.where(ctg_gen > 0, 0, self.gen_pg_max_0)
+
+        changed = np.where(ebranch_flow_max != self.ebranch_flow_max)[0]
+        if len(changed) > 0:
+            self._set_ebranch_flow_max(ebranch_flow_max[changed], changed)
+            self.ebranch_flow_max = ebranch_flow_max
+        
+        changed = np.where(ebranch_b_lin != self.ebranch_b_lin)[0]
+        if len(changed) > 0:
+            self._set_ebranch_b_lin(ebranch_b_lin[changed], changed)
+            self.ebranch_b_lin = ebranch_b_lin
+
+        changed = np.where(gen_pg_max != self.gen_pg_max)[0]
+        if len(changed) > 0:
+            self._set_gen_pg_max(gen_pg_max[changed], changed)
+            self.gen_pg_max = gen_pg_max
+    
+    def _solve_state(self, ctg_lines: np.ndarray, ctg_gen: np.ndarray) -> float:
+        """Returns the total load shedding of a state, solving the model only for new states"""
+        return self._state_outcome(ctg_lines, ctg_gen)[0]
+
+    def _state_outcome(self, ctg_lines: np.ndarray, ctg_gen: np.ndarray) -> tuple:
+        """Returns the total load shedding of a state and the shedding by bus with demand"""
+        key = self.sampler.pack(np.concatenate((ctg_lines, ctg_gen)))
+        outcome = self.cache.get(key)
+        if outcome is not None:
+            return outcome
+
+        line_key = ctg_lines.tobytes()
+        gen_out = ctg_gen > 0
+        if self.screening:
+            outcome = self.classifier.classify(line_key, gen_out)
+        if outcome is None:
+            self._apply_state(ctg_lines, ctg_gen)
+            super().solve_model()
+            sl = self._extract_var("sl", self.psd.bus.set_with_demand)
+            outcome = (sum(sl), sl)
+            if self.screening:
+                pg = self._extract_var("pg", self.psd.gen.set_all)
+                self.classifier.record(line_key, gen_out, pg, self._objective_value(), outcome)
+        self.cache.put(key, outcome)
+        return outcome
     
-    def get_results(self, export: bool = True, display: bool = True, file_name: str = "source/.results/results.txt", name_file_test: str = None) -> None:
-        super().get_results(export, display, file_name, name_file_test)
+    def get_results(self, export: bool = True, display: bool = True, file_name: str = "source/.results/results.txt", name_file_test: str = None,
+                    report: bool = False, results_file: str = "source/.results/results.npz") -> None:
+        super().get_results(export, display, file_name, name_file_test, report, results_file)
+        if not display:
+            return
 
         print("\n\n")
         print("Reliability Indexes")
@@ -121,22 +435,57 @@ class OPFMonteCarlo(OPFBasic):
         print("EPNS: {:>.2f} MW".format(self.psd.power_base * self.LOLP))
         print("EENS: {:>.2f} GWh/yr".format(8.760 * self.psd.power_base * self.LOLP))
 
+        cache_stats = self.cache.stats()
+        print("\nState cache")
+        print("Size: {} / {}".format(cache_stats["size"], cache_stats["capacity"]))
+        print("Hits: {}  Misses: {}  Evictions: {}".format(cache_stats["hits"], cache_stats["misses"], cache_stats["evictions"]))
+        print("Hit rate: {:>.2f} %".format(100 * cache_stats["hit_rate"]))
+        print("LPs avoided by screening: {} / {}".format(self.classifier.avoided, self.classifier.queries))
+
+    def _extract_results(self) -> None:
+        super()._extract_results()
         self.results["LOLP"] = self.LOLP
         self.results["EPNS"] = self.EPNS
 
-        if name_file_test is not None:
-            np.save(name_file_test, self.results)
 
-def main_opf_monte_carlo(data_file: str, name_file_test: str=None) -> None:
+# Parallel workers: each process holds its own model
+_worker_op = None
+
+def _init_worker(psd: PowerSystemData, ctg_list: np.ndarray, engine: str, cache_size: int, screening: bool,
+                 sampling: str, line_q: np.ndarray, gen_q: np.ndarray, formulation: str, lazy: bool,
+                 monitored: np.ndarray) -> None:
+    global _worker_op
+    _worker_op = OPFMonteCarlo(psd=psd, ctg_list=ctg_list, engine=engine, cache_size=cache_size, screening=screening,
+                               sampling=sampling, formulation=formulation, lazy=lazy, monitored=monitored)
+    _worker_op.define_model()
+    _worker_op._init_simulation()
+    _worker_op.sampler.line_q = line_q
+    _worker_op.sampler.gen_q = gen_q
+
+def _run_batch(seed: np.random.SeedSequence, n_samples: int, record: bool = False) -> tuple:
+    return _worker_op._run_batch(np.random.default_rng(seed), n_samples, record)
+
+
+def main_opf_monte_carlo(data_file: str, name_file_test: str=None, engine: str="pyomo", n_workers: int=None, batch_size: int=None,
+                         sampling: str="crude", report: bool=False, log_file: str=None, debug: bool=False,
+                         profile_file: str=None, formulation: str="angle", lazy: bool=False,
+                         monitored: np.ndarray=None) -> None:
     np.random.seed(seed=0)
-    system_data = read_from_MATPOWER(data_file)
-    psd = PowerSystemData(system_data=system_data)
+    profiler = Profiler()
+    psd = load_system(data_file, profiler=profiler)
     psd.bus.pd_max = psd.bus.pd_max*2
     psd.gen.pg_max = psd.gen.pg_max*2
-    op = OPFMonteCarlo(psd=psd)
-    op.define_model(debug=False)
-    op.solve_model()
-    op.get_results(name_file_test=name_file_test)
+    op = OPFMonteCarlo(psd=psd, engine=engine, n_workers=n_workers, batch_size=batch_size, seed=0, sampling=sampling,
+                       log_file=log_file, profiler=profiler, formulation=formulation, lazy=lazy, monitored=monitored)
+    with profiler.phase("define_model"):
+        op.define_model(debug=debug)
+    with profiler.phase("solve_model"):
+        op.solve_model()
+    with profiler.phase("get_results"):
+        op.get_results(name_file_test=name_file_test, report=report)
+    if profile_file is not None:
+        profiler.record_model(op.model)
+        profiler.dump(profile_file)
     return op.results
 
 if __name__ == "__main__":
@@ -148,5 +497,5 @@ if __name__ == "__main__":
         name_file_test = "source/tests/results/res_OPFMonteCarlo_case24_ieee_rts_reliability.npy"
         main_opf_monte_carlo(data_file=data_file, name_file_test=name_file_test)
     else:
-        main_opf_monte_carlo(data_file=data_file)
+        main_opf_monte_carlo(data_file=data_file, report=True)
         
\ No newline at end of file
@@ -1,54 +1,159 @@
 # Created in 06/03/2024 by Arthur
 
-from basics.readsystems import read_from_MATPOWER
-from basics.powersystem import PowerSystemData
+from basics.case_cache import load_system
+from basics.powersystem import PowerSystemData, ScenariosData
 from abc_classes.optimization import OptimizationProblem
 import pyomo.environ as pyo
 import numpy as np
-from basics.printing import print_centered_text, int_format, float_format, table_format, pyo_extract_2D
-import sys
+from basics.printing import print_centered_text, table_format, format_table, write_report, save_results, pyo_extract_2D
+from opf_basic import OPFBasic
+from basics.profiling import Profiler, ProfiledModel
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import copy
+import io
+import itertools
 
 class OPFSce(OptimizationProblem):
 
-    def __init__(self, psd: PowerSystemData) -> None:
+    def __init__(self,
+                 psd: PowerSystemData,
+                 chunk_size: int = None,
+                 decomposed: bool = False,
+                 n_workers: int = None,
+                 engine: str = "pyomo",
+                 profiler: Profiler = None,
+                 formulation: str = "angle",
+                 lazy: bool = False,
+                 monitored: np.ndarray = None) -> None:
         # PowerSystemData injection
         self.psd = psd
         
         self.losses = np.zeros((self.psd.ebranch.len, self.psd.sce.len_obs))
+
+        # Phase timings and model statistics
+        self.profiler = Profiler() if profiler is None else profiler
+
+        # Decomposed mode: one single-period model re-solved per scenario, optionally across processes
+        self.decomposed = decomposed or n_workers is not None
+        self.n_workers = n_workers
+        self.engine = engine
+        if not self.decomposed and self.engine != "pyomo":
+            raise ValueError("Engine '{}' is only available in decomposed mode".format(self.engine))
+        self.formulation = formulation
+        if not self.decomposed and self.formulation != "angle":
+            raise ValueError("Formulation '{}' is only available in decomposed mode".format(self.formulation))
+        self.lazy = lazy
+        self.monitored = monitored
+        if not self.decomposed and self.lazy:
+            raise ValueError("Lazy branch limits are only available in decomposed mode")
+
+        # Observations are modelled in windows of chunk_size, all at once by default
+        if chunk_size is None:
+            n_tasks = 1 if self.n_workers is None else 4*self.n_workers
+            chunk_size = -(-self.psd.sce.len_obs // n_tasks)
+        self.chunk_size = max(chunk_size, 1)
+        self.set_obs = self.psd.sce.set_obs[:self.chunk_size]
     
     def define_model(self, debug: bool = False):
+        if self.decomposed:
+            self.scenario_model = ScenarioModel(self.psd, engine=self.engine, debug=debug, profiler=self.profiler,
+                                              formulation=self.formulation, lazy=self.lazy, monitored=self.monitored)
+            return
+
         # Model
-        self.model = pyo.ConcreteModel(name=self.__class__.__name__)
+        self.model = ProfiledModel(self.profiler, name=self.__class__.__name__)
 
         # Scenarios' Parameters
-        self.model.bus_pd_max = pyo.Param(self.psd.bus.set_all, self.psd.sce.set_obs, initialize=self._init_bus_pd_sce)
-        self.model.gen_pg_sce = pyo.Param(self.psd.gen.set_all, self.psd.sce.set_obs, initialize=self._init_bus_pg_sce)
+        self.model.bus_pd_max = pyo.Param(self.psd.bus.set_all, self.set_obs, initialize=self._init_bus_pd_sce)
+        self.model.gen_pg_sce = pyo.Param(self.psd.gen.set_all, self.set_obs, initialize=self._init_bus_pg_sce)
         
         # Variables
-        self.model.pg = pyo.Var(self.psd.gen.set_all, self.psd.sce.set_obs, within=pyo.Reals, bounds=self._bounds_pg)  # Power Generation
-        self.model.th = pyo.Var(self.psd.bus.set_all, self.psd.sce.set_obs, within=pyo.Reals, bounds=(-np.pi, np.pi))  # Voltage angle
-        for s in self.psd.sce.set_obs:  
+        self.model.pg = pyo.Var(self.psd.gen.set_all, self.set_obs, within=pyo.Reals, bounds=self._bounds_pg)  # Power Generation
+        self.model.th = pyo.Var(self.psd.bus.set_all, self.set_obs, within=pyo.Reals, bounds=(-np.pi, np.pi))  # Voltage angle
+        for s in self.set_obs:  
             self.model.th[0, s].fix(0)
-        self.model.sl = pyo.Var(self.psd.bus.set_with_demand, self.psd.sce.set_obs, within=pyo.Reals, bounds=self._bounds_sl)  # Load shedding
+        self.model.sl = pyo.Var(self.psd.bus.set_with_demand, self.set_obs, within=pyo.Reals, bounds=self._bounds_sl)  # Load shedding
         
         # Dependent variables
-        self.model.pf = pyo.Var(self.psd.ebranch.set_all, self.psd.sce.set_obs, within=pyo.Reals, bounds=self._bounds_pf)  # Active Power Flow
+        self.model.pf = pyo.Var(self.psd.ebranch.set_all, self.set_obs, within=pyo.Reals, bounds=self._bounds_pf)  # Active Power Flow
 
         # Objective
         self.model.obj = pyo.Objective(expr=self._create_objective())
 
         # Constraints
-        self.model.con_power_balance = pyo.Constraint(self.psd.bus.set_all, self.psd.sce.set_obs, rule=self._rule_power_balance)
-        self.model.con_power_flow = pyo.Constraint(self.psd.ebranch.set_all, self.psd.sce.set_obs, rule=self._rule_power_flow)
+        self.model.con_power_balance = pyo.Constraint(self.psd.bus.set_all, self.set_obs, rule=self._rule_power_balance)
+        self.model.con_power_flow = pyo.Constraint(self.psd.ebranch.set_all, self.set_obs, rule=self._rule_power_flow)
 
         # Data file for debug
         if debug:
-            with open('source/.results/output.txt', 'w') as file:
-                self.model.pprint(ostream=file)
+            with self.profiler.phase("debug_output"):
+                with open('source/.results/output.txt', 'w') as file:
+                    self.model.pprint(ostream=file)
     
     def solve_model(self) -> None:
-        solver = pyo.SolverFactory('glpk')
+        if self.n_workers is not None:
+            self._solve_parallel()
+            return
+        if self.decomposed:
+            self._init_results()
+            for set_obs, data in self.psd.sce.windows(self.chunk_size):
+                self._store_window(set_obs, data, self.scenario_model.solve_window(data))
+            return
+
+        solver = self.profiler.instrument_solver(pyo.SolverFactory('glpk'))
+        self._init_results()
         solver.solve(self.model)
+        self._extract_window_values()
+
+        # Scenarios are uncoupled: the other windows are built and solved one at a time
+        for set_obs, _ in itertools.islice(self.psd.sce.windows(self.chunk_size), 1, None):
+            self.set_obs = set_obs
+            self.define_model()
+            solver.solve(self.model)
+            self._extract_window_values()
+
+    def _solve_parallel(self) -> None:
+        self._init_results()
+        with ProcessPoolExecutor(max_workers=self.n_workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.psd, self.engine, self.formulation, self.lazy, self.monitored)) as executor:
+            # A bounded number of windows is in flight, so memory does not grow with the series
+            futures = collections.deque()
+            for set_obs, data in self.psd.sce.windows(self.chunk_size):
+                futures.append((set_obs, data, executor.submit(_solve_window, np.array(data))))
+                if len(futures) == 2*self.n_workers:
+                    set_obs, data, future = futures.popleft()
+                    self._store_window(set_obs, data, future.result())
+            while futures:
+                set_obs, data, future = futures.popleft()
+                self._store_window(set_obs, data, future.result())
+
+    def _store_window(self, set_obs: np.ndarray, data: np.ndarray, solution: tuple) -> None:
+        pg, th, sl, pf, obj = solution
+        weight = data[:, self.psd.sce.weight_col]
+        self.results["pg"][:, set_obs] = pg
+        self.results["th"][:, set_obs] = th
+        self.results["sl"][:, set_obs] = sl
+        self.results["pf"][:, set_obs] = pf
+        self.objective += weight @ obj
+        self.pg_cost += weight @ (self.psd.gen.cost @ pg)
+        self.sl_cost += weight @ (self.psd.bus.sl_cost*np.sum(sl, axis=0))
+
+    def report_reduction(self, full_sce: ScenariosData) -> float:
+        """Solves the full scenario set in the same mode and reports the objective error of the reduced one"""
+        psd = copy.copy(self.psd)
+        psd.sce = full_sce
+        op = OPFSce(psd, decomposed=self.decomposed, n_workers=self.n_workers, engine=self.engine,
+                    formulation=self.formulation, lazy=self.lazy, monitored=self.monitored)
+        op.define_model()
+        op.solve_model()
+        self.full_objective = op.objective
+        self.reduction_error = (self.objective - op.objective) / abs(op.objective) if op.objective != 0 else 0.0
+        print("\nScenario reduction: {} of {} observations".format(self.psd.sce.len_obs, full_sce.len_obs))
+        print("Objective (reduced / full): {} / {}".format(self.objective, self.full_objective))
+        print("Relative error: {:>.4f} %".format(100*self.reduction_error))
+        return self.reduction_error
 
     def _init_bus_pd_sce(self, _, b: int, s: int) -> np.ndarray:
         return self.psd.bus.pd_max[b] * self.psd.sce.data[s, self.psd.bus.area[b]]
@@ -74,15 +179,15 @@ class OPFSce(OptimizationProblem):
     
     def _pf_inj(self, b: int, s: int) -> pyo.Expression:
         pf_inj = 0
-        for k in np.where(self.psd.ebranch.bus_fr == b)[0]:
+        for k in self.psd.incidence.ebranch_fr[b]:
             pf_inj += self.model.pf[k, s]
-        for k in np.where(self.psd.ebranch.bus_to == b)[0]:
+        for k in self.psd.incidence.ebranch_to[b]:
             pf_inj -= self.model.pf[k, s]
         return pf_inj
     
     def _pg_inj(self, b: int, s: int) -> pyo.Expression:
         pg_inj = 0
-        for g in np.where(self.psd.gen.bus == b)[0]:
+        for g in self.psd.incidence.gen[b]:
             pg_inj += self.model.pg[g, s]
         return pg_inj
     
@@ -95,62 +200,67 @@ class OPFSce(OptimizationProblem):
         return self.model.pf[k, s] == -self.psd.ebranch.b_lin[k]*(self.model.th[ki, s]-self.model.th[kj, s])
     
     def _sl_inj(self, b: int, s: int):
-        if b in self.psd.bus.set_with_demand:
+        if self.psd.bus.has_demand[b]:
             return self.model.sl[b, s]
         return 0
     
     def _total_pg_cost(self) -> pyo.Expression:
-        return sum([self.psd.sce.data[s, -1] * self.psd.gen.cost[g] * self.model.pg[g, s] \
-                    for g in self.psd.gen.set_all for s in self.psd.sce.set_obs])
+        return sum([self.psd.sce.data[s, self.psd.sce.weight_col] * self.psd.gen.cost[g] * self.model.pg[g, s] \
+                    for g in self.psd.gen.set_all for s in self.set_obs])
     
     def _total_sl_cost(self) -> pyo.Expression:
-        return sum([self.psd.sce.data[s, -1] * self.psd.bus.sl_cost*self.model.sl[b, s] \
-                    for b in self.psd.bus.set_with_demand for s in self.psd.sce.set_obs])
+        return sum([self.psd.sce.data[s, self.psd.sce.weight_col] * self.psd.bus.sl_cost*self.model.sl[b, s] \
+                    for b in self.psd.bus.set_with_demand for s in self.set_obs])
     
     def get_results(self, export: bool=True,
                     display: bool=True,
                     file_name: str="source/.results/results.txt",
-                    name_file_test: str=None) -> None:
-        with open(file_name, "w") as file:
-            for idx, out in enumerate([sys.stdout, file]):
-                if idx == 0 and not display:
-                    continue
-                if idx == 1 and not export:
-                    continue
-                print("-----------------------------------------", file=out)
-                print("-----------------Results-----------------", file=out)
-                print("-----------------------------------------", file=out)
-
-                self._print_bus_data(out=out)
-                self._print_ebranch_data(out=out)
-                self._print_gen_data(out=out)
-                
-                print("\nObjective:", file=out)
-                print(pyo.value(self.model.obj), file=out)
-
-                print("\nTotal Power generation cost:", file=out)
-                print(pyo.value(self._total_pg_cost()), file=out)
-
-                print("\nTotal Load shedding cost:", file=out)
-                print(pyo.value(self._total_sl_cost()), file=out)
-
-        self._extract_pyo_values()
+                    name_file_test: str=None,
+                    report: bool=False,
+                    results_file: str="source/.results/results.npz") -> None:
+        if export:
+            save_results(self.results, results_file)
+
+        # The text report is only built on request
+        if report:
+            write_report(self._report(), display=display, export=export, file_name=file_name)
+
         if name_file_test is not None:
             np.save(name_file_test, self.results)
+
+    def _report(self) -> str:
+        out = io.StringIO()
+        print("-----------------------------------------", file=out)
+        print("-----------------Results-----------------", file=out)
+        print("-----------------------------------------", file=out)
+
+        self._print_bus_data(out=out)
+        self._print_ebranch_data(out=out)
+        self._print_gen_data(out=out)
+        
+        print("\nObjective:", file=out)
+        print(self.objective, file=out)
+
+        print("\nTotal Power generation cost:", file=out)
+        print(self.pg_cost, file=out)
+
+        print("\nTotal Load shedding cost:", file=out)
+        print(self.sl_cost, file=out)
+        return out.getvalue()
     
     def _print_bus_data(self, out) -> None:
         print("\n\n", file=out)
         ncol = 4
         print_centered_text("Bus data", file=out, ncol=ncol)
+        pg_inj = np.zeros((self.psd.bus.len, self.psd.sce.len_obs))
+        np.add.at(pg_inj, self.psd.gen.bus, self.results["pg"])
+        sl_inj = np.zeros((self.psd.bus.len, self.psd.sce.len_obs))
+        sl_inj[self.psd.bus.set_with_demand] = self.results["sl"]
         for s in self.psd.sce.set_obs:
             print("\nScenario: {}".format(s), file=out)
             print(table_format(ncol=ncol).format("Bus", "pg", "LShed", "Angle"), file=out)
-            for b in self.psd.bus.set_all:
-                bus = int_format(b+1)
-                gen = float_format(self._pg_inj(b, s))
-                lshed = float_format(self._sl_inj(b, s))
-                angle = float_format(self.model.th[b, s])
-                print(bus + gen + lshed + angle, file=out)
+            out.write(format_table([self.psd.bus.set_all+1, pg_inj[:, s], sl_inj[:, s], self.results["th"][:, s]],
+                                   ["%9d", "%9.4f", "%9.4f", "%9.4f"]))
     
     def _print_ebranch_data(self, out) -> None:
         print("\n\n", file=out)
@@ -159,13 +269,9 @@ class OPFSce(OptimizationProblem):
         for s in self.psd.sce.set_obs:
             print("\nScenario: {}".format(s), file=out)
             print(table_format(ncol=ncol).format("Branch", "fr", "to", "pflow", "losses"), file=out)
-            for k in self.psd.ebranch.set_all:
-                branch = int_format(k+1)
-                fr = int_format(self.psd.ebranch.bus_fr[k]+1)
-                to = int_format(self.psd.ebranch.bus_to[k]+1)
-                pflow = float_format(self.model.pf[k, s])
-                losses = float_format(self.losses[k, s])
-                print(branch + fr + to + pflow + losses, file=out)
+            out.write(format_table([self.psd.ebranch.set_all+1, self.psd.ebranch.bus_fr+1, self.psd.ebranch.bus_to+1,
+                                    self.results["pf"][:, s], self.losses[:, s]],
+                                   ["%9d", "%9d", "%9d", "%9.4f", "%9.4f"]))
     
     def _print_gen_data(self, out) -> None:
         print("\n\n", file=out)
@@ -174,30 +280,94 @@ class OPFSce(OptimizationProblem):
         for s in self.psd.sce.set_obs:
             print("\nScenario: {}".format(s), file=out)
             print(table_format(ncol=ncol).format("Gen", "Bus", "pg", "cost"), file=out)
-            for g in self.psd.gen.set_all:
-                gen = int_format(g+1)
-                bus = int_format(self.psd.gen.bus[g]+1)
-                pg = float_format(self.model.pg[g, s])
-                cost = float_format(self.model.pg[g, s]*self.psd.gen.cost[g])
-                print(gen + bus + pg + cost, file=out)
-    
-    def _extract_pyo_values(self) -> None:
+            out.write(format_table([self.psd.gen.set_all+1, self.psd.gen.bus+1, self.results["pg"][:, s],
+                                    self.results["pg"][:, s]*self.psd.gen.cost],
+                                   ["%9d", "%9d", "%9.4f", "%9.4f"]))
+    
+    def _init_results(self) -> None:
         self.results = dict()
+        self.results["pg"] = np.zeros((self.psd.gen.len, self.psd.sce.len_obs))
+        self.results["th"] = np.zeros((self.psd.bus.len, self.psd.sce.len_obs))
+        self.results["sl"] = np.zeros((len(self.psd.bus.set_with_demand), self.psd.sce.len_obs))
+        self.results["pf"] = np.zeros((self.psd.ebranch.len, self.psd.sce.len_obs))
+        self.objective = 0
+        self.pg_cost = 0
+        self.sl_cost = 0
+
+    def _extract_window_values(self) -> None:
+        # Extracting results of the current window
+        self.results["pg"][:, self.set_obs] = pyo_extract_2D(self.model.pg, self.psd.gen.set_all, self.set_obs)
+        self.results["th"][:, self.set_obs] = pyo_extract_2D(self.model.th, self.psd.bus.set_all, self.set_obs)
+        self.results["sl"][:, self.set_obs] = pyo_extract_2D(self.model.sl, self.psd.bus.set_with_demand, self.set_obs)
+        self.results["pf"][:, self.set_obs] = pyo_extract_2D(self.model.pf, self.psd.ebranch.set_all, self.set_obs)
+        weight = self.psd.sce.data[self.set_obs, self.psd.sce.weight_col]
+        self.objective += pyo.value(self.model.obj)
+        self.pg_cost += weight @ (self.psd.gen.cost @ self.results["pg"][:, self.set_obs])
+        self.sl_cost += weight @ (self.psd.bus.sl_cost*np.sum(self.results["sl"][:, self.set_obs], axis=0))
+
+class ScenarioModel(OPFBasic):
+    """Single-period OPF whose demand and generation limits are set from one scenario at a time"""
+    def __init__(self, psd: PowerSystemData, engine: str = "pyomo", debug: bool = False, profiler: Profiler = None,
+                 formulation: str = "angle", lazy: bool = False, monitored: np.ndarray = None) -> None:
+        super().__init__(psd, engine=engine, profiler=profiler, formulation=formulation, lazy=lazy, monitored=monitored)
+        self.define_model(debug=debug)
+
+    def solve_window(self, data: np.ndarray) -> tuple:
+        """Solves the scenarios given as rows of data, returning pg, th, sl, pf by scenario column and the unweighted objectives"""
+        bus = self.psd.bus
+        gen = self.psd.gen
+        pg = np.zeros((gen.len, len(data)))
+        th = np.zeros((bus.len, len(data)))
+        sl = np.zeros((len(bus.set_with_demand), len(data)))
+        pf = np.zeros((self.psd.ebranch.len, len(data)))
+        obj = np.zeros(len(data))
+        for s, row in enumerate(data):
+            self._set_bus_pd_max(bus.pd_max * row[bus.area])
+            self._set_gen_pg_max(gen.pg_max * np.where(gen.serie < 0, 1, row[gen.serie]), gen.set_all)
+            self.solve_model()
+            pg[:, s] = self._extract_var("pg", gen.set_all)
+            th[:, s] = self._extract_var("th", bus.set_all)
+            sl[:, s] = self._extract_var("sl", bus.set_with_demand)
+            pf[:, s] = self._extract_var("pf", self.psd.ebranch.set_all)
+            obj[s] = self._objective_value()
+        return pg, th, sl, pf, obj
+
+
+# Parallel workers: each process holds its own single-period model
+_worker_model = None
+
+def _init_worker(psd: PowerSystemData, engine: str, formulation: str, lazy: bool, monitored: np.ndarray) -> None:
+    global _worker_model
+    _worker_model = ScenarioModel(psd, engine=engine, formulation=formulation, lazy=lazy, monitored=monitored)
+
+def _solve_window(data: np.ndarray) -> tuple:
+    return _worker_model.solve_window(data)
 
-        # Extracting results
-        self.results["pg"] = pyo_extract_2D(self.model.pg, self.psd.gen.set_all, self.psd.sce.set_obs)
-        self.results["th"] = pyo_extract_2D(self.model.th, self.psd.bus.set_all, self.psd.sce.set_obs)
-        self.results["sl"] = pyo_extract_2D(self.model.sl, self.psd.bus.set_with_demand, self.psd.sce.set_obs)
-        self.results["pf"] = pyo_extract_2D(self.model.pf, self.psd.ebranch.set_all, self.psd.sce.set_obs)
 
-def main_opf_sce(data_file: str, sce_file: str, name_file_test: str=None):
-    system_data = read_from_MATPOWER(data_file)
-    psd = PowerSystemData(system_data=system_data, sce_file=sce_file)
+def main_opf_sce(data_file: str, sce_file: str, name_file_test: str=None, chunk_size: int=None,
+                 decomposed: bool=False, n_workers: int=None, engine: str="pyomo",
+                 n_scenarios: int=None, reduction: str="kmeans", report: bool=False, debug: bool=False,
+                 profile_file: str=None, formulation: str="angle", lazy: bool=False, monitored: np.ndarray=None):
+    profiler = Profiler()
+    psd = load_system(data_file, sce_file=sce_file, profiler=profiler)
     psd.bus.define_all_areas_as_zero()  # Considered historical series has only one area
-    op = OPFSce(psd)
-    op.define_model(debug=True)
-    op.solve_model()
-    op.get_results(name_file_test=name_file_test)
+    if n_scenarios is not None:
+        full_sce = psd.sce
+        with profiler.phase("reduce_scenarios"):
+            psd.sce = full_sce.reduce(n_scenarios, method=reduction)
+    op = OPFSce(psd, chunk_size=chunk_size, decomposed=decomposed, n_workers=n_workers, engine=engine, profiler=profiler,
+                formulation=formulation, lazy=lazy, monitored=monitored)
+    with profiler.phase("define_model"):
+        op.define_model(debug=debug)
+    with profiler.phase("solve_model"):
+        op.solve_model()
+    with profiler.phase("get_results"):
+        op.get_results(name_file_test=name_file_test, report=report)
+    if profile_file is not None:
+        profiler.record_model(op.scenario_model.model if op.decomposed else op.model)
+        profiler.dump(profile_file)
+    if n_scenarios is not None:
+        op.report_reduction(full_sce)
     return op.results
 
 if __name__ == "__main__":
@@ -209,5 +379,5 @@ if __name__ == "__main__":
         name_file_test = "source/tests/results/res_OPFBasic_sce_case3.npy"
         main_opf_sce(data_file=data_file, sce_file=sce_file, name_file_test=name_file_test)
     else:
-        main_opf_sce(data_file=data_file, sce_file=sce_file)
+        main_opf_sce(data_file=data_file, sce_file=sce_file, report=True, debug=True)
         
\ No newline at end of file
@@ -0,0 +1,182 @@
+# Preventive security-constrained DC-OPF with post-contingency flow limits added lazily
+
+from opf_basic import OPFBasic
+from contingency_analysis import ContingencyAnalysis
+from basics.case_cache import load_system
+from basics.case_synthesis import branch_outages
+from basics.powersystem import PowerSystemData
+from basics.readsystems import read_chgtab_from_MATPOWER
+from basics.printing import print_centered_text, table_format, format_table
+from basics.profiling import Profiler
+import pyomo.environ as pyo
+import scipy.sparse as sp
+import numpy as np
+import io
+
+
+class OPFSCOPF(OPFBasic):
+    """Class to find the cheapest dispatch that also respects the flow limits after each listed branch outage.
+
+    The post-contingency flow of branch l after contingency c is pf[l] + sum(lodf[l, K]*pf[K]), K being the branches c
+    takes out, so a limit is a single row over the base flows instead of a copy of the network. Only the (contingency,
+    branch) pairs violated at the current dispatch get a cut, and the model is solved again until none is left.
+    """
+    def __init__(self, psd: PowerSystemData, engine: str = "pyomo", profiler: Profiler = None,
+                 formulation: str = "angle", lazy: bool = False, monitored: np.ndarray = None,
+                 contingencies: list = None) -> None:
+        super().__init__(psd, engine=engine, profiler=profiler, formulation=formulation, lazy=lazy, monitored=monitored)
+        self.ca = ContingencyAnalysis(self.psd)
+        self.ca.OVERLOAD_TOL = self.LAZY_TOL
+
+        # Contingencies list the branches taken out, one entry per circuit (N-1 of every real branch by default)
+        if contingencies is None:
+            contingencies = self.ca.outages[:, None]
+        self.contingencies = [np.asarray(outage, dtype=int) for outage in contingencies]
+        sizes = np.array([len(outage) for outage in self.contingencies], dtype=int)
+        self.single = np.flatnonzero(sizes == 1)
+        self.multiple = np.flatnonzero(sizes > 1)
+        self.islanding = np.zeros(len(self.contingencies), dtype=bool)  # Not secured, reported
+
+        # Cuts added so far: (contingency, branch) pairs
+        self.cuts = np.zeros((0, 2), dtype=int)
+        self.ctg_iterations = 0
+        self.solves = 0
+
+    def define_model(self, debug: bool = False):
+        super().define_model(debug)
+        if self.engine == "highs":
+            self.model.add_con("contingency_limit", 0)
+            return
+        self.model.con_contingency_limit = pyo.ConstraintList()
+
+    def solve_model(self) -> None:
+        # Base OPF first, with its own lazy limits, then one round of cuts per re-solve
+        super().solve_model()
+        self.solves = self.lazy_iterations
+        self.ctg_iterations = 0
+        violated = self._violated_contingencies()
+        while len(violated) > 0:
+            self._add_cuts(violated)
+            super().solve_model()
+            self.solves += self.lazy_iterations
+            self.ctg_iterations += 1
+            violated = self._violated_contingencies()
+
+    def _violated_contingencies(self) -> np.ndarray:
+        """(contingency, branch) pairs overloaded at the current dispatch and not cut yet"""
+        pf = self._extract_var("pf", self.psd.ebranch.set_all)
+        pairs = []
+        if len(self.single) > 0:
+            outcome = self.ca.screen(pf, np.array([self.contingencies[c][0] for c in self.single]))
+            self.islanding[self.single] = outcome["islanding"]
+            pairs.append(np.column_stack((self.single[outcome["overload_outage"]], outcome["overload_branch"])))
+        if len(self.multiple) > 0:
+            outcome = self.ca.screen_multiple(pf, [self.contingencies[c] for c in self.multiple])
+            self.islanding[self.multiple] = outcome["islanding"]
+            pairs.append(np.column_stack((self.multiple[outcome["overload_outage"]], outcome["overload_branch"])))
+        pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=int)
+
+        # A cut pair cannot be violated beyond the solver tolerance, skipping it guarantees the loop ends
+        ncol = self.psd.ebranch.len
+        return pairs[~np.isin(pairs[:, 0]*ncol+pairs[:, 1], self.cuts[:, 0]*ncol+self.cuts[:, 1])]
+
+    def _add_cuts(self, pairs: np.ndarray) -> None:
+        """Adds the post-contingency flow limits of the (contingency, branch) pairs to the model"""
+        pairs = pairs[np.argsort(pairs[:, 0], kind="stable")]
+        groups = np.split(pairs, np.flatnonzero(np.diff(pairs[:, 0]))+1)
+        for start in range(0, len(groups), self.ca.block_size):
+            self._add_cut_block(groups[start:start+self.ca.block_size])
+        self.cuts = np.concatenate((self.cuts, pairs))
+
+    def _add_cut_block(self, groups: list) -> None:
+        """Cuts of a block of contingencies, each group holding the pairs of one of them"""
+        outages = [np.unique(self.contingencies[group[0, 0]], return_counts=True) for group in groups]
+        columns = np.unique(np.concatenate([outage for outage, _ in outages]))
+        transfer = self.ca.ptdf.transfer_flows(columns)
+
+        # Post-contingency flows pf + transfer*z, with (I - diag(alpha)*transfer_KK) z = alpha*pf_K, as rows over pf
+        rows, cols, vals = [], [], []
+        n_cuts = 0
+        for group, (outage, circuits) in zip(groups, outages):
+            branches = group[:, 1]
+            alpha = np.minimum(circuits/self.ca.nlines[outage], 1)
+            t = transfer[:, np.searchsorted(columns, outage)]
+            lodf = t[branches] @ np.linalg.solve(np.eye(len(outage))-alpha[:, None]*t[outage], np.diag(alpha))
+            cut = n_cuts+np.arange(len(branches))
+            rows += [cut, np.repeat(cut, len(outage))]
+            cols += [branches, np.tile(outage, len(branches))]
+            vals += [np.ones(len(branches)), lodf.ravel()]
+            n_cuts += len(branches)
+        post = sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(n_cuts, self.psd.ebranch.len))
+        self._add_contingency_limits(post, self.flow_max[np.concatenate([group[:, 1] for group in groups])])
+
+    def _add_contingency_limits(self, post: sp.csr_matrix, flow_max: np.ndarray) -> None:
+        # -flow_max <= post*pf <= flow_max, written over the generation and shedding with PTDF
+        if self.engine == "highs":
+            first = len(self.model.con_idx["contingency_limit"])
+        if self.formulation == "ptdf":
+            involved = np.unique(post.indices)
+            gen_block, sl_block = self._ptdf_split(post[:, involved] @ self.ptdf.matrix(involved, self.ptdf_buses))
+            offset = post @ self.flow_offset
+            if self.engine == "highs":
+                self.model.add_con("contingency_limit", post.shape[0], lb=-flow_max+offset, ub=flow_max+offset)
+                self._add_ptdf_terms("contingency_limit", first+np.arange(post.shape[0]), gen_block, sl_block)
+                return
+            for idx in range(post.shape[0]):
+                self.model.con_contingency_limit.add((-flow_max[idx]+offset[idx], self._ptdf_inj(gen_block[idx], sl_block[idx]),
+                                                      flow_max[idx]+offset[idx]))
+            return
+
+        if self.engine == "highs":
+            self.model.add_con("contingency_limit", post.shape[0], lb=-flow_max, ub=flow_max)
+            terms = post.tocoo()
+            self.model.add_terms("contingency_limit", first+terms.row, "pf", terms.col, terms.data)
+            return
+        for idx in range(post.shape[0]):
+            terms = slice(post.indptr[idx], post.indptr[idx+1])
+            expr = sum(float(val)*self.model.pf[k] for k, val in zip(post.indices[terms].tolist(), post.data[terms]))
+            self.model.con_contingency_limit.add((-flow_max[idx], expr, flow_max[idx]))
+
+    def _extract_results(self) -> None:
+        super()._extract_results()
+        self.results["cuts"] = self.cuts
+        self.results["islanding"] = np.flatnonzero(self.islanding)
+
+    def _report(self) -> str:
+        out = io.StringIO()
+        out.write(super()._report())
+        print("\nContingencies: {}, {} islanding, {} cuts in {} solves".format(
+            len(self.contingencies), len(self.results["islanding"]), len(self.cuts), self.solves), file=out)
+        if len(self.cuts) > 0:
+            ncol = 3
+            print_centered_text("Contingency cuts", file=out, ncol=ncol)
+            print(table_format(ncol=ncol).format("Ctg", "Branch", "limit"), file=out)
+            out.write(format_table([self.cuts[:, 0]+1, self.cuts[:, 1]+1, self.flow_max[self.cuts[:, 1]]],
+                                   ["%9d", "%9d", "%9.4f"]))
+        return out.getvalue()
+
+def main_opf_scopf(data_file: str, name_file_test: str=None, engine: str="pyomo", report: bool=False,
+                   debug: bool=False, profile_file: str=None, formulation: str="angle", lazy: bool=False,
+                   monitored: np.ndarray=None, contingencies: list=None, contab_file: str=None) -> None:
+    profiler = Profiler()
+    psd = load_system(data_file, profiler=profiler)
+    if contab_file is not None:
+        # Change table rows refer to the branch rows of data_file, parallel circuits share one ebranch index
+        contingencies = branch_outages(read_chgtab_from_MATPOWER(contab_file), psd.ebranch.row_branch)
+    op = OPFSCOPF(psd, engine=engine, profiler=profiler, formulation=formulation, lazy=lazy, monitored=monitored,
+                  contingencies=contingencies)
+    with profiler.phase("define_model"):
+        op.define_model(debug=debug)
+    with profiler.phase("solve_model"):
+        op.solve_model()
+    with profiler.phase("get_results"):
+        op.get_results(name_file_test=name_file_test, report=report)
+    if profile_file is not None:
+        profiler.record_model(op.model)
+        profiler.dump(profile_file)
+    return op.results
+
+if __name__ == "__main__":
+    data_file = "source/data/matpower/case24_ieee_rts_reliability.m"
+    main_opf_scopf(data_file=data_file, engine="highs", report=True)
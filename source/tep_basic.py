@@ -1,28 +1,32 @@
 # Created in 16/03/2024 by Arthur
 
-from basics.readsystems import read_from_MATPOWER
+from basics.case_cache import load_system
+from basics.profiling import Profiler
 from basics.powersystem import PowerSystemData
 from opf_basic import OPFBasic
 import pyomo.environ as pyo
 import numpy as np
-from basics.printing import print_centered_text, int_format, float_format, table_format, pyo_extract
-import sys
+from basics.printing import print_centered_text, table_format, format_table
+import io
 
 class TEPBasic(OPFBasic):
 
-    def __init__(self, psd: PowerSystemData) -> None:
-        super().__init__(psd)
+    def __init__(self, psd: PowerSystemData, engine: str = "pyomo", profiler: Profiler = None) -> None:
+        super().__init__(psd, engine=engine, profiler=profiler)
 
         # Load Sheding cost
         self.psd.bus.sl_cost = 100*max(self.psd.xbranch.invT_cost)
     
     def define_model(self, debug: bool = False):
+        if self.engine == "highs":
+            super().define_model(debug)
+            return
         
         # Variables
         self.model.xpf = pyo.Var(self.psd.xbranch_bin.set_all, within=pyo.Reals, bounds=self._bounds_xpf)  # Power flow in new lines
         self.model.invT = pyo.Var(self.psd.xbranch_bin.set_all, within=pyo.Binary)  # Transmission investment
         
-        super().define_model(debug)
+        super().define_model()
 
         # Disjunctive power flow
         self.model.con_power_xflow_disj_pos = pyo.Constraint(self.psd.xbranch_bin.set_all, rule=self._rule_power_xflow_disj_pos)
@@ -34,17 +38,44 @@ class TEPBasic(OPFBasic):
         
         # Data file for debug
         if debug:
-            with open('source/.results/output.txt', 'w') as file:
-                self.model.pprint(ostream=file)
+            self._write_debug()
+
+    def _define_matrix_model(self) -> None:
+        super()._define_matrix_model()
+        xbranch_bin = self.psd.xbranch_bin
+
+        # Variables
+        self.model.add_var("xpf", xbranch_bin.len, lb=-xbranch_bin.flow_max, ub=xbranch_bin.flow_max)  # Power flow in new lines
+        self.model.add_var("invT", xbranch_bin.len, lb=0, ub=1, cost=xbranch_bin.invT_cost, integer=True)  # Transmission investment
+
+        # Power balance
+        self.model.add_terms("power_balance", xbranch_bin.bus_fr, "xpf", xbranch_bin.set_all, -1)
+        self.model.add_terms("power_balance", xbranch_bin.bus_to, "xpf", xbranch_bin.set_all, +1)
+
+        # Disjunctive power flow: -bigM*(1-invT) <= xpf + b_lin*(th_fr-th_to) <= bigM*(1-invT)
+        self.model.add_con("power_xflow_disj_pos", xbranch_bin.len, lb=-xbranch_bin.bigM)
+        self.model.add_con("power_xflow_disj_neg", xbranch_bin.len, ub=+xbranch_bin.bigM)
+        for con, sign in (("power_xflow_disj_pos", -1), ("power_xflow_disj_neg", +1)):
+            self.model.add_terms(con, xbranch_bin.set_all, "xpf", xbranch_bin.set_all, +1)
+            self.model.add_terms(con, xbranch_bin.set_all, "th", xbranch_bin.bus_fr, +xbranch_bin.b_lin)
+            self.model.add_terms(con, xbranch_bin.set_all, "th", xbranch_bin.bus_to, -xbranch_bin.b_lin)
+            self.model.add_terms(con, xbranch_bin.set_all, "invT", xbranch_bin.set_all, sign*xbranch_bin.bigM)
+
+        # Power flow limits: -invT*flow_max <= xpf <= invT*flow_max
+        self.model.add_con("power_xflow_pos", xbranch_bin.len, ub=0)
+        self.model.add_con("power_xflow_neg", xbranch_bin.len, lb=0)
+        for con, sign in (("power_xflow_pos", -1), ("power_xflow_neg", +1)):
+            self.model.add_terms(con, xbranch_bin.set_all, "xpf", xbranch_bin.set_all, +1)
+            self.model.add_terms(con, xbranch_bin.set_all, "invT", xbranch_bin.set_all, sign*xbranch_bin.flow_max)
 
     def _create_objective(self) -> pyo.Expression:
         return self._total_pg_cost()+self._total_sl_cost()+self._total_invT_cost()
     
     def _xpf_inj(self, b: int) -> pyo.Expression:
         xpf_inj = 0
-        for k in np.where(self.psd.xbranch_bin.bus_fr == b)[0]:
+        for k in self.psd.incidence.xbranch_bin_fr[b]:
             xpf_inj += self.model.xpf[k]
-        for k in np.where(self.psd.xbranch_bin.bus_to == b)[0]:
+        for k in self.psd.incidence.xbranch_bin_to[b]:
             xpf_inj -= self.model.xpf[k]
         return xpf_inj
     
@@ -73,46 +104,32 @@ class TEPBasic(OPFBasic):
     def _total_invT_cost(self) -> pyo.Expression:
         return sum([self.psd.xbranch_bin.invT_cost[k]*self.model.invT[k] for k in self.psd.xbranch_bin.set_all])
     
-    def get_results(self, export: bool=True,
-                    display: bool=True,
-                    file_name: str="source/.results/results.txt",
-                    name_file_test: str=None) -> None:
-        super().get_results(export=export, display=display, file_name=file_name)
-        with open(file_name, "a") as file:
-            for idx, out in enumerate([sys.stdout, file]):
-                if idx == 0 and not display:
-                    continue
-                if idx == 1 and not export:
-                    continue
-                
-                xpf, xlosses, invT = self._get_non_bin_res()
-                print("\n\n", file=out)
-                ncol = 6
-                print_centered_text("Candidate branch data", file=out, ncol=ncol)
-                print(table_format(ncol=ncol).format("Branch", "fr", "to", "pflow", "losses", "invT"), file=out)
-                for k in self.psd.xbranch.set_all:
-                    branch = int_format(k+1)
-                    fr = int_format(self.psd.xbranch.bus_fr[k]+1)
-                    to = int_format(self.psd.xbranch.bus_to[k]+1)
-                    pflow = float_format(xpf[k])
-                    losses = float_format(xlosses[k])
-                    n_invT = int_format(invT[k])
-                    print(branch + fr + to + pflow + losses + n_invT, file=out)
-
-        # Extracting results
-        self.results["xpf"] = pyo_extract(self.model.xpf, self.psd.xbranch_bin.set_all)
-        self.results["invT"] = pyo_extract(self.model.invT, self.psd.xbranch_bin.set_all)
-
-        if name_file_test is not None:
-            np.save(name_file_test, self.results)
+    def _extract_results(self) -> None:
+        super()._extract_results()
+        self.results["xpf"] = self._extract_var("xpf", self.psd.xbranch_bin.set_all)
+        self.results["invT"] = self._extract_var("invT", self.psd.xbranch_bin.set_all)
+
+    def _report(self) -> str:
+        out = io.StringIO()
+        out.write(super()._report())
+
+        xpf, xlosses, invT = self._get_non_bin_res()
+        print("\n\n", file=out)
+        ncol = 6
+        print_centered_text("Candidate branch data", file=out, ncol=ncol)
+        print(table_format(ncol=ncol).format("Branch", "fr", "to", "pflow", "losses", "invT"), file=out)
+        out.write(format_table([self.psd.xbranch.set_all+1, self.psd.xbranch.bus_fr+1, self.psd.xbranch.bus_to+1,
+                                xpf, xlosses, invT],
+                               ["%9d", "%9d", "%9d", "%9.4f", "%9.4f", "%9d"]))
+        return out.getvalue()
     
     def _get_non_bin_res(self):
         xpf = np.zeros(self.psd.xbranch.len)
         xlosses = np.zeros(self.psd.xbranch.len)
         invT = np.zeros(self.psd.xbranch.len, dtype=int)
 
-        res_xpf = pyo_extract(self.model.xpf, self.psd.xbranch_bin.set_all)
-        res_invT = pyo_extract(self.model.invT, self.psd.xbranch_bin.set_all)
+        res_xpf = self.results["xpf"]
+        res_invT = self.results["invT"]
 
         idx = 0
         for k in self.psd.xbranch.set_all:
@@ -123,13 +140,20 @@ class TEPBasic(OPFBasic):
         
         return xpf, xlosses, invT
 
-def main_tep_basic(data_file: str, name_file_test: str=None):
-    system_data = read_from_MATPOWER(data_file)
-    psd = PowerSystemData(system_data=system_data)
-    op = TEPBasic(psd)
-    op.define_model(debug=True)
-    op.solve_model()
-    op.get_results(name_file_test=name_file_test)
+def main_tep_basic(data_file: str, name_file_test: str=None, engine: str="pyomo", report: bool=False,
+                   debug: bool=False, profile_file: str=None):
+    profiler = Profiler()
+    psd = load_system(data_file, profiler=profiler)
+    op = TEPBasic(psd, engine=engine, profiler=profiler)
+    with profiler.phase("define_model"):
+        op.define_model(debug=debug)
+    with profiler.phase("solve_model"):
+        op.solve_model()
+    with profiler.phase("get_results"):
+        op.get_results(name_file_test=name_file_test, report=report)
+    if profile_file is not None:
+        profiler.record_model(op.model)
+        profiler.dump(profile_file)
     return op.results
 
 if __name__ == "__main__":
@@ -140,5 +164,5 @@ if __name__ == "__main__":
         name_file_test = "source/tests/results/res_TEPBasic_case3.npy"
         main_tep_basic(data_file=data_file, name_file_test=name_file_test)
     else:
-        main_tep_basic(data_file=data_file)
+        main_tep_basic(data_file=data_file, report=True, debug=True)
         
\ No newline at end of file
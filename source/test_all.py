@@ -1,10 +1,27 @@
 import unittest
 import numpy as np
-from opf_basic import main_opf_basic
-from opf_basic_losses import main_opf_basic_losses
+from opf_basic import main_opf_basic, OPFBasic
+from opf_basic_losses import main_opf_basic_losses, OPFBasicLoss
 from opf_sce import main_opf_sce
 from tep_basic import main_tep_basic
 from opf_monte_carlo import main_opf_monte_carlo
+from contingency_analysis import main_contingency_analysis, ContingencyAnalysis
+from opf_scopf import main_opf_scopf, OPFSCOPF
+from basics.readsystems import read_from_MATPOWER, read_from_ANAREDE, read_chgtab_from_MATPOWER
+from basics.case_synthesis import synthesize_case, synthesize_contingencies
+from basics import case_cache
+from basics.case_cache import load_system, case_key
+from basics.powersystem import ScenariosData
+from basics.scenario_store import convert_csv
+from basics.scenario_reduction import reduce_scenarios
+from basics.sample_log import SampleLogReader
+from basics.sensitivities import PTDF
+from benchmark import run_case, compare
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
 
 class TestAll(unittest.TestCase):
@@ -13,31 +30,429 @@ class TestAll(unittest.TestCase):
         results = np.load("source/tests/results/res_OPFBasic_case3.npy",allow_pickle=True).tolist()
         numpy_assert_almost_dict_values(main_opf_basic(data_file=data_file), results)
 
+
+    def test_OPFBasic_highs(self):
+        data_file = "source/tests/data/MATPOWER/case3_Basics.m"
+        results = np.load("source/tests/results/res_OPFBasic_case3.npy",allow_pickle=True).tolist()
+        numpy_assert_almost_dict_values(main_opf_basic(data_file=data_file, engine="highs"), results)
     
+    def test_OPFBasic_ptdf(self):
+        data_file = "source/tests/data/MATPOWER/case3_Basics.m"
+        results = np.load("source/tests/results/res_OPFBasic_case3.npy",allow_pickle=True).tolist()
+        for engine in ("pyomo", "highs"):
+            numpy_assert_almost_dict_values(main_opf_basic(data_file=data_file, engine=engine, formulation="ptdf"), results)
+
+        # case24 has equal-cost units, so only the optimal cost is unique
+        for engine in ("pyomo", "highs"):
+            objective = dict()
+            for formulation in ("angle", "ptdf"):
+                op = OPFBasic(load_system("source/tests/data/MATPOWER/case24_ieee_rts_reliability.m"), engine=engine, formulation=formulation)
+                op.define_model()
+                op.solve_model()
+                objective[formulation] = op._objective_value()
+            np.testing.assert_almost_equal(objective["ptdf"], objective["angle"])
+
+    def test_OPFBasic_lazy(self):
+        # Tighter limits on case24 make some of them bind
+        data_file = "source/tests/data/MATPOWER/case24_ieee_rts_reliability.m"
+        for formulation in ("angle", "ptdf"):
+            for engine in ("pyomo", "highs"):
+                ops = dict()
+                # "partial": a seed without the lazy check still enforces every limit
+                for lazy in (False, True, "seed", "partial"):
+                    psd = load_system(data_file)
+                    psd.ebranch.flow_max = 0.4*psd.ebranch.flow_max
+                    if lazy == "seed":
+                        seed = ops[True].results["monitored"]
+                    else:
+                        seed = [0] if lazy == "partial" else None
+                    ops[lazy] = OPFBasic(psd, engine=engine, formulation=formulation, lazy=lazy in (True, "seed"),
+                                         monitored=seed)
+                    ops[lazy].define_model()
+                    ops[lazy].solve_model()
+                    ops[lazy].get_results(export=False)
+                self.assertGreater(ops[True].lazy_iterations, 1)
+                self.assertLess(len(ops[True].results["monitored"]), psd.ebranch.len)
+                np.testing.assert_almost_equal(ops[True]._objective_value(), ops[False]._objective_value())
+                np.testing.assert_almost_equal(ops[True].results["sl"], ops[False].results["sl"])
+                self.assertEqual(ops["seed"].lazy_iterations, 1)
+                np.testing.assert_almost_equal(ops["seed"]._objective_value(), ops[False]._objective_value())
+                np.testing.assert_almost_equal(ops["partial"]._objective_value(), ops[False]._objective_value())
+                self.assertLessEqual(np.max(np.abs(ops["partial"].results["pf"])-psd.ebranch.flow_max), 1e-6)
+
+    def test_get_results_files(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            psd = load_system("source/tests/data/MATPOWER/case3_Basics.m")
+            op = OPFBasic(psd, engine="highs")
+            op.define_model()
+            op.solve_model()
+            op.get_results(display=False, file_name=os.path.join(tmp, "results.txt"), results_file=os.path.join(tmp, "results.npz"))
+            self.assertFalse(os.path.exists(os.path.join(tmp, "results.txt")))
+            with np.load(os.path.join(tmp, "results.npz")) as saved:
+                numpy_assert_almost_dict_values(dict(saved), op.results)
+
+            op.get_results(display=False, file_name=os.path.join(tmp, "results.txt"), results_file=os.path.join(tmp, "results.csv"), report=True)
+            np.testing.assert_almost_equal(np.loadtxt(os.path.join(tmp, "results_pf.csv"), delimiter=","), op.results["pf"])
+            with open(os.path.join(tmp, "results.txt")) as file:
+                self.assertIn("Existent branch data", file.read())
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_profile_file(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            for engine in ("pyomo", "highs"):
+                profile_file = os.path.join(tmp, "profile_{}.json".format(engine))
+                main_opf_basic(data_file="source/tests/data/MATPOWER/case3_Basics.m", engine=engine, profile_file=profile_file)
+                with open(profile_file) as file:
+                    profile = json.load(file)
+                phases = {phase["name"]: phase for phase in profile["phases"]}
+                for name in ("define_model", "solve_model/write", "solve_model/solve", "solve_model/load", "get_results"):
+                    self.assertEqual(phases[name]["calls"], 1)
+                self.assertNotIn("define_model/debug_output", phases)
+                self.assertEqual(profile["model"]["constraints"], 8)
+                if engine == "pyomo":
+                    self.assertIn("define_model/con_power_balance", phases)
+        finally:
+            shutil.rmtree(tmp)
+
     def test_OPFBasicLoss(self):
         data_file = "source/tests/data/MATPOWER/case3_Basics.m"
         results = np.load("source/tests/results/res_OPFBasic_loss_case3.npy",allow_pickle=True).tolist()
         numpy_assert_almost_dict_values(main_opf_basic_losses(data_file=data_file), results)
 
+    def test_OPFBasicLoss_highs(self):
+        data_file = "source/tests/data/MATPOWER/case3_Basics.m"
+        results = np.load("source/tests/results/res_OPFBasic_loss_case3.npy",allow_pickle=True).tolist()
+        numpy_assert_almost_dict_values(main_opf_basic_losses(data_file=data_file, engine="highs"), results)
+
     
+    def test_OPFBasicLoss_pwl(self):
+        losses = dict()
+        for engine in ("pyomo", "highs"):
+            for method in ("iterative", "pwl"):
+                op = OPFBasicLoss(load_system("source/tests/data/MATPOWER/case3_Basics.m"), engine=engine, method=method, n_segments=20)
+                op.define_model()
+                op.solve_model()
+                losses[engine, method] = op.losses
+        np.testing.assert_almost_equal(losses["pyomo", "pwl"], losses["highs", "pwl"])
+        np.testing.assert_allclose(losses["pyomo", "pwl"], losses["pyomo", "iterative"], rtol=1e-2)
+
     def test_OPFSce(self):
         data_file = "source/tests/data/MATPOWER/case3_sce.m"
         results = np.load("source/tests/results/res_OPFBasic_sce_case3.npy",allow_pickle=True).tolist()
         sce_file = "source/tests/data/scenarios/load_test.csv"
         numpy_assert_almost_dict_values(main_opf_sce(data_file=data_file, sce_file=sce_file), results)
 
+    def test_OPFSce_chunks(self):
+        data_file = "source/tests/data/MATPOWER/case3_sce.m"
+        results = np.load("source/tests/results/res_OPFBasic_sce_case3.npy",allow_pickle=True).tolist()
+        sce_file = "source/tests/data/scenarios/load_test.csv"
+        numpy_assert_almost_dict_values(main_opf_sce(data_file=data_file, sce_file=sce_file, chunk_size=1), results)
+
+    def test_OPFSce_decomposed(self):
+        data_file = "source/tests/data/MATPOWER/case3_sce.m"
+        results = np.load("source/tests/results/res_OPFBasic_sce_case3.npy",allow_pickle=True).tolist()
+        sce_file = "source/tests/data/scenarios/load_test.csv"
+        numpy_assert_almost_dict_values(main_opf_sce(data_file=data_file, sce_file=sce_file, decomposed=True, engine="highs"), results)
+        numpy_assert_almost_dict_values(main_opf_sce(data_file=data_file, sce_file=sce_file, n_workers=2, chunk_size=1), results)
+        numpy_assert_almost_dict_values(main_opf_sce(data_file=data_file, sce_file=sce_file, decomposed=True, formulation="ptdf"), results)
+
     
     def test_TEPBasic(self):
         data_file = "source/tests/data/MATPOWER/case3_Basics.m"
         results = np.load("source/tests/results/res_TEPBasic_case3.npy",allow_pickle=True).tolist()
         numpy_assert_almost_dict_values(main_tep_basic(data_file=data_file), results)
 
+    def test_TEPBasic_highs(self):
+        # Candidate circuits of a corridor are interchangeable, so investments are compared per corridor
+        data_file = "source/tests/data/MATPOWER/case3_Basics.m"
+        results = np.load("source/tests/results/res_TEPBasic_case3.npy",allow_pickle=True).tolist()
+        results_highs = main_tep_basic(data_file=data_file, engine="highs")
+        for res in [results, results_highs]:
+            res["xpf"] = res["xpf"].reshape(-1, 3).sum(axis=1)
+            res["invT"] = res["invT"].reshape(-1, 3).sum(axis=1)
+        numpy_assert_almost_dict_values(results_highs, results)
+
     # @unittest.skip("Under implementation")
     def test_OPFMonteCarlo(self):
         data_file = "source/tests/data/MATPOWER/case24_ieee_rts_reliability.m"
         results = np.load("source/tests/results/res_OPFMonteCarlo_case24_ieee_rts_reliability.npy",allow_pickle=True).tolist()
         numpy_assert_almost_dict_values(main_opf_monte_carlo(data_file=data_file), results)
 
+    def test_OPFMonteCarlo_ptdf(self):
+        data_file = "source/tests/data/MATPOWER/case24_ieee_rts_reliability.m"
+        results = np.load("source/tests/results/res_OPFMonteCarlo_case24_ieee_rts_reliability.npy",allow_pickle=True).tolist()
+        # Lazy mode appends limit rows after the ones replaced on each topology change
+        for lazy in (False, True):
+            results_ptdf = main_opf_monte_carlo(data_file=data_file, engine="highs", formulation="ptdf", lazy=lazy)
+            np.testing.assert_almost_equal(results_ptdf["LOLP"], results["LOLP"])
+            np.testing.assert_almost_equal(results_ptdf["EPNS"], results["EPNS"])
+
+    def test_OPFMonteCarlo_parallel(self):
+        # For a fixed seed and batch layout, results do not depend on the number of workers
+        data_file = "source/tests/data/MATPOWER/case24_ieee_rts_reliability.m"
+        results = main_opf_monte_carlo(data_file=data_file, engine="highs", n_workers=1)
+        numpy_assert_almost_dict_values(main_opf_monte_carlo(data_file=data_file, engine="highs", n_workers=2), results)
+
+        # Serial blocks also report the base case, whose dispatch is only unique in cost
+        results_blocks = main_opf_monte_carlo(data_file=data_file, engine="highs", batch_size=1000)
+        cost = load_system(data_file).gen.cost
+        np.testing.assert_almost_equal(cost @ results_blocks["pg"], cost @ results["pg"])
+        np.testing.assert_almost_equal(results_blocks["sl"], results["sl"])
+
+    def test_OPFMonteCarlo_sampling(self):
+        # Weighted estimates stay within a few beta of the crude estimate
+        data_file = "source/tests/data/MATPOWER/case24_ieee_rts_reliability.m"
+        results = main_opf_monte_carlo(data_file=data_file, engine="highs", batch_size=1000)
+        for sampling in ["ce", "lhs", "sobol"]:
+            results_sampling = main_opf_monte_carlo(data_file=data_file, engine="highs", sampling=sampling)
+            np.testing.assert_allclose(results_sampling["LOLP"], results["LOLP"], rtol=0.15)
+            np.testing.assert_allclose(results_sampling["EPNS"], results["EPNS"], rtol=0.15)
+
+
+    def test_sample_log(self):
+        # Indexes recomputed from the log match the run, and re-weighting to the same FORs changes nothing
+        tmp = tempfile.mkdtemp()
+        try:
+            data_file = "source/tests/data/MATPOWER/case24_ieee_rts_reliability.m"
+            log_file = os.path.join(tmp, "samples.log")
+            results = main_opf_monte_carlo(data_file=data_file, engine="highs", sampling="ce", log_file=log_file)
+            reader = SampleLogReader(log_file)
+            indexes = reader.indexes()
+            np.testing.assert_almost_equal(indexes["LOLP"], results["LOLP"])
+            np.testing.assert_almost_equal(indexes["EPNS"], results["EPNS"])
+            np.testing.assert_almost_equal(reader.indexes(gen_FOR=reader.sampler.gen_FOR)["EPNS"], results["EPNS"])
+            np.testing.assert_almost_equal(sum(lolp for lolp, _ in reader.by_outage_order().values()), results["LOLP"])
+            np.testing.assert_almost_equal(reader.shed_distribution(np.array([1e-9, np.inf])).sum(), results["LOLP"])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_benchmark(self):
+        runs = {"runs": [run_case("case5", model, engine="highs", n_samples=20) for model in ("OPFBasic", "TEPBasic", "OPFMonteCarlo")]}
+        self.assertEqual([run["buses"] for run in runs["runs"]], [5, 5, 5])
+        self.assertAlmostEqual(runs["runs"][0]["objective"], 174.80, places=2)
+        self.assertEqual(runs["runs"][1]["size"]["binaries"], 5)
+        self.assertEqual(compare(runs, runs), [])
+
+        slower = json.loads(json.dumps(runs))
+        slower["runs"][0]["times"]["solve_model"] += 1
+        self.assertEqual([regression[3] for regression in compare(slower, runs)], ["solve_model"])
+
+        # Runs that are not solved to optimality raise, so run_suite records them as errors
+        def negative_load(system_data, **kwds):
+            adapted = synthesize_case(system_data, **kwds)
+            adapted["bus"][1, 2] = -10
+            return adapted
+        with mock.patch("benchmark.synthesize_case", negative_load):
+            self.assertRaises(RuntimeError, run_case, "case5", "OPFBasicLoss", engine="highs")
+        system_data = synthesize_case(read_from_MATPOWER("misc/dataMATPOWER_original/case300.m"))
+        self.assertTrue(np.all(system_data["bus"][:, 2] >= 0))
+        np.testing.assert_equal(system_data["bus"][:, 8], 0)
+
+    def test_contingency_analysis(self):
+        data_file = "source/data/matpower/case24_ieee_rts_reliability.m"
+        outage_sets = [[0, 1], [24], [24, 24], [10, 22]]
+        results = main_contingency_analysis(data_file=data_file, outage_sets=outage_sets, engine="highs")
+        psd = load_system(data_file)
+        ca = ContingencyAnalysis(psd)
+        ebranch = psd.ebranch
+
+        # Max loading against a new flow solution with the outaged circuits taken out of b_lin
+        def max_loading(outage):
+            branches, circuits = np.unique(outage, return_counts=True)
+            kept = 1-circuits/ca.nlines[branches]
+            b_lin = np.copy(ebranch.b_lin)
+            b_lin[branches] *= kept
+            flow_max = np.copy(ebranch.flow_max)
+            flow_max[branches] *= kept
+            ptdf = PTDF(ebranch.bus_fr, ebranch.bus_to, b_lin, psd.bus.len)
+            post = ptdf.flows(ptdf.incidence.T @ results["pf"])[ca.checked]
+            return np.max(np.divide(np.abs(post), flow_max[ca.checked], out=np.zeros(len(post)), where=flow_max[ca.checked] > 0))
+
+        single = results["single"]
+        np.testing.assert_equal(np.flatnonzero(single["islanding"]), [10])
+        np.testing.assert_equal(single["islanded_buses"][10], [6])
+        np.testing.assert_equal(ca.islanded_buses(np.array([10])), [6])
+        for idx, k in enumerate(single["outage"]):
+            if not single["islanding"][idx]:
+                np.testing.assert_almost_equal(single["max_loading"][idx], max_loading([k]))
+
+        multiple = results["multiple"]
+        np.testing.assert_equal(multiple["islanding"], [False, False, False, True])
+        np.testing.assert_equal(multiple["islanded_buses"][3], [6])
+        for idx in range(3):
+            np.testing.assert_almost_equal(multiple["max_loading"][idx], max_loading(outage_sets[idx]))
+
+    def test_OPFSCOPF(self):
+        # Tighter limits on case24 make post-contingency limits bind; branch 11 islands bus 7 and cannot be secured
+        data_file = "source/tests/data/MATPOWER/case24_ieee_rts_reliability.m"
+        psd = load_system(data_file)
+        contingencies = [[k] for k in range(psd.ebranch.len)]+[[24, 24], [0, 1], [10, 22]]
+        for formulation in ("angle", "ptdf"):
+            for engine in ("pyomo", "highs"):
+                psd = load_system(data_file)
+                psd.ebranch.flow_max = 0.6*psd.ebranch.flow_max
+                op = OPFSCOPF(psd, engine=engine, formulation=formulation, lazy=True, contingencies=contingencies)
+                op.define_model()
+                op.solve_model()
+                op.get_results(export=False)
+                # Same cost as with the cuts of every pair added up front
+                np.testing.assert_almost_equal(op._objective_value(), 694.1337797, decimal=5)
+                np.testing.assert_equal(op.results["islanding"], [10, len(contingencies)-1])
+                self.assertGreater(op.ctg_iterations, 0)
+                self.assertLess(len(op.cuts), len(contingencies)*psd.ebranch.len/10)
+
+                # Secure against every listed outage that keeps the network connected
+                ca = ContingencyAnalysis(psd)
+                single = ca.screen(op.results["pf"])
+                multiple = ca.screen_multiple(op.results["pf"], contingencies[-3:-1])
+                self.assertLessEqual(np.nanmax(single["max_loading"]), 1+1e-6)
+                self.assertLessEqual(np.nanmax(multiple["max_loading"]), 1+1e-6)
+
+        # With the original limits, N-1 security comes at no extra cost
+        results = main_opf_scopf(data_file=data_file, engine="highs")
+        np.testing.assert_almost_equal(np.sum(results["sl"]), 0)
+
+        # Contab rows are branch rows: rows 25 and 26 are the two circuits of branch 24, so later rows shift by one
+        tmp = tempfile.mkdtemp()
+        try:
+            contab_file = os.path.join(tmp, "contab_case24.m")
+            with open(contab_file, "w") as file:
+                file.write("chgtab = [\n" + "".join("\t{}\t0\tCT_TBRCH\t{}\tBR_STATUS\tCT_REP\t0;\n".format(label, row)
+                                                   for label, row in [(1, 25), (1, 26), (2, 26), (3, 27), (4, 1), (4, 2),
+                                                                      (5, 11), (5, 23)]) + "];\n")
+            expected = [[24, 24], [24], [25], [0, 1], [10, 22]]
+            system_data = read_from_MATPOWER(data_file)
+            psd = load_system(data_file)
+            contingencies = synthesize_contingencies(read_chgtab_from_MATPOWER(contab_file), system_data, psd.ebranch)
+            self.assertEqual([outage.tolist() for outage in contingencies], expected)
+            objectives = []
+            for contingencies in (contingencies, expected):
+                psd = load_system(data_file)
+                psd.ebranch.flow_max = 0.6*psd.ebranch.flow_max
+                op = OPFSCOPF(psd, engine="highs", contingencies=contingencies)
+                op.define_model()
+                op.solve_model()
+                objectives.append(op._objective_value())
+            self.assertAlmostEqual(objectives[0], objectives[1], places=6)
+            results = main_opf_scopf(data_file=data_file, engine="highs", contab_file=contab_file)
+            np.testing.assert_equal(results["islanding"], [4])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_read_chgtab_from_MATPOWER(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            contab_file = os.path.join(tmp, "contab_case5.m")
+            with open(contab_file, "w") as file:
+                file.write("function chgtab = contab_case5\ndefine_constants;\n%\tlabel\tprob\ttable\trow\tcol\tchgtype\tnewval\n"
+                           "chgtab = [\n\t1\t0.1\tCT_TBRCH\t2\tBR_STATUS\tCT_REP\t0;\n"
+                           "\t2\t0\tCT_TBRCH\t4\tBR_STATUS\tCT_REP\t0;\n\t2\t0\tCT_TBRCH\t6\tBR_STATUS\tCT_REP\t0;\n"
+                           "\t3\t0\tCT_TGEN\t1\tGEN_STATUS\tCT_REP\t0;\t% Generator outage\n"
+                           "\t4\t0\tCT_TBRCH\t5\tBR_STATUS\tCT_REP\t0;\n];\n")
+            chgtab = read_chgtab_from_MATPOWER(contab_file)
+        finally:
+            shutil.rmtree(tmp)
+        np.testing.assert_equal(chgtab[0], [1, 0.1, 3, 2, 11, 1, 0])
+        np.testing.assert_equal(chgtab[3], [3, 0, 2, 1, 8, 1, 0])
+
+        # Branch 4 is out of service, so synthesize_case drops it and renumbers the rows after it
+        system_data = read_from_MATPOWER("misc/dataMATPOWER_original/case5.m")
+        system_data["branch"][3, 10] = 0
+        contingencies = synthesize_contingencies(chgtab, system_data)
+        np.testing.assert_equal([rows.tolist() for rows in contingencies], [[1], [4], [3]])
+
+    def test_read_from_MATPOWER(self):
+        system_data = read_from_MATPOWER("source/tests/data/MATPOWER/case3_sce.m")
+        self.assertEqual(system_data["baseMVA"], 100)
+        self.assertEqual(system_data["bus"].shape, (4, 13))
+        self.assertEqual(system_data["gencost"].shape, (4, 6))
+        self.assertEqual(system_data["c02tax"].shape, (1, 1))
+
+    def test_read_from_ANAREDE(self):
+        system_data = read_from_ANAREDE("source/data/anarede/SIST5BARRAS.PWF")
+        np.testing.assert_equal(system_data["bus_number"], [1, 2, 10, 20, 30])
+        np.testing.assert_equal(system_data["bus"][:, 1], [3, 2, 1, 1, 1])
+        np.testing.assert_almost_equal(system_data["bus"][:, 7], [1.017, 1.025, 1.006, 1.014, 1.0])
+        np.testing.assert_almost_equal(system_data["bus"][:, 2], [0, 0, 0, 0, 120])
+        np.testing.assert_equal(system_data["branch"][:, :2], [[1, 3], [2, 4], [3, 4], [3, 4], [3, 5], [3, 5]])
+        np.testing.assert_almost_equal(system_data["branch"][:, 3], [0.2, 0.07, 0.14, 0.14, 0.18, 0.18])
+        np.testing.assert_almost_equal(system_data["branch"][:, 8], [0, 0, 1.02, 0.9, 0, 0])
+        psd = load_system("source/data/anarede/SIST5BARRAS.PWF")
+        np.testing.assert_equal(psd.bus.area, [1, 1, 1, 1, 1])
+
+    def test_load_system(self):
+        # Bundles are reused while the file is unchanged and ignored once it changes
+        tmp = tempfile.mkdtemp()
+        try:
+            data_file = os.path.join(tmp, "case3.m")
+            shutil.copy("source/tests/data/MATPOWER/case3_Basics.m", data_file)
+            psd = load_system(data_file, cache_dir=tmp)
+            psd_cached = load_system(data_file, cache_dir=tmp)
+            np.testing.assert_equal(psd_cached.bus.pd_max, psd.bus.pd_max)
+            np.testing.assert_equal(psd_cached.incidence.gen.indptr, psd.incidence.gen.indptr)
+
+            with open(data_file) as file:
+                content = file.read()
+            with open(data_file, "w") as file:
+                file.write(content.replace("2\t1\t100", "2\t1\t150"))
+            np.testing.assert_equal(load_system(data_file, cache_dir=tmp).bus.pd_max, [0, 1.5, 1, 1])
+
+            # A change to the code behind the stored objects makes the bundles stale too
+            key = case_key(data_file, 100, 4*np.pi)
+            with mock.patch.object(case_cache, "layout_fingerprint", return_value="changed"):
+                self.assertNotEqual(case_key(data_file, 100, 4*np.pi), key)
+
+            # Bundles keep a reference to the scenario store, which is mapped again on load
+            data_file = "source/tests/data/MATPOWER/case3_sce.m"
+            sce_file = "source/tests/data/scenarios/load_test.csv"
+            psd = load_system(data_file, sce_file=sce_file, cache_dir=tmp)
+            psd_cached = load_system(data_file, sce_file=sce_file, cache_dir=tmp)
+            self.assertEqual(psd_cached.sce.store_file, psd.sce.store_file)
+            self.assertIsInstance(psd_cached.sce.data, np.memmap)
+            np.testing.assert_equal(psd_cached.sce.data, psd.sce.data)
+            with open(os.path.join(tmp, case_key(data_file, 100, 4*np.pi, sce_file), "manifest.json")) as file:
+                manifest = json.load(file)
+            self.assertNotIn("data", manifest["content"]["dict"]["psd"]["attrs"]["sce"]["attrs"])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_ScenariosData(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            sce_file = "source/tests/data/scenarios/load_test.csv"
+            sce = ScenariosData(sce_file, store_dir=tmp)
+            np.testing.assert_equal(sce.data, np.genfromtxt(sce_file, delimiter=","))
+            self.assertEqual(sce.weight_col, 2)
+            self.assertEqual(ScenariosData(sce_file, store_dir=tmp).store_file, sce.store_file)
+            windows = list(sce.windows(1))
+            np.testing.assert_equal([obs for obs, _ in windows], [[0], [1]])
+            np.testing.assert_equal(np.vstack([data for _, data in windows]), sce.data)
+
+            # Failed conversions leave nothing next to the stores
+            store_dir = os.path.join(tmp, "stores")
+            for name, content in (("ragged.csv", "1,2,1\n1,2\n"), ("empty.csv", "\n"), ("text.csv", "a,b,c\n")):
+                with open(os.path.join(tmp, name), "w") as file:
+                    file.write(content)
+                self.assertRaises(ValueError, convert_csv, os.path.join(tmp, name), os.path.join(store_dir, name + ".sce"))
+            self.assertRaises(OSError, convert_csv, os.path.join(tmp, "missing.csv"), os.path.join(store_dir, "missing.sce"))
+            self.assertEqual(os.listdir(store_dir), [])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_reduce_scenarios(self):
+        data = np.genfromtxt("source/data/scenarios/mISODATA_demand-2wind.csv", delimiter=",")
+        for method in ["kmeans", "kmedoids", "forward"]:
+            reduced, labels = reduce_scenarios(data, 10, method=method)
+            self.assertEqual(reduced.shape, (10, data.shape[1]))
+            np.testing.assert_almost_equal(reduced[:, -1].sum(), data[:, -1].sum())
+            np.testing.assert_almost_equal(reduced[:, -1], np.bincount(labels, weights=data[:, -1], minlength=10))
+            if method != "kmeans":
+                # Representatives are observations
+                self.assertTrue(all(np.any(np.all(data[:, :-1] == row, axis=1)) for row in reduced[:, :-1]))
+        np.testing.assert_equal(np.sort(reduce_scenarios(data, len(data), method="forward")[0], axis=0), np.sort(data, axis=0))
         
 def dic_to_keys_values(dic):
     keys, values = list(dic.keys()), list(dic.values())